@@ -0,0 +1,376 @@
+"""Times the compiler and the generated parsers on generated grammars and inputs of increasing size.
+
+Results are written as JSON, so runs on different commits can be compared:
+
+    $ python benchmarks/run_benchmarks.py -o before.json
+    $ git checkout my-branch
+    $ python benchmarks/run_benchmarks.py -o after.json --compare before.json
+
+The same works for comparing the JavaScript backends, by passing --bytecode to one of the runs.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Tuple
+
+# Add ../langlang to the path so the benchmarks can find all the things.
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'langlang')))
+
+from parsing.tokenizer import tokenize
+from parsing.ll_parser import parse_file
+from parsing import syntax_tree_utilities
+from parsing.optimizer import optimize
+from assemblers import javascript, python
+
+# The generated parsers recurse once per nested expression or list item.
+sys.setrecursionlimit(100000)
+
+# Appended to the generated JavaScript. Prints the best lex and parse times over several runs, and
+# the best times for an incremental parse and for reparsing it after typing a space near the start
+# or the end.
+JS_HARNESS = '''
+const fs = require('fs');
+const input = fs.readFileSync(process.argv[2], 'utf8');
+const repeat = parseInt(process.argv[3]);
+const edits = { reparse_start: parseInt(process.argv[4]), reparse_end: parseInt(process.argv[5]) };
+const entrypoint = "%s";
+let best = { lex: Infinity, parse: Infinity, incremental: Infinity, reparse_start: Infinity, reparse_end: Infinity };
+for (let i = 0; i < repeat; i++) {
+    let start = process.hrtime.bigint();
+    let parser = new Parser(input);
+    let lexed = process.hrtime.bigint();
+    parser.__consume_all(entrypoint);
+    let parsed = process.hrtime.bigint();
+    best.lex = Math.min(best.lex, Number(lexed - start) / 1e6);
+    best.parse = Math.min(best.parse, Number(parsed - lexed) / 1e6);
+
+    start = process.hrtime.bigint();
+    new IncrementalParser(input).__parse(entrypoint);
+    best.incremental = Math.min(best.incremental, Number(process.hrtime.bigint() - start) / 1e6);
+
+    // A tree can only be reparsed once, so each edit gets a fresh one.
+    for (let name in edits) {
+        let tree = new IncrementalParser(input).__parse(entrypoint);
+        start = process.hrtime.bigint();
+        tree.__reparse({ offset: edits[name], deleted: 0, inserted: ' ' }).__parse(entrypoint);
+        best[name] = Math.min(best[name], Number(process.hrtime.bigint() - start) / 1e6);
+    }
+}
+console.log(JSON.stringify(best));
+'''
+
+# Grammars end in a right-recursive list, since langlang has no repetition operator.
+EXPRESSION_GRAMMAR = '''
+number :: r`[0-9]+`
+mul :: [number: left] peek {
+    case `*` => `*` [mul: right] as struct Mul { left: left, right: right }
+    case _ => left
+}
+export add :: [mul: left] peek {
+    case `+` => `+` [add: right] as struct Add { left: left, right: right }
+    case _ => left
+}
+'''
+
+LIST_GRAMMAR = '''
+item :: r`[a-z0-9]+`
+export list :: [item: head] peek {
+    case `,` => `,` [list: tail] as struct List { head: head, tail: tail }
+    case _ => head
+}
+'''
+
+
+def deep_expression(size: int) -> Tuple[str, str, str]:
+    # Alternating operators, so the result nests through both rules.
+    return EXPRESSION_GRAMMAR, 'add', ' '.join(f'{i} {"+*"[i % 2]}' for i in range(size)) + ' 0'
+
+
+def long_list(size: int) -> Tuple[str, str, str]:
+    return LIST_GRAMMAR, 'list', ', '.join(f'item{i}' for i in range(size))
+
+
+def commented_list(size: int) -> Tuple[str, str, str]:
+    # Mostly indentation and comments, which are skipped before any token is tried.
+    grammar = 'skip r`#[^\\n]*`\n' + LIST_GRAMMAR
+    return grammar, 'list', ',\n'.join(f'    # Item number {i}.\n        item{i}' for i in range(size))
+
+
+def large_document(size: int) -> Tuple[str, str, str]:
+    # Big enough that work proportional to the whole document shows up in the reparse timings, but
+    # small enough that the list's recursion fits on node's stack.
+    return commented_list(size)
+
+
+def statement_list(statement_rule: str) -> str:
+    return f'''
+export program :: [{statement_rule}: first] peek {{
+    case `;` => `;` [program: rest] as struct Statements {{ first: first, rest: rest }}
+    case _ => first
+}}
+'''
+
+
+def keyword(i: int) -> str:
+    # Tokens match the first literal that fits, so no keyword can be a prefix of another.
+    return ''.join('abcdefghij'[int(digit)] for digit in str(i)) + 'kw'
+
+
+def many_keywords(size: int) -> Tuple[str, str, str]:
+    # Tokens are tried in order, so every keyword in the input is checked against all of them.
+    keywords = [keyword(i) for i in range(size)]
+    cases = '\n'.join(f'    case `{k}` => `{k}` [name: n] as struct Keyword{i} {{ name: n }}'
+        for i, k in enumerate(keywords))
+    grammar = (
+        f'name :: r`[A-Z_]+`\n'
+        f'statement :: peek {{\n{cases}\n}}\n'
+        f'{statement_list("statement")}'
+    )
+    source = '; '.join(f'{keywords[-1]} NAME_{"ABCDEFGHIJKLMNOPQRSTUVWXYZ"[i % 26]}' for i in range(200))
+    return grammar, 'program', source
+
+
+def peek_fanout(size: int) -> Tuple[str, str, str]:
+    # Every case starts with the same token, so each one has to be speculated past it.
+    cases = '\n'.join(f'    case `(` `{keyword(i)}` => `(` `{keyword(i)}` `)`' for i in range(size))
+    grammar = (
+        f'statement :: peek {{\n{cases}\n}}\n'
+        f'{statement_list("statement")}'
+    )
+    source = '; '.join(f'( {keyword(size - 1)} )' for i in range(200))
+    return grammar, 'program', source
+
+
+def many_structs(size: int) -> Tuple[str, str, str]:
+    # Every rule builds a struct, so typing the grammar makes and compares thousands of struct types.
+    rules = '\n'.join(
+        f'struct{i} :: `{keyword(i)}` [name: first] [name: second] '
+        f'as struct Node{i} {{ first: first, second: second }}'
+        for i in range(size))
+    cases = '\n'.join(f'    case `{keyword(i)}` => struct{i}' for i in range(size))
+    grammar = (
+        f'name :: r`[A-Z_]+`\n'
+        f'{rules}\n'
+        f'statement :: peek {{\n{cases}\n}}\n'
+        f'{statement_list("statement")}'
+    )
+    # Only the first keyword, so lexing and parsing stay cheap next to compiling.
+    source = '; '.join(f'{keyword(0)} A B' for i in range(200))
+    return grammar, 'program', source
+
+
+def many_rules(size: int) -> Tuple[str, str, str]:
+    # Thousands of rules, each calling the one defined after it, so typing them has to follow a long
+    # chain of forward references.
+    rules = '\n'.join(f'rule{i} :: [name: n] rule{i + 1} as struct Rule{i} {{ name: n }}'
+        for i in range(size))
+    grammar = (
+        f'{statement_list("rule0")}'
+        f'{rules}\n'
+        f'rule{size} :: `;`\n'
+        f'name :: r`[A-Z_]+`\n'
+    )
+    source = ' '.join(f'NAME_{"ABCDEFGHIJKLMNOPQRSTUVWXYZ"[i % 26]}' for i in range(size)) + ' ;'
+    return grammar, 'program', source
+
+
+BENCHMARKS: Dict[str, Tuple[Callable[[int], Tuple[str, str, str]], List[int]]] = {
+    'deep_expression': (deep_expression, [10, 100, 500]),
+    'long_list': (long_list, [10, 100, 1000, 2000]),
+    'commented_list': (commented_list, [100, 1000, 2000]),
+    'large_document': (large_document, [3000, 7000]),
+    'many_keywords': (many_keywords, [10, 100, 500]),
+    'peek_fanout': (peek_fanout, [10, 100, 500]),
+    'many_structs': (many_structs, [100, 1000, 3000]),
+    'many_rules': (many_rules, [1000, 3000, 10000]),
+}
+
+
+def best_of(repeat: int, f: Callable[[], object]) -> Tuple[float, object]:
+    # Returns the fastest time in milliseconds, and the result of the last call.
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = f()
+        best = min(best, (time.perf_counter() - start) * 1000)
+    return best, result
+
+
+def typed_tree(grammar: str, optimization_level: int):
+    tree = parse_file(tokenize(grammar))
+    syntax_tree_utilities.set_additional_properties(tree)
+    return optimize(tree, optimization_level)
+
+
+def time_compiler(grammar: str, repeat: int, optimization_level: int) -> Dict[str, float]:
+    timings = {}
+    timings['tokenize'], _ = best_of(repeat, lambda: tokenize(grammar))
+    timings['parse_file'], tree = best_of(repeat, lambda: parse_file(tokenize(grammar)))
+
+    def set_additional_properties():
+        tree = parse_file(tokenize(grammar))
+        start = time.perf_counter()
+        syntax_tree_utilities.set_additional_properties(tree)
+        return (time.perf_counter() - start) * 1000, tree
+    timings['set_additional_properties'] = min(set_additional_properties()[0] for _ in range(repeat))
+
+    _, tree = set_additional_properties()
+    timings['optimize'], tree = best_of(repeat, lambda: optimize(tree, optimization_level))
+    timings['assemble'], _ = best_of(repeat, lambda: javascript.assemble(tree))
+    return timings
+
+
+def space_after(source: str, fraction: float) -> int:
+    # An offset to type a space at, in whitespace (or a comment) at least `fraction` of the way
+    # through the source, so every benchmark's input still parses after the edit.
+    offset = source.find(' ', int(len(source) * fraction))
+    return len(source) if offset == -1 else offset
+
+
+def time_javascript(grammar: str, entrypoint: str, source: str, repeat: int,
+        optimization_level: int, bytecode: bool) -> Tuple[Dict[str, float], int]:
+    # Also returns the size of the generated parser in bytes.
+    tree = typed_tree(grammar, optimization_level)
+    parser = javascript.assemble(tree, bytecode=bytecode)
+
+    with tempfile.TemporaryDirectory() as directory:
+        module_path = os.path.join(directory, 'module.js')
+        parser_path = os.path.join(directory, 'parser.js')
+        input_path = os.path.join(directory, 'input.txt')
+        with open(module_path, 'w') as f:
+            f.write(parser)
+        with open(parser_path, 'w') as f:
+            f.write(parser + JS_HARNESS % entrypoint)
+        with open(input_path, 'w') as f:
+            f.write(source)
+
+        output = subprocess.run(
+            ['node', '--stack-size=65500', parser_path, input_path, str(repeat),
+                str(space_after(source, 0.01)), str(space_after(source, 0.99))],
+            check=True, capture_output=True)
+        timings = json.loads(output.stdout)
+
+        # Includes starting node itself, which is the same for every grammar.
+        timings['startup'], _ = best_of(repeat, lambda: subprocess.run(
+            ['node', '-e', f'require({json.dumps(module_path)})'], check=True, capture_output=True))
+        return timings, len(parser.encode())
+
+
+def time_python(grammar: str, entrypoint: str, source: str, repeat: int,
+        optimization_level: int) -> Dict[str, float]:
+    tree = typed_tree(grammar, optimization_level)
+
+    namespace = {}
+    exec(python.assemble(tree), namespace)
+    Parser = namespace['Parser']
+
+    timings = {}
+    timings['lex'], parser = best_of(repeat, lambda: Parser(source))
+
+    def parse():
+        parser = Parser(source)
+        start = time.perf_counter()
+        parser._consume_all(entrypoint)
+        return (time.perf_counter() - start) * 1000
+    timings['parse'] = min(parse() for _ in range(repeat))
+    return timings
+
+
+def run(names: List[str], repeat: int, optimization_level: int, bytecode: bool) -> List[Dict]:
+    results = []
+    for name in names:
+        generate, sizes = BENCHMARKS[name]
+        for size in sizes:
+            grammar, entrypoint, source = generate(size)
+            javascript_timings, javascript_bytes = time_javascript(
+                grammar, entrypoint, source, repeat, optimization_level, bytecode)
+            result = {
+                'benchmark': name,
+                'size': size,
+                'compiler': time_compiler(grammar, repeat, optimization_level),
+                'javascript': javascript_timings,
+                'javascript_bytes': javascript_bytes,
+                'python': time_python(grammar, entrypoint, source, repeat, optimization_level),
+            }
+            print(f'{name} ({size}): ' + ', '.join(
+                f'{group}.{phase} {ms:.2f} ms'
+                for group in ('compiler', 'javascript', 'python')
+                for phase, ms in result[group].items())
+                + f', javascript.bytes {javascript_bytes}', file=sys.stderr)
+            results.append(result)
+    return results
+
+
+def compare(baseline: List[Dict], results: List[Dict]):
+    # Prints how each timing changed, as a ratio of the baseline (below 1.00 is faster).
+    old = {(r['benchmark'], r['size'], group, phase): ms
+        for r in baseline
+        for group in ('compiler', 'javascript', 'python') if group in r
+        for phase, ms in r[group].items()}
+    old_sizes = {(r['benchmark'], r['size']): r['javascript_bytes']
+        for r in baseline if 'javascript_bytes' in r}
+
+    for r in results:
+        for group in ('compiler', 'javascript', 'python'):
+            for phase, ms in r[group].items():
+                key = (r['benchmark'], r['size'], group, phase)
+                if old.get(key):
+                    print(f'{r["benchmark"]:>16} {r["size"]:>6} {group + "." + phase:>35} '
+                        f'{old[key]:>10.2f} -> {ms:>10.2f} ms ({ms / old[key]:.2f}x)')
+
+        old_bytes = old_sizes.get((r['benchmark'], r['size']))
+        if old_bytes and 'javascript_bytes' in r:
+            print(f'{r["benchmark"]:>16} {r["size"]:>6} {"javascript.bytes":>35} '
+                f'{old_bytes:>10} -> {r["javascript_bytes"]:>10}    ({r["javascript_bytes"] / old_bytes:.2f}x)')
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], check=True, capture_output=True,
+            cwd=os.path.dirname(__file__)).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the langlang compiler and generated parsers.')
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark',
+        help=f'benchmarks to run: {", ".join(BENCHMARKS)} (default: all)')
+    parser.add_argument('-o', dest='outfile', type=str, action='store',
+        help='write JSON results to a file instead of stdout')
+    parser.add_argument('--repeat', dest='repeat', type=int, default=3,
+        help='runs per timing; the fastest is reported (default: 3)')
+    parser.add_argument('-O', dest='optimization_level', type=int, choices=[0, 1, 2], default=1,
+        help='optimization level to compile the grammars with (default: 1)')
+    parser.add_argument('--bytecode', dest='bytecode', action='store_true',
+        help='compile the JavaScript parsers to bytecode')
+    parser.add_argument('--compare', dest='baseline', type=str, action='store',
+        help='JSON results from an earlier run to compare against')
+
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f'unknown benchmark "{name}"')
+
+    results = run(args.benchmarks or list(BENCHMARKS), args.repeat, args.optimization_level,
+        args.bytecode)
+    output = json.dumps({'revision': git_revision(), 'optimization_level': args.optimization_level,
+        'bytecode': args.bytecode, 'results': results}, indent=2)
+
+    if args.outfile:
+        with open(args.outfile, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(json.load(f)['results'], results)
+
+
+if __name__ == '__main__':
+    main()
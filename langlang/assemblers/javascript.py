@@ -1,13 +1,16 @@
 import copy
 from dataclasses import dataclass
 import enum
+import functools
+import json
 import os
 import re
-from typing import Any, Dict, Set, Tuple, Type, Union
+from typing import Any, Dict, List, Optional, Set, Tuple, Type, Union
 
 from jinja2 import Template
 
 from parsing import storage_methods
+from parsing import syntax_tree_utilities
 from parsing import types
 from parsing import syntax_tree as ast
 
@@ -19,6 +22,12 @@ current_dir = os.path.dirname(__file__)
 runtime_template_filepath = os.path.join(current_dir, RUNTIME_DIR, MAIN_TEMPLATE_FILE)
 standalone_template_filepath = os.path.join(current_dir, RUNTIME_DIR, STANDALONE_TEMPLATE_FILE)
 
+@functools.lru_cache(maxsize=None)
+def load_template(filepath: str) -> Template:
+    # Parsing a template takes longer than rendering it, and a process may assemble many grammars.
+    with open(filepath) as f:
+        return Template(f.read())
+
 INDENT_SIZE = '    '
 
 
@@ -26,29 +35,94 @@ class Context:
     def __init__(self):
         self.tokens = {}
         self.exports: Set[str] = set()
+        self.rules: List[str] = []
+        # Regex sources of the grammar's `skip` patterns.
+        self.skips: List[str] = []
+        # Whitespace characters that tokens can start with.
+        self.token_whitespace: Set[str] = set()
+        # Whether every rule gets a validator, for `.validate`.
+        self.validate = False
+        # Rules whose validators are called, in the order they were first called for (with repeats).
+        self.validated: List[str] = []
+        # Class name and field order for each struct name and set of fields.
+        self.structs: Dict[Tuple[str, frozenset], Tuple[str, List[str]]] = {}
+
+def struct_class(node: ast.Struct, ctx: Context) -> Tuple[str, List[str]]:
+    # Adds the class for a named struct, and returns its name and the order of its fields.
+    key = (node.name, frozenset(node.map))
+    if key not in ctx.structs:
+        # Structs with the same name but different fields need their own classes.
+        same_name = sum(1 for name, _ in ctx.structs if name == node.name)
+        class_name = f'__struct_{node.name}' + (f'_{same_name + 1}' if same_name else '')
+        ctx.structs[key] = (class_name, list(node.type.fields))
+    return ctx.structs[key]
+
+def assemble_struct_class(name: str, class_name: str, fields: List[str]) -> str:
+    # Every instance has the same fields in the same order, so code reading them stays monomorphic.
+    # _type is shared through the prototype, and added back when converting to JSON. Struct and
+    # field names can be JavaScript keywords (like `new` or `default`), so they're only ever used in
+    # strings.
+    params = [f'f{i}' for i in range(len(fields))]
+    assignments = ''.join(
+        f'\n{INDENT_SIZE * 2}this[{json.dumps(field)}] = {param};' for field, param in zip(fields, params))
+    json_fields = ''.join(f'{json.dumps(field)}: this[{json.dumps(field)}], ' for field in fields)
+    return (
+        f'const {class_name} = class {{\n'
+        f'{INDENT_SIZE}constructor({", ".join(params)}) {{{assignments}\n'
+        f'{INDENT_SIZE}}}\n'
+        f'\n'
+        f'{INDENT_SIZE}toJSON() {{\n'
+        f'{INDENT_SIZE * 2}return {{ {json_fields}_type: this._type }};\n'
+        f'{INDENT_SIZE}}}\n'
+        f'}};\n'
+        f'Object.defineProperty({class_name}, "name", {{ value: {json.dumps(name)} }});\n'
+        f'{class_name}.prototype._type = {json.dumps(name)};'
+    )
 
-def assemble_into_js(node: ast.Node, ctx: Context, indent='') -> str:
-    # Basic parsers
+def token_pattern(node: ast.Node) -> str:
+    # The source of a regex literal matching what a literal or regex parser matches, without the
+    # slashes.
     if isinstance(node, ast.LiteralParser):
         # Replace with literal regex that does the same thing.
-        token_name = f'lit_{node.value}'
-        escaped_re = re.sub(r'([-/[\]{}()*+?.,\\^$|#\\s])', r'\\\1', node.value)
-        as_re = f'/^{escaped_re}/'
-        ctx.tokens[token_name] = as_re
-        return f'{indent}{node.storage_method.as_prefix()}this.__require("{token_name}").value;'
+        return re.sub(r'([-/[\]{}()*+?.,\\^$|#\s])', r'\\\1', node.value)
+    return node.value.replace('/',  '\\/')
 
-    elif isinstance(node, ast.RegexParser):
+def token(node: ast.Node, ctx: Context) -> str:
+    # Adds the token a literal or regex parser matches, and returns its name.
+    if isinstance(node, ast.LiteralParser):
+        token_name = f'lit_{node.value}'
+    else:
         token_name = node.value.replace('"', '\\"')
-        escaped_re = node.value.replace('/',  '\\/')
-        as_re = f'/^{escaped_re}/'
-        ctx.tokens[token_name] = as_re
-        return f'{indent}{node.storage_method.as_prefix()}this.__require("{token_name}").value;'
+    ctx.tokens[token_name] = f'/{token_pattern(node)}/y'
+    ctx.token_whitespace.update(syntax_tree_utilities.leading_whitespace(node))
+    return token_name
+
+# Nodes that can be assembled as validators when their value is ignored. Names bound inside a peek
+# never escape its match function, so ignored peeks can drop them too. Sequences, `as` and `!` are
+# left alone, since what they bind may be used later on.
+IGNORABLE_NODES = (
+    ast.LiteralParser, ast.RegexParser, ast.FusedSequence, ast.Peek, ast.Var, ast.Struct,
+    ast.LitStr, ast.LitNum)
+
+def assemble_into_js(node: ast.Node, ctx: Context, indent='') -> str:
+    # Values that are thrown away aren't built: tokens are skipped, and rules are called through
+    # their validators.
+    if isinstance(node.storage_method, storage_methods.Ignore) and isinstance(node, IGNORABLE_NODES):
+        return assemble_validator(node, ctx, indent=indent)
+
+    # Basic parsers
+    if isinstance(node, (ast.LiteralParser, ast.RegexParser)):
+        return f'{indent}{node.storage_method.as_prefix()}this.__require("{token(node, ctx)}").value;'
 
     # Parser combinators
     elif isinstance(node, ast.Sequence):
         e1 = assemble_into_js(node.expr1, ctx, indent=indent)
         e2 = assemble_into_js(node.expr2, ctx, indent=indent)
-        return f'{e1}\n{e2}'
+        return '\n'.join(e for e in (e1, e2) if e)
+
+    elif isinstance(node, ast.FusedSequence):
+        token_names = ', '.join(f'"{token(parser, ctx)}"' for parser in node.parsers)
+        return f'{indent}{node.storage_method.as_prefix()}this.__require_seq([{token_names}]).value;'
 
     elif isinstance(node, ast.Peek):
         statements = ''
@@ -57,7 +131,8 @@ def assemble_into_js(node: ast.Node, ctx: Context, indent='') -> str:
 
             # This won't happen in the default case.
             if cond_node:
-                cond = assemble_into_js(cond_node, ctx, indent=indent_1 + INDENT_SIZE)
+                # Tests are only run to see if they match.
+                cond = assemble_validator(cond_node, ctx, indent=indent_1 + INDENT_SIZE)
                 parser = assemble_into_js(parser_node, ctx, indent=indent_1 + INDENT_SIZE)
                 statement = (
                     f'{indent_1}function __test_case_{i}() {{\n'
@@ -80,7 +155,7 @@ def assemble_into_js(node: ast.Node, ctx: Context, indent='') -> str:
 
     # Language utilities
     elif isinstance(node, ast.Named):
-        if node.storage_method is storage_methods.Ignore:
+        if isinstance(node.storage_method, storage_methods.Ignore):
             suffix = ''
         else:
             suffix = f';\n{indent}{node.storage_method.as_prefix()}{node.name};'
@@ -100,26 +175,34 @@ def assemble_into_js(node: ast.Node, ctx: Context, indent='') -> str:
 
         parser = assemble_into_js(node.parser, ctx, indent=indent1)
 
+        if node.recovery:
+            # Record the error and skip ahead to the recovery parser, unless recovery is disabled.
+            recovery = assemble_into_js(node.recovery, ctx, indent=indent1 + INDENT_SIZE)
+            handler = (
+                f'{indent1}this.__recover({node.message}, function __recovery() {{\n'
+                f'{recovery}\n'
+                f'{indent1}}});'
+            )
+        else:
+            handler = f'{indent1}this.__fail_with({node.message});'
+
         return (
             f'{indent}try {{\n'
             f'{parser}\n'
             f'{indent}}} catch (e) {{\n'
-            f'{indent1}throw Error({node.message})\n'
+            f'{indent1}if (e !== __FAILED) {{\n'
+            f'{indent1 + INDENT_SIZE}throw e;\n'
+            f'{indent1}}}\n'
+            f'{handler}\n'
             f'{indent}}}'
         )
 
     elif isinstance(node, ast.Debug):
-        if node.storage_method is storage_methods.Ignore:
-            var_name = '__debug'
-            suffix = ''
-        elif node.storage_method is storage_methods.Return:
-            var_name = 'ret'
-            suffix = f'\n{indent}{node.storage_method.as_prefix()}ret;'
-        elif isinstance(node.storage_method, storage_methods.Var):
-            var_name = node.storage_method.name
-            suffix = ''
+        var_name = node.expr.storage_method.name
+        if isinstance(node.storage_method, storage_methods.Return):
+            suffix = f'\n{indent}return {var_name};'
         else:
-            raise Exception('Unknown storage method')
+            suffix = ''
 
         e = assemble_into_js(node.expr, ctx, indent=indent)
         return f'{e}\n{indent}console.log(JSON.stringify({var_name}));{suffix}'
@@ -133,10 +216,13 @@ def assemble_into_js(node: ast.Node, ctx: Context, indent='') -> str:
 
 
     elif isinstance(node, ast.Struct):
+        if node.name:
+            class_name, fields = struct_class(node, ctx)
+            args = ', '.join(node.map[field] for field in fields)
+            return f'{indent}{node.storage_method.as_prefix()}new {class_name}({args});'
+
         indent1 = indent + INDENT_SIZE
         item_map = f',\n{indent1}'.join(f'"{key}": {value}' for key, value in node.map.items())
-        if node.name:
-            item_map += f',\n{indent1}"_type": "{node.name}"'
 
         return (
             f'{indent}{node.storage_method.as_prefix()}{{\n'
@@ -146,11 +232,36 @@ def assemble_into_js(node: ast.Node, ctx: Context, indent='') -> str:
 
     # File-level structures
     elif isinstance(node, ast.StatementSequence):
-        return '\n'.join(assemble_into_js(s, ctx=ctx, indent=indent) for s in node.stmts)
+        stmts = [assemble_into_js(s, ctx=ctx, indent=indent) for s in node.stmts]
+
+        # Validators are only made for the rules something calls them for, and making one can call
+        # for more.
+        rules = {stmt.name: stmt for stmt in node.stmts if isinstance(stmt, ast.Def)}
+        validators: Dict[str, str] = {}
+        i = 0
+        while i < len(ctx.validated):
+            name = ctx.validated[i]
+            i += 1
+            if name in rules and name not in validators:
+                validator = assemble_validator(rules[name].expr, ctx, indent=indent + INDENT_SIZE)
+                validators[name] = (
+                    f'{indent}__validate_{name}() {{\n'
+                    f'{validator}\n'
+                    f'{indent}}}')
+        stmts.extend(validators[name] for name in rules if name in validators)
+
+        return '\n'.join(stmt for stmt in stmts if stmt)
+
+    elif isinstance(node, ast.Skip):
+        ctx.skips.extend(token_pattern(pattern) for pattern in node.patterns)
+        return ''
 
     elif isinstance(node, ast.Def):
         if node.export:
             ctx.exports.add(node.name)
+        ctx.rules.append(node.name)
+        if ctx.validate:
+            ctx.validated.append(node.name)
 
         assembled_js = assemble_into_js(node.expr, ctx, indent=indent + INDENT_SIZE)
         return (
@@ -163,32 +274,301 @@ def assemble_into_js(node: ast.Node, ctx: Context, indent='') -> str:
         raise Exception(f'Unknown AST node: {node}')
 
 
+def assemble_validator(node: ast.Node, ctx: Context, indent='') -> str:
+    # Like assemble_into_js, but only matches the input: no values are built, named or returned.
+    # Nodes that only build values assemble to nothing.
+    if isinstance(node, (ast.LiteralParser, ast.RegexParser)):
+        return f'{indent}this.__skip("{token(node, ctx)}");'
+
+    elif isinstance(node, ast.Sequence):
+        e1 = assemble_validator(node.expr1, ctx, indent=indent)
+        e2 = assemble_validator(node.expr2, ctx, indent=indent)
+        return '\n'.join(e for e in (e1, e2) if e)
+
+    elif isinstance(node, ast.FusedSequence):
+        token_names = ', '.join(f'"{token(parser, ctx)}"' for parser in node.parsers)
+        return f'{indent}this.__require_seq([{token_names}]);'
+
+    elif isinstance(node, ast.Peek):
+        # Nothing to return, so cases are an if/else chain instead of a match function.
+        indent1 = indent + INDENT_SIZE
+        branches = []
+        for i, (cond_node, parser_node) in enumerate(node.cases, 1):
+            parser = assemble_validator(parser_node, ctx, indent=indent1)
+            if cond_node:
+                cond = assemble_validator(cond_node, ctx, indent=indent1)
+                branches.append(
+                    f'if (this.__test(function __test_case_{i}() {{\n'
+                    f'{cond}\n'
+                    f'{indent}}})) {{\n'
+                    f'{parser}\n'
+                    f'{indent}}}')
+            else:
+                # Cases after the default case can never match.
+                if parser:
+                    branches.append(
+                        f'{{\n'
+                        f'{parser}\n'
+                        f'{indent}}}')
+                break
+
+        return indent + f'\n{indent}else '.join(branches) if branches else ''
+
+    elif isinstance(node, (ast.Named, ast.Debug)):
+        return assemble_validator(node.expr, ctx, indent=indent)
+
+    elif isinstance(node, ast.As):
+        return assemble_validator(node.parser, ctx, indent=indent)
+
+    elif isinstance(node, ast.Error):
+        indent1 = indent + INDENT_SIZE
+
+        parser = assemble_validator(node.parser, ctx, indent=indent1)
+
+        if node.recovery:
+            recovery = assemble_validator(node.recovery, ctx, indent=indent1 + INDENT_SIZE)
+            handler = (
+                f'{indent1}this.__recover({node.message}, function __recovery() {{\n'
+                f'{recovery}\n'
+                f'{indent1}}});'
+            )
+        else:
+            handler = f'{indent1}this.__fail_with({node.message});'
+
+        return (
+            f'{indent}try {{\n'
+            f'{parser}\n'
+            f'{indent}}} catch (e) {{\n'
+            f'{indent1}if (e !== __FAILED) {{\n'
+            f'{indent1 + INDENT_SIZE}throw e;\n'
+            f'{indent1}}}\n'
+            f'{handler}\n'
+            f'{indent}}}'
+        )
+
+    elif isinstance(node, ast.Var):
+        if isinstance(node.type, types.Parser):
+            ctx.validated.append(node.name)
+            return f'{indent}this.__validate_{node.name}();'
+        return ''
+
+    elif isinstance(node, (ast.Struct, ast.LitStr, ast.LitNum)):
+        return ''
+
+    else:
+        raise Exception(f'Unknown AST node: {node}')
+
+
+class Op(enum.IntEnum):
+    # Instructions run by Parser.__exec in runtime.js. Operands follow the opcode.
+    END = 0          # Returns the value of the block.
+    REQUIRE = 1      # token constant
+    SKIP = 2         # token constant
+    REQUIRE_SEQ = 3  # constant list of tokens
+    CALL = 4         # rule name constant
+    STORE = 5        # local
+    LOAD = 6         # local
+    CONST = 7        # constant
+    BUILD = 8        # shape, then a local per field
+    PEEK = 9         # case count, whether the cases bind names, then a test block (-1 for the default
+                     # case) and a body block per case
+    TRY = 10         # message constant, parser block, recovery block (or -1)
+    DEBUG = 11
+
+
+class Program:
+    """Bytecode for every rule, run by a small interpreter instead of a method per rule.
+
+    Code is made of blocks that each end with END: one per rule, peek test, peek case, and parser
+    or recovery in `!`. Blocks run with a recursive call, so no jumps are needed.
+    """
+    def __init__(self):
+        self.code: List[int] = []
+        # JavaScript source of each constant.
+        self.constants: List[str] = []
+        self.constant_indexes: Dict[str, int] = {}
+        # Name (None if unnamed) and field order of each struct.
+        self.shapes: List[Tuple[Optional[str], List[str]]] = []
+        self.shape_indexes: Dict[Tuple[Optional[str], Tuple[str, ...]], int] = {}
+        # Name, block and number of locals of each rule.
+        self.rules: List[Tuple[str, int, int]] = []
+
+    def constant(self, source: str) -> int:
+        if source not in self.constant_indexes:
+            self.constant_indexes[source] = len(self.constants)
+            self.constants.append(source)
+        return self.constant_indexes[source]
+
+    def shape(self, name: Optional[str], fields: List[str]) -> int:
+        key = (name, tuple(fields))
+        if key not in self.shape_indexes:
+            self.shape_indexes[key] = len(self.shapes)
+            self.shapes.append((name, fields))
+        return self.shape_indexes[key]
+
+
+def assemble_block(node: ast.Node, ctx: Context, program: Program, slots: Dict[str, int]) -> int:
+    # Adds the node's code as a new block, and returns where it starts.
+    code: List[int] = []
+    assemble_bytecode(node, ctx, program, slots, code)
+    code.append(Op.END)
+    start = len(program.code)
+    program.code.extend(code)
+    return start
+
+def assemble_bytecode(node: ast.Node, ctx: Context, program: Program, slots: Dict[str, int],
+        code: List[int]):
+    # Every instruction leaves its value where the next one can use it, so unlike assemble_into_js,
+    # only names need storing.
+    def local(name: str) -> int:
+        return slots.setdefault(name, len(slots))
+
+    if isinstance(node, (ast.LiteralParser, ast.RegexParser)):
+        op = Op.SKIP if isinstance(node.storage_method, storage_methods.Ignore) else Op.REQUIRE
+        code.extend([op, program.constant(f'"{token(node, ctx)}"')])
+
+    elif isinstance(node, ast.Sequence):
+        assemble_bytecode(node.expr1, ctx, program, slots, code)
+        assemble_bytecode(node.expr2, ctx, program, slots, code)
+
+    elif isinstance(node, ast.FusedSequence):
+        token_names = ', '.join(f'"{token(parser, ctx)}"' for parser in node.parsers)
+        code.extend([Op.REQUIRE_SEQ, program.constant(f'[{token_names}]')])
+
+    elif isinstance(node, ast.Peek):
+        blocks = []
+        for cond_node, parser_node in node.cases:
+            test = assemble_block(cond_node, ctx, program, slots) if cond_node else -1
+            blocks.extend([test, assemble_block(parser_node, ctx, program, slots)])
+        binds = any(isinstance(child, ast.Named) for child in syntax_tree_utilities.walk(node))
+        code.extend([Op.PEEK, len(node.cases), int(binds), *blocks])
+
+    elif isinstance(node, ast.Named):
+        assemble_bytecode(node.expr, ctx, program, slots, code)
+        code.extend([Op.STORE, local(node.name)])
+
+    elif isinstance(node, ast.As):
+        assemble_bytecode(node.parser, ctx, program, slots, code)
+        assemble_bytecode(node.result, ctx, program, slots, code)
+
+    elif isinstance(node, ast.Error):
+        parser = assemble_block(node.parser, ctx, program, slots)
+        recovery = assemble_block(node.recovery, ctx, program, slots) if node.recovery else -1
+        code.extend([Op.TRY, program.constant(node.message), parser, recovery])
+
+    elif isinstance(node, ast.Debug):
+        assemble_bytecode(node.expr, ctx, program, slots, code)
+        code.append(Op.DEBUG)
+
+    elif isinstance(node, ast.Var):
+        if isinstance(node.type, types.Parser):
+            code.extend([Op.CALL, program.constant(f'"{node.name}"')])
+        else:
+            code.extend([Op.LOAD, local(node.name)])
+
+    elif isinstance(node, ast.Struct):
+        # Same field order as the classes assemble_into_js uses.
+        fields = struct_class(node, ctx)[1] if node.name else list(node.map)
+        code.extend([Op.BUILD, program.shape(node.name, fields)])
+        code.extend(local(node.map[field]) for field in fields)
+
+    elif isinstance(node, ast.LitStr):
+        code.extend([Op.CONST, program.constant(node.value)])
+
+    elif isinstance(node, ast.LitNum):
+        code.extend([Op.CONST, program.constant(repr(node.value))])
+
+    else:
+        raise Exception(f'Unknown AST node: {node}')
+
+def assemble_program(node: ast.StatementSequence, ctx: Context) -> Program:
+    program = Program()
+    for stmt in node.stmts:
+        if isinstance(stmt, ast.Skip):
+            ctx.skips.extend(token_pattern(pattern) for pattern in stmt.patterns)
+        elif isinstance(stmt, ast.Def):
+            if stmt.export:
+                ctx.exports.add(stmt.name)
+            ctx.rules.append(stmt.name)
+
+            slots: Dict[str, int] = {}
+            start = assemble_block(stmt.expr, ctx, program, slots)
+            program.rules.append((stmt.name, start, len(slots)))
+    return program
+
+
 # Dunno' if this is a misnomer, as it's not assembly.
-def assemble(ast, standalone_parser_entrypoint=None):
+def assemble(ast, standalone_parser_entrypoint=None, instrument=False, sample_every=None,
+        bytecode=False, ndjson=False, delimiter='\n', workers=None, validate=False):
+    """Assembles a typed syntax tree into a JavaScript module.
+
+    With `bytecode`, rules are compiled to a compact instruction array run by an interpreter in the
+    runtime, instead of a method each, and structs are built from a table instead of a class each.
+    Parsing is slower, but the output is much smaller and quicker to load.
+
+    With `validate`, each exported parser also gets a `.validate` function, which matches the input
+    without building any values. That needs a validator for every rule, so it's off by default.
+
+    With `ndjson`, the stand-alone parser reads records separated by `delimiter` and writes a line
+    of JSON for each one as it goes. `workers` parses them on that many worker threads instead of
+    the main one, or one per CPU if it's 0.
+    """
     context = Context()
+    context.validate = validate
+
+    # Rules no export can reach, and the tokens only they use, would just slow down lexing.
+    ast = syntax_tree_utilities.remove_unreachable_rules(ast, standalone_parser_entrypoint)
 
     # Statefully changes context
-    javascript = assemble_into_js(ast, context, indent=INDENT_SIZE)
+    if bytecode:
+        program = assemble_program(ast, context)
+        javascript = ''
+    else:
+        program = None
+        javascript = assemble_into_js(ast, context, indent=INDENT_SIZE)
 
-    with open(runtime_template_filepath) as f:
-        output_template = Template(f.read())
+    output_template = load_template(runtime_template_filepath)
 
     output = output_template.render(
         help_url='github.com/apccurtiss/langlang',
         parsers=javascript,
+        # Bytecode makes its struct classes at runtime, from program.shapes.
+        structs='' if bytecode else '\n\n'.join(assemble_struct_class(name, class_name, fields)
+            for (name, _), (class_name, fields) in context.structs.items()),
         exports='\n'.join(
-                f'exports.{name} = (input) => new Parser(input).__consume_all("{name}");' 
+                f'exports.{name} = (input) => new Parser(input).__consume_all("{name}");\n'
+                f'exports.{name}.recover = (input) => new Parser(input).__recover_all("{name}");\n'
+                + (f'exports.{name}.validate = (input) => new Parser(input).__validate_all("{name}");\n'
+                    if validate else '') +
+                f'exports.{name}.incremental = (input) => new IncrementalParser(input).__parse("{name}");\n'
+                f'exports.{name}.reparse = (previous, edit) => previous.__reparse(edit).__parse("{name}");'
                 for name in context.exports),
+        rules=', '.join(f'"{name}"' for name in context.rules),
+        program=program and {
+            # As JavaScript strings holding JSON.
+            'code': json.dumps(json.dumps(program.code, separators=(',', ':'))),
+            'constants': f'[{", ".join(program.constants)}]',
+            'shapes': json.dumps(json.dumps(program.shapes, separators=(',', ':'))),
+            'rules': json.dumps(json.dumps(program.rules, separators=(',', ':'))),
+        },
+        instrument=instrument,
+        sample_every=sample_every,
         tokens='\n'.join(f'        "{k}": {v},' for k, v in context.tokens.items()),
+        token_whitespace=context.token_whitespace and json.dumps(''.join(sorted(context.token_whitespace))),
+        skip=context.skips and '/' + '|'.join(f'(?:{skip})' for skip in context.skips) + '/y',
     )
 
     if standalone_parser_entrypoint:
         if standalone_parser_entrypoint not in context.exports:
             raise Exception(f'The parser "{standalone_parser_entrypoint}" is not exported.')
 
-        with open(standalone_template_filepath) as f:
-            standalone_template = Template(f.read())
+        standalone_template = load_template(standalone_template_filepath)
 
-        output += standalone_template.render(entrypoint=standalone_parser_entrypoint)
+        output += standalone_template.render(
+            entrypoint=standalone_parser_entrypoint,
+            sample_every=sample_every,
+            ndjson=ndjson,
+            delimiter=json.dumps(delimiter),
+            workers=workers)
 
     return output
\ No newline at end of file
@@ -0,0 +1,249 @@
+import functools
+import keyword
+import os
+import re
+from typing import List, Set
+
+from jinja2 import Template
+
+from parsing import storage_methods
+from parsing import syntax_tree_utilities
+from parsing import types
+from parsing import syntax_tree as ast
+
+RUNTIME_DIR = '../runtimes'
+MAIN_TEMPLATE_FILE = 'runtime.py'
+STANDALONE_TEMPLATE_FILE = 'standalone_runtime.py'
+
+current_dir = os.path.dirname(__file__)
+runtime_template_filepath = os.path.join(current_dir, RUNTIME_DIR, MAIN_TEMPLATE_FILE)
+standalone_template_filepath = os.path.join(current_dir, RUNTIME_DIR, STANDALONE_TEMPLATE_FILE)
+
+@functools.lru_cache(maxsize=None)
+def load_template(filepath: str) -> Template:
+    # Parsing a template takes longer than rendering it, and a process may assemble many grammars.
+    with open(filepath) as f:
+        return Template(f.read())
+
+INDENT_SIZE = '    '
+
+
+class Context:
+    def __init__(self):
+        self.tokens = {}
+        self.exports: Set[str] = set()
+        self.rules: List[str] = []
+        # Regexes of the grammar's `skip` patterns.
+        self.skips: List[str] = []
+        # Whitespace characters that tokens can start with.
+        self.token_whitespace: Set[str] = set()
+
+def identifier(name: str) -> str:
+    # Langlang names can be anything matching \w+, which includes Python keywords.
+    return f'{name}_' if keyword.iskeyword(name) else name
+
+def storage_prefix(storage_method: storage_methods.StorageMethod) -> str:
+    if isinstance(storage_method, storage_methods.Var):
+        return f'{identifier(storage_method.name)} = '
+    elif isinstance(storage_method, storage_methods.Return):
+        return 'return '
+    else:
+        return ''
+
+def bound_names(node: ast.Node) -> List[str]:
+    # Names bound by a parser in the current function. Peek cases run in their own function.
+    if isinstance(node, ast.Named):
+        return [node.name, *bound_names(node.expr)]
+    elif isinstance(node, ast.Sequence):
+        return [*bound_names(node.expr1), *bound_names(node.expr2)]
+    elif isinstance(node, (ast.As, ast.Error)):
+        return bound_names(node.parser)
+    elif isinstance(node, ast.Debug):
+        return bound_names(node.expr)
+    else:
+        return []
+
+def token_pattern(node: ast.Node) -> str:
+    # A regex matching what a literal or regex parser matches.
+    return re.escape(node.value) if isinstance(node, ast.LiteralParser) else node.value
+
+def token(node: ast.Node, ctx: Context) -> str:
+    # Adds the token a literal or regex parser matches, and returns its name.
+    token_name = f'lit_{node.value}' if isinstance(node, ast.LiteralParser) else node.value
+    ctx.tokens[token_name] = token_pattern(node)
+    ctx.token_whitespace.update(syntax_tree_utilities.leading_whitespace(node))
+    return token_name
+
+def assemble_into_python(node: ast.Node, ctx: Context, indent='') -> str:
+    # Basic parsers
+    if isinstance(node, (ast.LiteralParser, ast.RegexParser)):
+        return f'{indent}{storage_prefix(node.storage_method)}self._require({token(node, ctx)!r}).value'
+
+    # Parser combinators
+    elif isinstance(node, ast.Sequence):
+        e1 = assemble_into_python(node.expr1, ctx, indent=indent)
+        e2 = assemble_into_python(node.expr2, ctx, indent=indent)
+        return f'{e1}\n{e2}'
+
+    elif isinstance(node, ast.FusedSequence):
+        token_names = tuple(token(parser, ctx) for parser in node.parsers)
+        return f'{indent}{storage_prefix(node.storage_method)}self._require_seq({token_names!r}).value'
+
+    elif isinstance(node, ast.Peek):
+        statements = ''
+        for i, (cond_node, parser_node) in enumerate(node.cases, 1):
+            indent_1 = indent + INDENT_SIZE
+
+            # This won't happen in the default case.
+            if cond_node:
+                cond = assemble_into_python(cond_node, ctx, indent=indent_1 + INDENT_SIZE)
+                parser = assemble_into_python(parser_node, ctx, indent=indent_1 + INDENT_SIZE)
+                statement = (
+                    f'{indent_1}def _test_case_{i}():\n'
+                    f'{cond}\n'
+                    f'{indent_1}if self._test(_test_case_{i}):\n'
+                    f'{parser}\n')
+
+            else:
+                statement = assemble_into_python(parser_node, ctx, indent=indent_1) + '\n'
+
+            statements += statement
+
+        return (
+            f'{indent}def _match():\n'
+            f'{statements}'
+            f'{indent}{storage_prefix(node.storage_method)}_match()'
+        )
+
+    # Language utilities
+    elif isinstance(node, ast.Named):
+        if isinstance(node.storage_method, storage_methods.Ignore):
+            suffix = ''
+        else:
+            suffix = f'\n{indent}{storage_prefix(node.storage_method)}{identifier(node.name)}'
+
+        expr = assemble_into_python(node.expr, ctx, indent=indent)
+
+        return f'{expr}{suffix}'
+
+    elif isinstance(node, ast.As):
+        parser = assemble_into_python(node.parser, ctx, indent=indent)
+        result = assemble_into_python(node.result, ctx, indent=indent)
+
+        return f'{parser}\n{result}'
+
+    elif isinstance(node, ast.Error):
+        indent1 = indent + INDENT_SIZE
+
+        parser = assemble_into_python(node.parser, ctx, indent=indent1)
+
+        declarations = ''
+        if node.recovery:
+            # Record the error and skip ahead to the recovery parser, unless recovery is disabled.
+            recovery = assemble_into_python(node.recovery, ctx, indent=indent1 + INDENT_SIZE)
+            handler = (
+                f'{indent1}def _recovery():\n'
+                f'{recovery}\n'
+                f'{indent1}self._recover(ParseError({node.message}), _recovery)'
+            )
+            # After recovering, anything the parser would have bound is None.
+            for name in dict.fromkeys(bound_names(node.parser)):
+                declarations += f'{indent}{identifier(name)} = None\n'
+        else:
+            handler = f'{indent1}raise ParseError({node.message}) from None'
+
+        return (
+            f'{declarations}'
+            f'{indent}try:\n'
+            f'{parser}\n'
+            f'{indent}except ParseError:\n'
+            f'{handler}'
+        )
+
+    elif isinstance(node, ast.Debug):
+        var_name = identifier(node.expr.storage_method.name)
+        if isinstance(node.storage_method, storage_methods.Return):
+            suffix = f'\n{indent}return {var_name}'
+        else:
+            suffix = ''
+
+        e = assemble_into_python(node.expr, ctx, indent=indent)
+        return f'{e}\n{indent}print(json.dumps({var_name})){suffix}'
+
+    # Values
+    elif isinstance(node, ast.Var):
+        if isinstance(node.type, types.Parser):
+            return f'{indent}{storage_prefix(node.storage_method)}self.{identifier(node.name)}()'
+        else:
+            return f'{indent}{storage_prefix(node.storage_method)}{identifier(node.name)}'
+
+    elif isinstance(node, ast.Struct):
+        items = [f'{key!r}: {identifier(value)}' for key, value in node.map.items()]
+        if node.name:
+            items.append(f"'_type': {node.name!r}")
+
+        return f'{indent}{storage_prefix(node.storage_method)}{{{", ".join(items)}}}'
+
+    # File-level structures
+    elif isinstance(node, ast.StatementSequence):
+        stmts = (assemble_into_python(s, ctx=ctx, indent=indent) for s in node.stmts)
+        return '\n\n'.join(stmt for stmt in stmts if stmt)
+
+    elif isinstance(node, ast.Skip):
+        ctx.skips.extend(token_pattern(pattern) for pattern in node.patterns)
+        return ''
+
+    elif isinstance(node, ast.Def):
+        if node.export:
+            ctx.exports.add(node.name)
+        ctx.rules.append(node.name)
+
+        assembled_python = assemble_into_python(node.expr, ctx, indent=indent + INDENT_SIZE)
+        return (
+            f'{indent}def {identifier(node.name)}(self):\n'
+            f'{assembled_python}'
+        )
+
+    else:
+        raise Exception(f'Unknown AST node: {node}')
+
+
+def assemble(ast, standalone_parser_entrypoint=None):
+    context = Context()
+
+    # Rules no export can reach, and the tokens only they use, would just slow down lexing.
+    ast = syntax_tree_utilities.remove_unreachable_rules(ast, standalone_parser_entrypoint)
+
+    # Statefully changes context
+    python = assemble_into_python(ast, context, indent=INDENT_SIZE)
+
+    # Whitespace that tokens can start with is left for _skip_whitespace.
+    token_whitespace = ''.join(sorted(context.token_whitespace))
+    whitespace = f'[^\\S{re.escape(token_whitespace)}]+' if token_whitespace else '\\s+'
+
+    output_template = load_template(runtime_template_filepath)
+
+    output = output_template.render(
+        help_url='github.com/apccurtiss/langlang',
+        parsers=python,
+        exports='\n\n'.join(
+                f'def {identifier(name)}(input):\n'
+                f'    return Parser(input)._consume_all({identifier(name)!r})\n'
+                f'{identifier(name)}.recover = lambda input: Parser(input)._recover_all({identifier(name)!r})'
+                for name in sorted(context.exports))
+            + f'\n\n__all__ = {[identifier(name) for name in sorted(context.exports)]!r}',
+        tokens='\n'.join(f'        ({k!r}, re.compile({v!r})),' for k, v in context.tokens.items()),
+        # Always matches, possibly nothing.
+        skip=repr(f'(?:{whitespace}' + ''.join(f'|(?:{skip})' for skip in context.skips) + ')*'),
+        token_whitespace=token_whitespace and repr(token_whitespace),
+    )
+
+    if standalone_parser_entrypoint:
+        if standalone_parser_entrypoint not in context.exports:
+            raise Exception(f'The parser "{standalone_parser_entrypoint}" is not exported.')
+
+        standalone_template = load_template(standalone_template_filepath)
+
+        output += standalone_template.render(entrypoint=identifier(standalone_parser_entrypoint))
+
+    return output
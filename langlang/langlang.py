@@ -1,16 +1,34 @@
 import argparse
 from collections import namedtuple
+import hashlib
 import logging
 import os
 import re
+import signal
+import socket
 import sys
 import time
-from typing import Dict, List, Optional
+import types
+from typing import Callable, Dict, List, Optional
 from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
 
-from parsing.ll_parser import parse
-from assemblers.javascript import assemble
+from parsing import ir
+from parsing.analysis import analyze
+from parsing.ll_parser import parse_file
+from parsing.optimizer import optimize
+from parsing.syntax_tree_utilities import set_additional_properties, walk
+from parsing.tokenizer import tokenize
+from assemblers import javascript, python
+import modules
+import profiling
+import server
+import watcher
+
+TARGETS = {
+    'javascript': (javascript.assemble, '.js'),
+    'python': (python.assemble, '.py'),
+}
+IR_EXTENSION = '.llir'
 
 
 def version(args):
@@ -18,71 +36,297 @@ def version(args):
     exit(0)
 
 
-def compile_source(source, entrypoint=None):
-    ast = parse(source)
-    return assemble(ast, standalone_parser_entrypoint=entrypoint)
+def typed_tree(source, path=None, profile: profiling.Profile = None):
+    """Parses and types langlang source, and links in the rules it imports.
 
+    Imports are relative to the file at `path`, or to the working directory if there isn't one.
+    """
+    with profiling.phase(profile, 'tokenize') as counters:
+        tokens = tokenize(source)
+        counters['tokens'] = len(tokens.tokens)
 
-def compile_file(args):
-    with open(args.filename) as f:
-        source = f.read()
+    with profiling.phase(profile, 'parse_file') as counters:
+        ast = parse_file(tokens)
+        counters['backtracks'] = tokens.backtracks
+
+    with profiling.phase(profile, 'imports') as counters:
+        loader = modules.ModuleLoader()
+        directory = os.path.dirname(os.path.abspath(path)) if path else os.getcwd()
+        imports = [loader.load(import_path) for import_path in modules.import_paths(ast, directory)]
+        counters['compiled'] = loader.compiled
+        counters['reused'] = loader.reused
+
+    with profiling.phase(profile, 'set_additional_properties') as counters:
+        set_additional_properties(ast, modules.imported_types(imports))
+        ast = modules.link(ast, imports)
+        if profile:
+            counters['ast_nodes'] = sum(1 for _ in walk(ast))
+
+    return ast
+
+
+def compile_source(source, entrypoint=None, target='javascript', profile: profiling.Profile = None,
+        optimization_level=1, path=None, **options):
+    """Compiles langlang source to the target language.
+
+    See `typed_tree` for how imports are found, and `compile_tree` for the other options.
+    """
+    ast = typed_tree(source, path, profile)
+    return compile_tree(ast, entrypoint, target, profile, optimization_level, **options)
+
+
+def compile_tree(ast, entrypoint=None, target='javascript', profile: profiling.Profile = None,
+        optimization_level=1, **options):
+    """Compiles a typed syntax tree (from `typed_tree` or an IR file) to the target language.
+
+    See `parsing.optimizer.optimize` for the optimization levels. Any other options are passed to
+    the target's assembler (e.g. `instrument=True` for javascript).
+    """
+    if target not in TARGETS:
+        raise Exception(f'Unknown target: {target}')
+    assemble, _ = TARGETS[target]
+
+    with profiling.phase(profile, 'optimize') as counters:
+        ast = optimize(ast, optimization_level)
+        if profile:
+            counters['ast_nodes'] = sum(1 for _ in walk(ast))
+
+    with profiling.phase(profile, 'assemble') as counters:
+        output = assemble(ast, standalone_parser_entrypoint=entrypoint, **options)
+        counters['bytes'] = len(output.encode())
+
+    return output
+
+
+class Grammar:
+    """Parsers compiled from langlang source and loaded into this process.
+
+    Every exported parser is available as an attribute (Python keywords get a trailing
+    underscore), and raises `ParseError` when its input doesn't parse.
+    """
+    def __init__(self, module: types.ModuleType):
+        self.ParseError = module.ParseError
+        self.parsers: Dict[str, Callable] = {name: getattr(module, name) for name in module.__all__}
+
+    def __getattr__(self, name):
+        try:
+            return self.parsers[name]
+        except KeyError:
+            raise AttributeError(f'No exported parser named "{name}"') from None
+
+
+# Compiled grammars, keyed by the SHA-256 of their source.
+loaded_grammars: Dict[str, Grammar] = {}
 
-    output = compile_source(source, args.entrypoint)
+def load(source: str) -> Grammar:
+    key = hashlib.sha256(source.encode()).hexdigest()
+    if key not in loaded_grammars:
+        module = types.ModuleType(f'langlang_{key[:16]}')
+        exec(compile(compile_source(source, target='python'), module.__name__, 'exec'), module.__dict__)
+        loaded_grammars[key] = Grammar(module)
 
-    outfile = args.outfile or f'{os.path.splitext(args.filename)[0]}.js'
-    with open(outfile, 'w') as f:
+    return loaded_grammars[key]
+
+
+def read_typed_tree(filename, profile: profiling.Profile = None):
+    # Accepts both langlang source and IR written by --emit-ir.
+    with open(filename, 'rb') as f:
+        data = f.read()
+
+    if ir.is_ir(data):
+        with profiling.phase(profile, 'load_ir') as counters:
+            counters['bytes'] = len(data)
+            return ir.loads(data)
+    return typed_tree(data.decode(), filename, profile)
+
+
+def compile_output(args, filename):
+    # Returns the file to write the output to, and the output.
+    profile = profiling.Profile(memory=args.profile_memory) if args.profile else None
+    ast = read_typed_tree(filename, profile)
+
+    if args.emit_ir:
+        output = ir.dumps(ast)
+        extension = IR_EXTENSION
+    else:
+        options = {}
+        if args.instrument:
+            options['instrument'] = True
+        if args.sample_every:
+            options['sample_every'] = args.sample_every
+        if args.bytecode:
+            options['bytecode'] = True
+        if args.validate:
+            options['validate'] = True
+        if args.ndjson:
+            options['ndjson'] = True
+            options['delimiter'] = args.delimiter
+            options['workers'] = args.workers
+        output = compile_tree(ast, args.entrypoint, args.target, profile, args.optimization_level,
+            **options).encode()
+        _, extension = TARGETS[args.target]
+
+    if profile:
+        print(profile.to_json() if args.profile == 'json' else profile.report(), file=sys.stderr)
+
+    return args.outfile or f'{os.path.splitext(filename)[0]}{extension}', output
+
+
+def compile_file(args):
+    outfile, output = compile_output(args, args.filename)
+    with open(outfile, 'wb') as f:
         print(f'Writing output to {outfile}')
         f.write(output)
 
 
-def watch_file(args):
-    filename = args.filename
-
-    class Handler(FileSystemEventHandler): 
-        @staticmethod
-        def on_any_event(event):
-            if event.event_type == 'modified' and event.src_path == filename: 
-                print(f'Recompiling {filename}')
-                compile_file(args)
-
-    watchpath = os.path.dirname(filename)
-
-    # Initialize Observer 
-    observer = Observer() 
-    observer.schedule(Handler(), watchpath)
-  
-    # Start the observer
-    print(f'Watching for changes to {watchpath}')
-    observer.start() 
-    try: 
-        while True: 
-            # Set the thread sleep time 
+def analyze_file(args):
+    print(analyze(read_typed_tree(args.filename)).report())
+
+
+def serve(args):
+    if os.path.exists(args.socket):
+        # Left behind by a server that didn't shut down cleanly, unless one is still listening.
+        probe = socket.socket(socket.AF_UNIX)
+        try:
+            probe.connect(args.socket)
+            exit(f'A server is already listening on {args.socket}')
+        except ConnectionRefusedError:
+            os.unlink(args.socket)
+        finally:
+            probe.close()
+
+    compile_server = server.CompileServer(args.socket, compile_tree, args.cache_size)
+    print(f'Listening on {args.socket}', flush=True)
+    # Clean up the socket when stopped by a service manager, too.
+    signal.signal(signal.SIGTERM, lambda *_: exit(0))
+    try:
+        compile_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        compile_server.server_close()
+        os.unlink(args.socket)
+
+
+def watch_files(args):
+    observer = Observer()
+    compile_watcher = watcher.Watcher(args.filenames, lambda filename: compile_output(args, filename),
+        args.debounce / 1000, imports=modules.imported_files,
+        schedule=lambda directory: observer.schedule(compile_watcher, directory))
+
+    print(f'Watching for changes to {", ".join(args.filenames)} and the files they import')
+    compile_watcher.start()
+    observer.start()
+    try:
+        while True:
             time.sleep(1)
-    except KeyboardInterrupt: 
+    except KeyboardInterrupt:
         observer.stop()
-    observer.join() 
+    observer.join()
+    compile_watcher.stop()
 
 
 def main():
     parser = argparse.ArgumentParser(description='Compile langlang files.')
-    parser.add_argument('filename', type=str, nargs='?', action='store', help='file to compile')
+    parser.add_argument('filenames', type=str, nargs='*', action='store',
+        help='file to compile (--watch can take several)')
     parser.add_argument('-o', dest='outfile', type=str, action='store', help='output filename')
     parser.add_argument('--watch', dest='watch', action='store_true',
-        help='watch a file and recompile on changes')
+        help='watch the files, and everything they import, and recompile each one when it changes')
+    parser.add_argument('--debounce', dest='debounce', type=int, default=100, metavar='MS',
+        help='with --watch, how long a file has to go without changing before it\'s recompiled '
+             '(default: 100)')
     parser.add_argument('--version', dest='version', action='store_true',
         help='print version and exit')
     parser.add_argument('--stdin', dest='entrypoint', type=str, action='store',
         help='compile the output file to pass data from stdin to <entrypoint> and print the result')
+    parser.add_argument('--target', dest='target', choices=TARGETS, default='javascript',
+        help='language to compile the parser to (default: javascript)')
+    parser.add_argument('-O', dest='optimization_level', type=int, choices=[0, 1, 2], default=1,
+        help='0: no optimizations, 1: inline small rules (the default), 2: also match runs of tokens '
+             'all at once')
+    parser.add_argument('--instrument', dest='instrument', action='store_true',
+        help='count calls, speculation, failures, tokens and time per rule, exported as __stats() '
+             '(javascript only)')
+    parser.add_argument('--sample', dest='sample_every', type=int, metavar='N',
+        help='record the stack of running rules every N tokens, exported as __samples() in collapsed '
+             'stack format for flamegraphs (javascript only)')
+    parser.add_argument('--bytecode', dest='bytecode', action='store_true',
+        help='compile rules to a compact table run by an interpreter, instead of a method each, so '
+             'huge grammars load faster (javascript only)')
+    parser.add_argument('--validate', dest='validate', action='store_true',
+        help='export a .validate function for each parser, which checks input without building its '
+             'value (javascript only)')
+    parser.add_argument('--ndjson', dest='ndjson', action='store_true',
+        help='make the --stdin parser treat each line of input as a separate document, and print a '
+             'line of JSON for each one as soon as it is parsed (javascript only)')
+    parser.add_argument('--delimiter', dest='delimiter', type=str, default='\n',
+        help='what separates documents with --ndjson (default: a newline)')
+    parser.add_argument('--workers', dest='workers', type=int, nargs='?', const=0, metavar='N',
+        help='parse --ndjson documents on N worker threads (default: one per CPU)')
+    parser.add_argument('--emit-ir', dest='emit_ir', action='store_true',
+        help=f'write the typed syntax tree as {IR_EXTENSION} IR instead of compiling. IR files can be '
+             'compiled like source files, without parsing or typing them again')
+    parser.add_argument('--analyze', dest='analyze', action='store_true',
+        help="print each rule's FIRST and FOLLOW sets and warn about peeks that backtrack a lot, "
+             'instead of compiling')
+    parser.add_argument('--serve', dest='socket', type=str, metavar='SOCKET',
+        help='instead of compiling a file, serve compile requests on a Unix socket (see server.py)')
+    parser.add_argument('--cache-size', dest='cache_size', type=int, default=64, metavar='N',
+        help='with --serve, the number of typed files and compiled outputs to keep in memory')
+    parser.add_argument('--profile', dest='profile', nargs='?', choices=['text', 'json'], const='text',
+        help='print the time and counters for each compiler phase to stderr')
+    parser.add_argument('--profile-memory', dest='profile_memory', action='store_true',
+        help='with --profile, also measure the peak memory of each phase, which slows every phase '
+             'down unevenly')
 
     args = parser.parse_args()
+    args.filename = args.filenames[0] if args.filenames else None
 
     if args.version:
         version(args)
+    if args.socket:
+        if args.cache_size < 1:
+            parser.error('--cache-size needs to keep at least one entry')
+        serve(args)
+        exit(0)
     if not args.filename:
         parser.print_help()
         exit(0)
+    if len(args.filenames) > 1 and not args.watch:
+        parser.error('only --watch takes more than one file')
+    if len(args.filenames) > 1 and args.outfile:
+        parser.error("-o can't name the output of more than one file")
+    if args.profile_memory and not args.profile:
+        parser.error('--profile-memory needs --profile')
+    if args.debounce < 0:
+        parser.error("--debounce can't be negative")
+    if args.instrument and args.target != 'javascript':
+        parser.error('--instrument is only supported by the javascript target')
+    if args.sample_every and args.target != 'javascript':
+        parser.error('--sample is only supported by the javascript target')
+    if args.bytecode and args.target != 'javascript':
+        parser.error('--bytecode is only supported by the javascript target')
+    if args.validate and args.target != 'javascript':
+        parser.error('--validate is only supported by the javascript target')
+    if args.ndjson and not args.entrypoint:
+        parser.error('--ndjson needs a parser to pass stdin to (see --stdin)')
+    if args.ndjson and args.target != 'javascript':
+        parser.error('--ndjson is only supported by the javascript target')
+    if args.workers is not None and not args.ndjson:
+        parser.error('--workers needs --ndjson')
+    if args.workers is not None and args.workers < 0:
+        parser.error("--workers can't be negative")
+    if args.workers is not None and args.sample_every:
+        parser.error("--sample can't record stacks on worker threads")
+    if not args.delimiter:
+        parser.error('--delimiter must not be empty')
+    if args.sample_every is not None and args.sample_every < 1:
+        parser.error('--sample needs a positive number of tokens')
+    elif args.analyze:
+        analyze_file(args)
     elif args.watch:
-        watch_file(args)
+        watch_files(args)
     else:
         compile_file(args)
 
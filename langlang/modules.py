@@ -0,0 +1,268 @@
+import copy
+from dataclasses import dataclass
+import hashlib
+import json
+import os
+from typing import Dict, Iterator, List, MutableMapping, Optional
+
+from parsing.ll_parser import parse_file
+from parsing.syntax_tree_utilities import set_additional_properties, walk
+from parsing.tokenizer import tokenize
+from parsing import ir
+from parsing import syntax_tree as ast
+from parsing import types
+
+# Typed modules are cached here, next to their source, like __pycache__. Each artifact is a line of
+# JSON describing it, followed by the typed tree as IR, so reading one never runs any code.
+CACHE_DIR = '__llcache__'
+# Bump whenever what the JSON line holds changes. The tree is versioned by the IR.
+ARTIFACT_VERSION = 3
+
+
+@dataclass
+class Module:
+    path: str
+    # Changes whenever the module's source, or any module it imports, changes.
+    key: str
+    tree: ast.StatementSequence
+    imports: List['Module']
+
+
+def import_paths(tree: ast.StatementSequence, directory: str) -> List[str]:
+    # Imports are relative to the importing file.
+    return [os.path.abspath(os.path.join(directory, stmt.path))
+        for stmt in tree.stmts if isinstance(stmt, ast.Import)]
+
+
+def imported_files(path: str) -> List[str]:
+    """Returns the path of every file the grammar at `path` imports, directly or not.
+
+    Only reads their imports, without typing anything. Imported files that can't be read or parsed
+    are still included, but not what they import.
+    """
+    path = os.path.abspath(path)
+    with open(path) as f:
+        pending = import_paths(parse_file(tokenize(f.read())), os.path.dirname(path))
+    found: List[str] = []
+    while pending:
+        import_path = pending.pop()
+        if import_path in found or import_path == path:
+            continue
+        found.append(import_path)
+        try:
+            with open(import_path) as f:
+                tree = parse_file(tokenize(f.read()))
+            pending.extend(import_paths(tree, os.path.dirname(import_path)))
+        except Exception:
+            # Compiling the grammar will report it.
+            continue
+    return found
+
+
+def module_key(source: str, imports: List[Module]) -> str:
+    key = hashlib.sha256(source.encode())
+    for module in imports:
+        key.update(module.key.encode())
+    return key.hexdigest()
+
+
+def imported_types(imports: List[Module]):
+    # The rules a module can call from the modules it imports directly.
+    return {stmt.name: stmt.type
+        for module in imports for stmt in module.tree.stmts if isinstance(stmt, ast.Def)}
+
+
+class ModuleLoader:
+    """Loads imported modules, typing each one once.
+
+    Typed modules are cached on disk and reused as long as neither they nor anything they import
+    has changed, so a build only re-parses the modules that were edited. Long-running processes
+    can also pass `memory`, a mapping shared between loaders that keeps the same artifacts by path
+    and is checked before the disk.
+    """
+    def __init__(self, use_cache: bool = True, memory: Optional[MutableMapping[str, Dict]] = None):
+        self.use_cache = use_cache
+        self.memory = memory
+        self.modules: Dict[str, Module] = {}
+        # Paths of the modules being loaded, to catch import cycles.
+        self.loading: List[str] = []
+        # Reported when profiling.
+        self.compiled = 0
+        self.reused = 0
+
+    def artifact_path(self, path: str) -> str:
+        directory, filename = os.path.split(path)
+        return os.path.join(directory, CACHE_DIR, f'{filename}.artifact')
+
+    def read_artifact(self, path: str) -> Optional[Dict]:
+        if self.memory is not None:
+            artifact = self.memory.get(path)
+            if artifact is not None:
+                return artifact
+        if not self.use_cache:
+            return None
+        try:
+            with open(self.artifact_path(path), 'rb') as f:
+                header, _, tree = f.read().partition(b'\n')
+            artifact = json.loads(header)
+            if artifact.get('version') != ARTIFACT_VERSION:
+                return None
+            artifact['tree'] = ir.loads(tree)
+        except Exception:
+            # Missing, corrupt, or from a version of the IR that can't be read any more.
+            return None
+        return artifact
+
+    def write_artifact(self, path: str, artifact: Dict):
+        if self.memory is not None:
+            self.memory[path] = artifact
+        if not self.use_cache:
+            return
+        artifact_path = self.artifact_path(path)
+        try:
+            os.makedirs(os.path.dirname(artifact_path), exist_ok=True)
+            header = {key: value for key, value in artifact.items() if key != 'tree'}
+            with open(artifact_path, 'wb') as f:
+                f.write(json.dumps(header).encode() + b'\n' + ir.dumps(artifact['tree']))
+        except OSError:
+            # The cache is only an optimization.
+            pass
+
+    def load(self, path: str, source: Optional[str] = None) -> Module:
+        # Reads the module from `path`, unless its source is given.
+        path = os.path.abspath(path)
+        if path in self.modules:
+            return self.modules[path]
+        if path in self.loading:
+            cycle = self.loading[self.loading.index(path):] + [path]
+            raise Exception(f'Import cycle: {" -> ".join(cycle)}')
+
+        if source is None:
+            with open(path) as f:
+                source = f.read()
+
+        # A cached artifact for the same source already knows what the module imports.
+        artifact = self.read_artifact(path)
+        tree = None
+        if artifact and artifact['source'] == hashlib.sha256(source.encode()).hexdigest():
+            paths = artifact['imports']
+        else:
+            tree = parse_file(tokenize(source))
+            paths = import_paths(tree, os.path.dirname(path))
+
+        self.loading.append(path)
+        try:
+            imports = [self.load(import_path) for import_path in paths]
+        finally:
+            self.loading.pop()
+
+        key = module_key(source, imports)
+        if artifact and artifact['key'] == key:
+            tree = artifact['tree']
+            self.reused += 1
+        else:
+            if tree is None:
+                tree = parse_file(tokenize(source))
+            set_additional_properties(tree, imported_types(imports))
+            self.write_artifact(path, {
+                'version': ARTIFACT_VERSION,
+                'source': hashlib.sha256(source.encode()).hexdigest(),
+                'imports': paths,
+                'key': key,
+                'tree': tree,
+            })
+            self.compiled += 1
+
+        module = self.modules[path] = Module(path, key, tree, imports)
+        return module
+
+
+def link(tree: ast.StatementSequence, imports: List[Module]) -> ast.StatementSequence:
+    """Returns the tree with every rule from the imported modules (and their imports) added.
+
+    Imported rules are never exported. Rules nobody uses are dropped later, by the assemblers.
+
+    Linked rules all share one namespace, but each module's calls have to keep meaning the rules
+    it could see: its own, and those of the modules it imports directly. So an imported rule whose
+    name is already taken, by the importing grammar or by an earlier module, is renamed along with
+    every call to it.
+    """
+    linked: List[Module] = []
+    seen = set()
+
+    def add(module: Module):
+        if module.path in seen:
+            return
+        seen.add(module.path)
+        for imported in module.imports:
+            add(imported)
+        linked.append(module)
+
+    for module in imports:
+        add(module)
+
+    # What each module's rules are called once linked. The importing grammar keeps its names.
+    original = {stmt.name for module in linked for stmt in module.tree.stmts
+        if isinstance(stmt, ast.Def)}
+    taken = {stmt.name for stmt in tree.stmts if isinstance(stmt, ast.Def)}
+    renamed: Dict[str, Dict[str, str]] = {}
+    for module in linked:
+        names = renamed[module.path] = {}
+        for stmt in module.tree.stmts:
+            if isinstance(stmt, ast.Def) and stmt.name not in names:
+                name = stmt.name
+                suffix = 2
+                while name in taken or (name != stmt.name and name in original):
+                    name = f'{stmt.name}_{suffix}'
+                    suffix += 1
+                names[stmt.name] = name
+                taken.add(name)
+
+    def visible(imports: List[Module], own: Dict[str, str]) -> Dict[str, str]:
+        # The rules a module can call, as set_additional_properties saw them: its own rules shadow
+        # imported ones, and later imports shadow earlier ones.
+        names = {}
+        for module in imports:
+            names.update(renamed[module.path])
+        names.update(own)
+        return names
+
+    def rename_calls(node: ast.Node, names: Dict[str, str]) -> ast.Node:
+        # Module trees are shared between compiles, so they're only copied if a call changes.
+        def calls(node: ast.Node) -> Iterator[ast.Var]:
+            return (child for child in walk(node)
+                if isinstance(child, ast.Var) and isinstance(child.type, types.Parser)
+                and names.get(child.name, child.name) != child.name)
+        if next(calls(node), None) is None:
+            return node
+        node = copy.deepcopy(node)
+        for call in calls(node):
+            call.name = names[call.name]
+        return node
+
+    stmts: List[ast.Node] = []
+    for module in linked:
+        names = visible(module.imports, renamed[module.path])
+        for stmt in module.tree.stmts:
+            if isinstance(stmt, ast.Def):
+                stmts.append(ast.Def(name=names[stmt.name], expr=rename_calls(stmt.expr, names),
+                    export=False))
+                stmts[-1].type = stmt.type
+                stmts[-1].storage_method = stmt.storage_method
+            elif isinstance(stmt, ast.Skip):
+                # There's only one lexer, so whatever an imported grammar skips is skipped
+                # everywhere.
+                stmts.append(stmt)
+
+    names = visible(imports,
+        {stmt.name: stmt.name for stmt in tree.stmts if isinstance(stmt, ast.Def)})
+    for stmt in tree.stmts:
+        if isinstance(stmt, ast.Def):
+            expr = rename_calls(stmt.expr, names)
+            if expr is not stmt.expr:
+                stmt = copy.copy(stmt)
+                stmt.expr = expr
+            stmts.append(stmt)
+        elif not isinstance(stmt, ast.Import):
+            stmts.append(rename_calls(stmt, names))
+    return ast.StatementSequence(stmts=stmts)
@@ -0,0 +1,269 @@
+from dataclasses import dataclass, field
+import math
+from typing import Dict, FrozenSet, List, Optional, Set
+
+from . import types
+from . import syntax_tree as ast
+from .syntax_tree_utilities import walk
+
+# Stands for the end of input in FOLLOW sets.
+END = '$'
+
+Tokens = FrozenSet[str]
+
+
+def token_name(node: ast.Node) -> str:
+    if isinstance(node, ast.LiteralParser):
+        return f'`{node.value}`'
+    else:
+        return f'r`{node.value}`'
+
+
+@dataclass
+class Analysis:
+    """FIRST and FOLLOW sets for every rule, plus warnings about grammar constructs that are
+    likely to backtrack a lot."""
+    first: Dict[str, Tokens] = field(default_factory=dict)
+    follow: Dict[str, Tokens] = field(default_factory=dict)
+    nullable: Dict[str, bool] = field(default_factory=dict)
+    # Most __test calls that can be running at once, or math.inf if guards recurse.
+    speculation_depth: Dict[str, float] = field(default_factory=dict)
+    warnings: List[str] = field(default_factory=list)
+
+    def report(self) -> str:
+        def show(tokens: Tokens) -> str:
+            return ', '.join(sorted(tokens)) or '(none)'
+
+        lines = ['Rules:']
+        for name in self.first:
+            depth = self.speculation_depth[name]
+            lines.append(f'  {name}')
+            lines.append(f'    FIRST:  {show(self.first[name])}')
+            lines.append(f'    FOLLOW: {show(self.follow[name])}')
+            lines.append(f'    nullable: {"yes" if self.nullable[name] else "no"}, '
+                f'speculation depth: {"unbounded" if depth == math.inf else depth}')
+
+        lines.append('Warnings:' if self.warnings else 'No warnings.')
+        lines.extend(f'  {warning}' for warning in self.warnings)
+        return '\n'.join(lines)
+
+
+class Analyzer:
+    def __init__(self, tree: ast.StatementSequence):
+        self.rules: Dict[str, ast.Def] = {
+            stmt.name: stmt for stmt in tree.stmts if isinstance(stmt, ast.Def)}
+        self.analysis = Analysis(
+            first={name: frozenset() for name in self.rules},
+            follow={name: frozenset() for name in self.rules},
+            nullable={name: False for name in self.rules},
+            speculation_depth={name: 0 for name in self.rules},
+        )
+        # See max_tokens.
+        self.rule_max_tokens: Dict[str, float] = {}
+        self.calling: Set[str] = set()
+
+    def called_rule(self, node: ast.Node) -> Optional[str]:
+        # The rule a Var calls, if it calls one rather than reading a value.
+        if isinstance(node, ast.Var) and isinstance(node.type, types.Parser) and node.name in self.rules:
+            return node.name
+        return None
+
+    # FIRST sets and nullability
+    def nullable(self, node: ast.Node) -> bool:
+        if isinstance(node, (ast.LiteralParser, ast.RegexParser)):
+            return False
+        elif isinstance(node, ast.Sequence):
+            return self.nullable(node.expr1) and self.nullable(node.expr2)
+        elif isinstance(node, ast.Peek):
+            # A peek without a default case consumes nothing when no case matches.
+            return (all(case_test for case_test, _ in node.cases)
+                or any(self.nullable(case_value) for _, case_value in node.cases))
+        elif isinstance(node, (ast.Named, ast.Debug)):
+            return self.nullable(node.expr)
+        elif isinstance(node, (ast.As, ast.Error)):
+            return self.nullable(node.parser)
+        elif self.called_rule(node):
+            return self.analysis.nullable[node.name]
+        else:
+            # Values consume no input.
+            return True
+
+    def first(self, node: ast.Node) -> Tokens:
+        if isinstance(node, (ast.LiteralParser, ast.RegexParser)):
+            return frozenset([token_name(node)])
+        elif isinstance(node, ast.Sequence):
+            first = self.first(node.expr1)
+            if self.nullable(node.expr1):
+                first |= self.first(node.expr2)
+            return first
+        elif isinstance(node, ast.Peek):
+            return frozenset().union(*(self.first(case_value) for _, case_value in node.cases))
+        elif isinstance(node, (ast.Named, ast.Debug)):
+            return self.first(node.expr)
+        elif isinstance(node, (ast.As, ast.Error)):
+            return self.first(node.parser)
+        elif self.called_rule(node):
+            return self.analysis.first[node.name]
+        else:
+            return frozenset()
+
+    # FOLLOW sets
+    def add_follows(self, node: ast.Node, follow: Tokens) -> bool:
+        # Adds to the FOLLOW set of every rule called by node. Returns whether any set grew.
+        if isinstance(node, ast.Sequence):
+            expr1_follow = self.first(node.expr2)
+            if self.nullable(node.expr2):
+                expr1_follow |= follow
+            changed = self.add_follows(node.expr1, expr1_follow)
+            return self.add_follows(node.expr2, follow) or changed
+        elif isinstance(node, ast.Peek):
+            # Guards only look ahead, so whatever follows them isn't part of the parse.
+            changed = False
+            for _, case_value in node.cases:
+                changed = self.add_follows(case_value, follow) or changed
+            return changed
+        elif isinstance(node, (ast.Named, ast.Debug)):
+            return self.add_follows(node.expr, follow)
+        elif isinstance(node, (ast.As, ast.Error)):
+            return self.add_follows(node.parser, follow)
+        elif self.called_rule(node):
+            old = self.analysis.follow[node.name]
+            self.analysis.follow[node.name] = old | follow
+            return self.analysis.follow[node.name] != old
+        else:
+            return False
+
+    # Speculation
+    def speculation_depth(self, node: ast.Node) -> float:
+        if isinstance(node, ast.Sequence):
+            return max(self.speculation_depth(node.expr1), self.speculation_depth(node.expr2))
+        elif isinstance(node, ast.Peek):
+            # A guarded body isn't speculative itself, but it can call rules that are.
+            return max(
+                max(1 + self.speculation_depth(case_test), self.speculation_depth(case_value))
+                if case_test else self.speculation_depth(case_value)
+                for case_test, case_value in node.cases)
+        elif isinstance(node, (ast.Named, ast.Debug)):
+            return self.speculation_depth(node.expr)
+        elif isinstance(node, (ast.As, ast.Error)):
+            return self.speculation_depth(node.parser)
+        elif self.called_rule(node):
+            return self.analysis.speculation_depth[node.name]
+        else:
+            return 0
+
+    def max_tokens(self, node: ast.Node) -> float:
+        # Most tokens the node can consume, or math.inf if it can recurse.
+        if isinstance(node, (ast.LiteralParser, ast.RegexParser)):
+            return 1
+        elif isinstance(node, ast.Sequence):
+            return self.max_tokens(node.expr1) + self.max_tokens(node.expr2)
+        elif isinstance(node, ast.Peek):
+            return max(self.max_tokens(case_value) for _, case_value in node.cases)
+        elif isinstance(node, (ast.Named, ast.Debug)):
+            return self.max_tokens(node.expr)
+        elif isinstance(node, (ast.As, ast.Error)):
+            return self.max_tokens(node.parser)
+        elif self.called_rule(node):
+            name = node.name
+            if name in self.calling:
+                return math.inf
+            # A rule only reaches a rule that's still being expanded if they're in a cycle, and
+            # then it's unbounded however it was reached. So each rule's result can be kept.
+            if name not in self.rule_max_tokens:
+                self.calling.add(name)
+                self.rule_max_tokens[name] = self.max_tokens(self.rules[name].expr)
+                self.calling.remove(name)
+            return self.rule_max_tokens[name]
+        else:
+            return 0
+
+    def check_peeks(self, rule: str, node: ast.Node):
+        # Warns about peek cases that can't be told apart by their first token, and guards that
+        # can speculate over unbounded input.
+        peeks = [n for n in walk(node) if isinstance(n, ast.Peek)]
+        for peek_number, peek in enumerate(peeks, 1):
+            where = f'{rule}, peek {peek_number}' if len(peeks) > 1 else f'{rule}, peek'
+            guards = [(i, case_test) for i, (case_test, _) in enumerate(peek.cases, 1) if case_test]
+
+            default = next((i for i, (case_test, _) in enumerate(peek.cases, 1) if not case_test), None)
+            if default is not None and default < len(peek.cases):
+                self.analysis.warnings.append(
+                    f'{where}: cases after the default case {default} can never match.')
+
+            for i, guard in guards:
+                if self.nullable(guard):
+                    self.analysis.warnings.append(
+                        f'{where}: case {i} can match without consuming input, so later cases '
+                        'can never match.')
+
+                length = self.max_tokens(guard)
+                if length == math.inf:
+                    self.analysis.warnings.append(
+                        f'{where}: case {i} calls a recursive rule, so testing it can read '
+                        'unbounded input before failing.')
+
+            for n, (i, guard_i) in enumerate(guards):
+                for j, guard_j in guards[n + 1:]:
+                    overlap = self.first(guard_i) & self.first(guard_j)
+                    if overlap:
+                        self.analysis.warnings.append(
+                            f'{where}: cases {i} and {j} can both start with '
+                            f'{", ".join(sorted(overlap))}, so telling them apart takes more than '
+                            'one token of lookahead.')
+
+            # Speculating inside a guard multiplies the work each failed case throws away.
+            depth = max((self.speculation_depth(guard) for _, guard in guards), default=0)
+            if depth >= 1:
+                self.analysis.warnings.append(
+                    f'{where}: testing a case speculates '
+                    f'{"without bound" if depth == math.inf else f"{depth + 1} levels deep"}, '
+                    'so backtracking can be exponential in the input.')
+
+    def run(self) -> Analysis:
+        analysis = self.analysis
+
+        # FIRST sets and nullability only grow, so iterate until nothing changes.
+        changed = True
+        while changed:
+            changed = False
+            for name, rule in self.rules.items():
+                first, nullable = self.first(rule.expr), self.nullable(rule.expr)
+                if first != analysis.first[name] or nullable != analysis.nullable[name]:
+                    analysis.first[name], analysis.nullable[name] = first, nullable
+                    changed = True
+
+        for name, rule in self.rules.items():
+            if rule.export:
+                analysis.follow[name] = frozenset([END])
+        changed = True
+        while changed:
+            changed = False
+            for name, rule in self.rules.items():
+                changed = self.add_follows(rule.expr, analysis.follow[name]) or changed
+
+        # Depths only grow too. If they're still growing after every rule could have been
+        # nested once, a guard is recursive.
+        for _ in range(len(self.rules) + 1):
+            depths = {name: self.speculation_depth(rule.expr) for name, rule in self.rules.items()}
+            if depths == analysis.speculation_depth:
+                break
+            analysis.speculation_depth = depths
+        else:
+            for name, rule in self.rules.items():
+                if self.speculation_depth(rule.expr) > len(self.rules):
+                    analysis.speculation_depth[name] = math.inf
+            # Anything calling an unbounded rule is unbounded too.
+            for _ in range(len(self.rules)):
+                analysis.speculation_depth = {
+                    name: self.speculation_depth(rule.expr) for name, rule in self.rules.items()}
+
+        for name, rule in self.rules.items():
+            self.check_peeks(name, rule.expr)
+
+        return analysis
+
+
+def analyze(tree: ast.StatementSequence) -> Analysis:
+    """Analyzes a typed syntax tree (see syntax_tree_utilities.set_additional_properties)."""
+    return Analyzer(tree).run()
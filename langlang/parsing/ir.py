@@ -0,0 +1,242 @@
+"""A compact binary format for typed syntax trees, so tools can skip the front end.
+
+Files start with MAGIC and a little-endian 16 bit IR_VERSION, followed by a table of every string
+in the tree and then the root node. Nodes, types and storage methods are a tag byte followed by
+their fields. Numbers are unsigned LEB128 varints, and strings are indexes into the table.
+"""
+import struct
+from typing import Any, Callable, Dict, List, Tuple
+
+from . import storage_methods as storage
+from . import syntax_tree as ast
+from . import types
+
+MAGIC = b'LLIR'
+# Bump whenever the layout of any node changes.
+IR_VERSION = 3
+
+# Tag and fields of each node class. Field kinds are:
+#   str, opt_str, bool, float: what they say
+#   node, opt_node: a child node
+#   nodes: a list of child nodes
+#   cases: a list of (optional test node, node) pairs
+#   map: a dict of strings to strings
+NODE_FIELDS: Dict[type, Tuple[int, List[Tuple[str, str]]]] = {
+    ast.LiteralParser: (1, [('value', 'str')]),
+    ast.RegexParser: (2, [('value', 'str')]),
+    ast.Sequence: (3, [('expr1', 'node'), ('expr2', 'node')]),
+    ast.FusedSequence: (4, [('parsers', 'nodes')]),
+    ast.Peek: (5, [('cases', 'cases')]),
+    ast.LitStr: (6, [('value', 'str')]),
+    ast.LitNum: (7, [('value', 'float')]),
+    ast.Var: (8, [('name', 'str')]),
+    ast.Struct: (9, [('name', 'opt_str'), ('map', 'map')]),
+    ast.Named: (10, [('expr', 'node'), ('name', 'str')]),
+    ast.Error: (11, [('parser', 'node'), ('message', 'str'), ('recovery', 'opt_node')]),
+    ast.As: (12, [('parser', 'node'), ('result', 'node')]),
+    ast.Debug: (13, [('expr', 'node')]),
+    ast.StatementSequence: (14, [('stmts', 'nodes')]),
+    ast.Import: (15, [('path', 'str')]),
+    ast.Def: (16, [('name', 'str'), ('expr', 'node'), ('export', 'bool')]),
+    ast.Skip: (17, [('patterns', 'nodes')]),
+}
+NODE_CLASSES = {tag: (cls, fields) for cls, (tag, fields) in NODE_FIELDS.items()}
+
+# Tag for annotations that haven't been set, including the `...` return type of a rule that's
+# still being typed.
+UNSET = 0
+TYPE_TAGS = {types.Null: 2, types.String: 3, types.Parser: 4, types.Struct: 5}
+STORAGE_TAGS = {storage.Ignore: 2, storage.Return: 3, storage.Var: 4}
+
+
+class IRError(Exception):
+    pass
+
+
+def is_ir(data: bytes) -> bool:
+    return data.startswith(MAGIC)
+
+
+def encode_varint(n: int, out: bytearray):
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def dumps(tree: ast.Node) -> bytes:
+    strings: Dict[str, int] = {}
+    body = bytearray()
+
+    def string(s: str):
+        encode_varint(strings.setdefault(s, len(strings)), body)
+
+    def type_(t: Any):
+        if t is ...:
+            body.append(UNSET)
+        elif isinstance(t, types.Parser):
+            body.append(TYPE_TAGS[types.Parser])
+            type_(t.ret)
+        elif isinstance(t, types.Struct):
+            body.append(TYPE_TAGS[types.Struct])
+            encode_varint(len(t.fields), body)
+            for key, value in t.fields.items():
+                string(key)
+                type_(value)
+        else:
+            body.append(TYPE_TAGS[type(t)])
+
+    def storage_method(s: Any):
+        if s is ...:
+            body.append(UNSET)
+        else:
+            body.append(STORAGE_TAGS[type(s)])
+            if isinstance(s, storage.Var):
+                string(s.name)
+
+    def node(n: ast.Node):
+        try:
+            tag, fields = NODE_FIELDS[type(n)]
+        except KeyError:
+            raise IRError(f'Unknown AST node: {n}') from None
+        body.append(tag)
+        type_(n.type)
+        storage_method(n.storage_method)
+
+        for name, kind in fields:
+            value = getattr(n, name)
+            if kind == 'str':
+                string(value)
+            elif kind in ('opt_str', 'opt_node'):
+                body.append(value is not None)
+                if value is not None:
+                    string(value) if kind == 'opt_str' else node(value)
+            elif kind == 'bool':
+                body.append(bool(value))
+            elif kind == 'float':
+                body.extend(struct.pack('<d', value))
+            elif kind == 'node':
+                node(value)
+            elif kind == 'nodes':
+                encode_varint(len(value), body)
+                for child in value:
+                    node(child)
+            elif kind == 'cases':
+                encode_varint(len(value), body)
+                for case_test, case_value in value:
+                    body.append(case_test is not None)
+                    if case_test is not None:
+                        node(case_test)
+                    node(case_value)
+            elif kind == 'map':
+                encode_varint(len(value), body)
+                for key, item in value.items():
+                    string(key)
+                    string(item)
+
+    node(tree)
+
+    out = bytearray(MAGIC)
+    out.extend(struct.pack('<H', IR_VERSION))
+    encode_varint(len(strings), out)
+    for s in strings:
+        encoded = s.encode()
+        encode_varint(len(encoded), out)
+        out.extend(encoded)
+    out.extend(body)
+    return bytes(out)
+
+
+def loads(data: bytes) -> ast.Node:
+    if not is_ir(data):
+        raise IRError('Not a langlang IR file')
+    version, = struct.unpack_from('<H', data, len(MAGIC))
+    if version != IR_VERSION:
+        raise IRError(f'IR version {version} is not supported (expected {IR_VERSION})')
+
+    position = len(MAGIC) + 2
+
+    def byte() -> int:
+        nonlocal position
+        position += 1
+        return data[position - 1]
+
+    def varint() -> int:
+        n = shift = 0
+        while True:
+            b = byte()
+            n |= (b & 0x7f) << shift
+            if b < 0x80:
+                return n
+            shift += 7
+
+    strings: List[str] = []
+
+    def string() -> str:
+        return strings[varint()]
+
+    def type_() -> Any:
+        tag = byte()
+        if tag == UNSET:
+            return ...
+        elif tag == TYPE_TAGS[types.Null]:
+            return types.Null()
+        elif tag == TYPE_TAGS[types.String]:
+            return types.String()
+        elif tag == TYPE_TAGS[types.Parser]:
+            return types.Parser(type_())
+        elif tag == TYPE_TAGS[types.Struct]:
+            return types.Struct({string(): type_() for _ in range(varint())})
+        raise IRError(f'Unknown type tag {tag} at byte {position - 1}')
+
+    def storage_method() -> Any:
+        tag = byte()
+        if tag == UNSET:
+            return ...
+        elif tag == STORAGE_TAGS[storage.Ignore]:
+            return storage.Ignore()
+        elif tag == STORAGE_TAGS[storage.Return]:
+            return storage.Return()
+        elif tag == STORAGE_TAGS[storage.Var]:
+            return storage.Var(string())
+        raise IRError(f'Unknown storage method tag {tag} at byte {position - 1}')
+
+    def node() -> ast.Node:
+        tag = byte()
+        try:
+            cls, fields = NODE_CLASSES[tag]
+        except KeyError:
+            raise IRError(f'Unknown node tag {tag} at byte {position - 1}') from None
+
+        n = cls.__new__(cls)
+        n.type = type_()
+        n.storage_method = storage_method()
+        for name, kind in fields:
+            setattr(n, name, readers[kind]())
+        return n
+
+    def float_() -> float:
+        nonlocal position
+        position += 8
+        return struct.unpack_from('<d', data, position - 8)[0]
+
+    readers: Dict[str, Callable[[], Any]] = {
+        'str': string,
+        'opt_str': lambda: string() if byte() else None,
+        'opt_node': lambda: node() if byte() else None,
+        'bool': lambda: bool(byte()),
+        'float': float_,
+        'node': node,
+        'nodes': lambda: [node() for _ in range(varint())],
+        'cases': lambda: [(node() if byte() else None, node()) for _ in range(varint())],
+        'map': lambda: {string(): string() for _ in range(varint())},
+    }
+
+    try:
+        for _ in range(varint()):
+            length = varint()
+            strings.append(data[position:position + length].decode())
+            position += length
+        return node()
+    except (IndexError, struct.error):
+        raise IRError('Truncated IR file') from None
@@ -18,7 +18,7 @@ def list_of(parser: Parser, minimum: int = 0, sep: Parser = None) -> Parser:
                 # Statefully changes the index
                 node = parser(tokens)
             except Exception as e:
-                tokens.index = backup
+                tokens.backtrack(backup)
                 if len(items) < minimum:
                     raise Exception(f'Too few items. Last error: {e}')
                 break
@@ -30,7 +30,7 @@ def list_of(parser: Parser, minimum: int = 0, sep: Parser = None) -> Parser:
                 try:
                     sep(tokens)
                 except Exception as e:
-                    tokens.index = backup
+                    tokens.backtrack(backup)
                     break
         return items
 
@@ -46,7 +46,7 @@ def first_of(*parsers: Parser) -> Parser:
                 return parser(tokens)
             except Exception as e:
                 err = e
-                tokens.index = backup
+                tokens.backtrack(backup)
 
         raise err
 
@@ -59,7 +59,7 @@ def optional(parser: Parser) -> Parser:
             # Statefully changes the index
             return parser(tokens)
         except:
-            tokens.index = backup
+            tokens.backtrack(backup)
             return None
 
     return ret
@@ -125,7 +125,7 @@ def parse_peek(tokens: TokenStream) -> ast.Node:
 # Order of operations, from least binding to most binding:
 # 1. As expression (e.g. `foo` as "bar")
 # 2. Sequence expression (e.g. `foo` `bar` `baz`)
-# 3. Error expressions (e.g. `foo` ! "Fooerror!")
+# 3. Error expressions (e.g. `foo` ! "Fooerror!" or `foo` ! "Fooerror!" recover `;`)
 def parse_atom(tokens: TokenStream) -> ast.Node:
     return first_of(
         parse_literal_parser,
@@ -140,11 +140,16 @@ def parse_error(tokens: TokenStream) -> ast.Node:
         need('bang')(tokens)
         return parse_string(tokens).value
 
+    def parse_recovery(tokens: TokenStream) -> ast.Node:
+        need('kw_recover')(tokens)
+        return parse_atom(tokens)
+
     ret = parse_atom(tokens)
 
     error_message = optional(parse_error)(tokens)
     if error_message:
-        ret = ast.Error(parser=ret, message=error_message)
+        recovery = optional(parse_recovery)(tokens)
+        ret = ast.Error(parser=ret, message=error_message, recovery=recovery)
 
     return ret
 
@@ -183,8 +188,18 @@ def parse_def(tokens: TokenStream) -> ast.Node:
     expr = parse_suffix(tokens)
     return ast.Def(name=name, expr=expr, export=export is not None)
 
+def parse_import(tokens: TokenStream) -> ast.Node:
+    need('kw_import')(tokens)
+    path = parse_string(tokens).value
+    return ast.Import(path=path[1:-1])
+
+def parse_skip(tokens: TokenStream) -> ast.Node:
+    need('kw_skip')(tokens)
+    patterns = list_of(first_of(parse_literal_parser, parse_regex_parser), minimum=1)(tokens)
+    return ast.Skip(patterns=patterns)
+
 def parse_statement(tokens: TokenStream) -> ast.Node:
-    return first_of(parse_debug, parse_def)(tokens)
+    return first_of(parse_import, parse_skip, parse_debug, parse_def)(tokens)
 
 def parse_value(tokens: TokenStream) -> ast.Node:
     return first_of(parse_var, parse_struct, parse_string)(tokens)
@@ -194,7 +209,7 @@ def parse_var(tokens: TokenStream) -> ast.Node:
     name = need('ident')(tokens).value
     
     if peek_type('doublecolon')(tokens):
-        tokens.index = backup
+        tokens.backtrack(backup)
         raise Exception('Variables can\'t be followed by colons. That would be a definition.')
 
     return ast.Var(name=name)
@@ -0,0 +1,170 @@
+import copy
+from typing import Callable, Dict, List, Optional, Set
+
+from . import storage_methods as storage
+from . import types
+from . import syntax_tree as ast
+from .syntax_tree_utilities import recursive_rules, set_additional_properties, walk
+
+# Rules with more nodes than this (after inlining their own callees) are still called.
+INLINE_SIZE = 8
+
+
+def rewrite(node: ast.Node, f: Callable[[ast.Node], ast.Node]) -> ast.Node:
+    # Rewrites the node's children, then the node itself. Modifies the tree in place.
+    if isinstance(node, ast.Sequence):
+        node.expr1 = rewrite(node.expr1, f)
+        node.expr2 = rewrite(node.expr2, f)
+    elif isinstance(node, ast.Peek):
+        node.cases = [(case_test and rewrite(case_test, f), rewrite(case_value, f))
+            for case_test, case_value in node.cases]
+    elif isinstance(node, (ast.Named, ast.Debug, ast.Def)):
+        node.expr = rewrite(node.expr, f)
+    elif isinstance(node, ast.As):
+        node.parser = rewrite(node.parser, f)
+        node.result = rewrite(node.result, f)
+    elif isinstance(node, ast.Error):
+        node.parser = rewrite(node.parser, f)
+        if node.recovery:
+            node.recovery = rewrite(node.recovery, f)
+    elif isinstance(node, ast.StatementSequence):
+        node.stmts = [rewrite(stmt, f) for stmt in node.stmts]
+
+    return f(node)
+
+
+def is_call(node: ast.Node) -> bool:
+    return isinstance(node, ast.Var) and isinstance(node.type, types.Parser)
+
+
+def inline_rules(tree: ast.StatementSequence):
+    # Replaces calls to small, non-recursive rules with a copy of their body. Rules that bind names
+    # are never inlined, since the names could clash with the caller's.
+    rules: Dict[str, ast.Def] = {}
+    for stmt in tree.stmts:
+        if isinstance(stmt, ast.Def):
+            rules[stmt.name] = None if stmt.name in rules else stmt
+
+    # None if the rule can't be inlined.
+    bodies: Dict[str, Optional[ast.Node]] = {}
+    # Found the first time a rule that calls other rules might be inlined.
+    recursive: Optional[Set[str]] = None
+
+    def is_recursive(name: str, rule: ast.Def) -> bool:
+        nonlocal recursive
+        if not any(is_call(n) for n in walk(rule.expr)):
+            return False
+        if recursive is None:
+            recursive = recursive_rules(tree)
+        return name in recursive
+
+    def inlined_body(name: str) -> Optional[ast.Node]:
+        if name not in bodies:
+            rule = rules[name]
+            # Also stops recursion while the body is being inlined.
+            bodies[name] = None
+            # Inlining never shrinks a body, so check its size before anything slower.
+            if (rule
+                    and sum(1 for _ in walk(rule.expr)) <= INLINE_SIZE
+                    and not any(isinstance(n, (ast.Named, ast.Debug)) for n in walk(rule.expr))
+                    and not is_recursive(name, rule)):
+                body = rewrite(copy.deepcopy(rule.expr), inline_call)
+                if sum(1 for _ in walk(body)) <= INLINE_SIZE:
+                    bodies[name] = body
+        return bodies[name]
+
+    def inline_call(node: ast.Node) -> ast.Node:
+        if is_call(node) and node.name in rules:
+            body = inlined_body(node.name)
+            if body:
+                return copy.deepcopy(body)
+        return node
+
+    for stmt in tree.stmts:
+        if isinstance(stmt, ast.Def):
+            stmt.expr = rewrite(stmt.expr, inline_call)
+
+
+def fold_as(node: ast.Node) -> ast.Node:
+    # `... [parser: x] as x` returns what the parser returned, so it doesn't need the name.
+    if isinstance(node, ast.As) and isinstance(node.result, ast.Var):
+        if isinstance(node.parser, ast.Named) and node.parser.name == node.result.name:
+            return node.parser.expr
+
+        last = node.parser
+        while isinstance(last, ast.Sequence) and isinstance(last.expr2, ast.Sequence):
+            last = last.expr2
+        if (isinstance(last, ast.Sequence) and isinstance(last.expr2, ast.Named)
+                and last.expr2.name == node.result.name):
+            last.expr2 = last.expr2.expr
+            return node.parser
+    return node
+
+
+def fuse_sequences(node: ast.Node) -> ast.Node:
+    # Turns runs of two or more tokens in a sequence into a single multi-token match. Runs after
+    # the type pass, so it sets types and storage methods itself.
+    if not isinstance(node, ast.Sequence):
+        return node
+
+    items: List[ast.Node] = []
+    rest = node
+    while isinstance(rest, ast.Sequence):
+        items.append(rest.expr1)
+        rest = rest.expr2
+    items.append(rest)
+
+    fused: List[ast.Node] = []
+    run: List[ast.Node] = []
+    for item in items + [None]:
+        if isinstance(item, (ast.LiteralParser, ast.RegexParser)):
+            run.append(item)
+            continue
+        elif isinstance(item, ast.FusedSequence):
+            # Sequences are rewritten innermost first, so the end of this one may be fused already.
+            run.extend(item.parsers)
+            continue
+
+        if len(run) > 1:
+            fused_sequence = ast.FusedSequence(run)
+            fused_sequence.type = run[-1].type
+            fused_sequence.storage_method = run[-1].storage_method
+            fused.append(fused_sequence)
+        else:
+            fused.extend(run)
+        run = []
+        if item:
+            fused.append(item)
+
+    if len(fused) == len(items):
+        return node
+
+    result = fused[-1]
+    for item in reversed(fused[:-1]):
+        result = ast.Sequence(item, result)
+        result.type = result.expr2.type
+        result.storage_method = result.expr2.storage_method
+        # Only the last item of a sequence stores its value.
+        item.storage_method = storage.Ignore()
+    return result
+
+
+def optimize(tree: ast.StatementSequence, level: int) -> ast.StatementSequence:
+    """Optimizes a typed syntax tree (see syntax_tree_utilities.set_additional_properties).
+
+    Level 0 does nothing. Level 1 inlines small rules and drops `as` results that just return the
+    last parser's value. Level 2 also fuses runs of tokens into one multi-token match.
+    """
+    if level < 1:
+        return tree
+
+    tree = copy.deepcopy(tree)
+    inline_rules(tree)
+    tree = rewrite(tree, fold_as)
+    # Inlining moves nodes into new contexts, so their storage methods have to be worked out again.
+    set_additional_properties(tree)
+
+    if level >= 2:
+        tree = rewrite(tree, fuse_sequences)
+
+    return tree
@@ -18,4 +18,4 @@ class Var(StorageMethod):
     name: str
 
     def as_prefix(self):
-        return 'let {} = '.format(self.name)
\ No newline at end of file
+        return 'var {} = '.format(self.name)
\ No newline at end of file
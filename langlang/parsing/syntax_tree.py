@@ -24,6 +24,11 @@ class Sequence(Node):
         self.expr1 = expr1
         self.expr2 = expr2
 
+class FusedSequence(Node):
+    # Made by the optimizer from a sequence of literal and regex parsers.
+    def __init__(self, parsers: List[Node]):
+        self.parsers = parsers
+
 class Peek(Node):
     def __init__(self, cases: List[Tuple[Node, Node]]):
         self.cases = cases
@@ -54,9 +59,10 @@ class Named(Node):
         self.name = name
 
 class Error(Node):
-    def __init__(self, parser: Node, message: str):
+    def __init__(self, parser: Node, message: str, recovery: Optional[Node] = None):
         self.parser = parser
         self.message = message
+        self.recovery = recovery
 
 class As(Node):
     def __init__(self, parser: Node, result: Node):
@@ -72,6 +78,15 @@ class StatementSequence(Node):
     def __init__(self, stmts: List[Node]):
         self.stmts = stmts
 
+class Import(Node):
+    def __init__(self, path: str):
+        self.path = path
+
+class Skip(Node):
+    # Text the lexer throws away, like comments, on top of whitespace.
+    def __init__(self, patterns: List[Node]):
+        self.patterns = patterns
+
 class Def(Node):
     def __init__(self, name: str, expr: Node, export: bool):
         self.name = name
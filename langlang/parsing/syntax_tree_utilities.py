@@ -1,14 +1,287 @@
 import copy
-from typing import Dict
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    # Before Python 3.11.
+    import sre_parse
 
 from . import types
 from . import syntax_tree as ast
 from . import storage_methods as storage
 
 
+def walk(node: ast.Node) -> Iterator[ast.Node]:
+    # Yields the node and everything beneath it, parents before children.
+    yield node
+
+    if isinstance(node, ast.Sequence):
+        yield from walk(node.expr1)
+        yield from walk(node.expr2)
+    elif isinstance(node, ast.FusedSequence):
+        for parser in node.parsers:
+            yield from walk(parser)
+    elif isinstance(node, ast.Peek):
+        for (case_test, case_value) in node.cases:
+            if case_test:
+                yield from walk(case_test)
+            yield from walk(case_value)
+    elif isinstance(node, (ast.Named, ast.Debug, ast.Def)):
+        yield from walk(node.expr)
+    elif isinstance(node, ast.As):
+        yield from walk(node.parser)
+        yield from walk(node.result)
+    elif isinstance(node, ast.Error):
+        yield from walk(node.parser)
+        if node.recovery:
+            yield from walk(node.recovery)
+    elif isinstance(node, ast.StatementSequence):
+        for stmt in node.stmts:
+            yield from walk(stmt)
+    elif isinstance(node, ast.Skip):
+        for pattern in node.patterns:
+            yield from walk(pattern)
+
+
+# Everything \s matches in either JavaScript or Python, which the runtimes skip between tokens.
+WHITESPACE = (
+    '\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f \x85\xa0\u1680\u2000\u2001\u2002\u2003\u2004\u2005\u2006'
+    '\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000\ufeff')
+
+CATEGORY_PATTERNS = {
+    'CATEGORY_DIGIT': r'\d', 'CATEGORY_NOT_DIGIT': r'\D',
+    # JavaScript's \s also matches a byte order mark.
+    'CATEGORY_SPACE': r'[\s\ufeff]', 'CATEGORY_NOT_SPACE': r'[^\s\ufeff]',
+    'CATEGORY_WORD': r'\w', 'CATEGORY_NOT_WORD': r'\W',
+}
+
+def class_matches(items, c: str) -> bool:
+    # Whether a parsed character class matches c.
+    negated = False
+    for op, av in items:
+        if str(op) == 'NEGATE':
+            negated = True
+        elif (str(op) == 'LITERAL' and chr(av) == c
+                or str(op) == 'RANGE' and av[0] <= ord(c) <= av[1]
+                or str(op) == 'CATEGORY' and re.match(CATEGORY_PATTERNS.get(str(av), r'[\s\S]'), c)):
+            return not negated
+    return negated
+
+def regex_starts(items, chars: str) -> Tuple[Set[str], bool]:
+    # The characters (out of chars, plus any literal ones) that a parsed regex can start with, and
+    # whether it can match nothing at all.
+    starts: Set[str] = set()
+    for op, av in items:
+        op = str(op)
+        if op in ('AT', 'ASSERT', 'ASSERT_NOT'):
+            # Anchors and lookarounds don't consume anything.
+            continue
+        elif op == 'LITERAL':
+            return starts | {chr(av)}, False
+        elif op == 'NOT_LITERAL':
+            return starts | (set(chars) - {chr(av)}), False
+        elif op == 'ANY':
+            return starts | set(chars), False
+        elif op == 'IN':
+            return starts | {c for c in chars if class_matches(av, c)}, False
+        elif op in ('BRANCH', 'SUBPATTERN', 'ATOMIC_GROUP', 'MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT'):
+            if op == 'BRANCH':
+                alternatives, nullable = av[1], False
+            elif op == 'SUBPATTERN':
+                alternatives, nullable = [av[-1]], False
+            elif op == 'ATOMIC_GROUP':
+                alternatives, nullable = [av], False
+            else:
+                alternatives, nullable = [av[2]], av[0] == 0
+            for alternative in alternatives:
+                first, empty = regex_starts(alternative, chars)
+                starts |= first
+                nullable = nullable or empty
+            if not nullable:
+                return starts, False
+        else:
+            # Backreferences, conditionals, and anything newer.
+            return starts | set(chars), False
+    return starts, True
+
+def leading_whitespace(node: ast.Node) -> str:
+    """Returns the whitespace characters the token of a literal or regex parser can start with.
+
+    The runtimes don't skip whitespace where a token starts with it, so grammars can match newlines
+    (or any other whitespace) themselves. Regexes that can't be parsed here count as starting with
+    any whitespace.
+    """
+    if isinstance(node, ast.LiteralParser):
+        return node.value[0] if node.value and node.value[0] in WHITESPACE else ''
+    try:
+        starts, nullable = regex_starts(sre_parse.parse(node.value), WHITESPACE)
+    except Exception:
+        return WHITESPACE
+    return WHITESPACE if nullable else ''.join(c for c in WHITESPACE if c in starts)
+
+
+def reachable_rules(tree: ast.StatementSequence, roots: Iterable[str]) -> Set[str]:
+    # Names of the rules that can be called, directly or not, from the root rules.
+    rules = {}
+    for stmt in tree.stmts:
+        if isinstance(stmt, ast.Def):
+            rules.setdefault(stmt.name, []).append(stmt)
+
+    reachable = set()
+    pending = [name for name in roots if name in rules]
+    while pending:
+        name = pending.pop()
+        if name in reachable:
+            continue
+        reachable.add(name)
+
+        for rule in rules[name]:
+            for node in walk(rule.expr):
+                if isinstance(node, ast.Var) and isinstance(node.type, types.Parser) and node.name in rules:
+                    pending.append(node.name)
+
+    return reachable
+
+
+def recursive_rules(tree: ast.StatementSequence) -> Set[str]:
+    # Names of the rules that can call themselves, directly or not. These are the rules in cycles
+    # of the call graph, found with one pass of Tarjan's strongly connected components algorithm.
+    # It keeps its own stack, so long call chains don't hit Python's recursion limit.
+    calls: Dict[str, List[str]] = {}
+    for stmt in tree.stmts:
+        if isinstance(stmt, ast.Def):
+            calls.setdefault(stmt.name, []).extend(node.name for node in walk(stmt.expr)
+                if isinstance(node, ast.Var) and isinstance(node.type, types.Parser))
+
+    index: Dict[str, int] = {}
+    # The lowest index reachable from each rule without leaving the stack.
+    low: Dict[str, int] = {}
+    stack: List[str] = []
+    on_stack: Set[str] = set()
+    recursive: Set[str] = set()
+
+    def visit(name: str):
+        index[name] = low[name] = len(index)
+        stack.append(name)
+        on_stack.add(name)
+        work.append((name, iter(calls[name])))
+
+    for root in calls:
+        if root in index:
+            continue
+        work: List[Tuple[str, Iterator[str]]] = []
+        visit(root)
+        while work:
+            name, callees = work[-1]
+            for callee in callees:
+                if callee not in calls:
+                    continue
+                if callee not in index:
+                    visit(callee)
+                    break
+                if callee in on_stack:
+                    low[name] = min(low[name], index[callee])
+            else:
+                work.pop()
+                if work:
+                    caller = work[-1][0]
+                    low[caller] = min(low[caller], low[name])
+                if low[name] == index[name]:
+                    component = []
+                    while not component or component[-1] != name:
+                        component.append(stack.pop())
+                        on_stack.discard(component[-1])
+                    if len(component) > 1 or name in calls[name]:
+                        recursive.update(component)
+
+    return recursive
+
+
+def remove_unreachable_rules(tree: ast.StatementSequence, entrypoint: str = None) -> ast.StatementSequence:
+    """Returns the tree without the rules that no exported rule (or the entrypoint) can call.
+
+    Tokens are only emitted for the rules that use them, so this drops unused tokens too. Needs
+    types, so run it after set_additional_properties.
+    """
+    roots = [stmt.name for stmt in tree.stmts if isinstance(stmt, ast.Def) and stmt.export]
+    if entrypoint:
+        roots.append(entrypoint)
+
+    reachable = reachable_rules(tree, roots)
+    pruned = copy.copy(tree)
+    pruned.stmts = [stmt for stmt in tree.stmts if not isinstance(stmt, ast.Def) or stmt.name in reachable]
+    return pruned
+
+
+class Scope:
+    """The names visible from some point in the tree.
+
+    Each frame only holds the names defined in it and points at the frame around it, so making a
+    new scope for a rule takes constant time no matter how many rules came before it.
+    """
+    def __init__(self, parent: Optional['Scope'] = None):
+        self.parent = parent
+        self.names: Dict[str, types.LLType] = {}
+
+    def child(self) -> 'Scope':
+        return Scope(self)
+
+    def define(self, name: str, type: types.LLType):
+        self.names[name] = type
+
+    def lookup(self, name: str) -> types.LLType:
+        frame = self
+        while frame is not None:
+            if name in frame.names:
+                return frame.names[name]
+            frame = frame.parent
+
+        raise Exception('Undefined variable: {}'.format(name))
+
+
+def used_names(node: ast.Node) -> Iterator[str]:
+    for child in walk(node):
+        if isinstance(child, ast.Var):
+            yield child.name
+        elif isinstance(child, ast.Struct):
+            yield from child.map.values()
+
+
+def typing_order(rules: List[ast.Def]) -> List[ast.Def]:
+    """Orders rules so that each one comes after the rules it uses, wherever that's possible.
+
+    Rules that use each other can't all come first, so whichever does sees the others return `...`.
+    """
+    by_name = {rule.name: rule for rule in rules}
+    order = []
+    # By id, since nodes aren't hashable. Iterative, so long chains of rules don't hit the
+    # recursion limit.
+    visited = set()
+    for root in rules:
+        if id(root) in visited:
+            continue
+        visited.add(id(root))
+        stack = [(root, used_names(root.expr))]
+        while stack:
+            rule, names = stack[-1]
+            for name in names:
+                used = by_name.get(name)
+                if used is not None and id(used) not in visited:
+                    visited.add(id(used))
+                    stack.append((used, used_names(used.expr)))
+                    break
+            else:
+                stack.pop()
+                order.append(rule)
+
+    return order
+
+
 def set_types_and_storage_methods(
     node: ast.Node,
-    scope: Dict[str, ast.Node],
+    scope: Scope,
     storage_method: storage.StorageMethod):
 
     node.storage_method = storage_method
@@ -29,7 +302,8 @@ def set_types_and_storage_methods(
             if case_test:
                 set_types_and_storage_methods(case_test, scope, storage.Ignore())
 
-            set_types_and_storage_methods(case_value, scope, storage_method)
+            # Cases run inside their own match function, which returns the matching case's value.
+            set_types_and_storage_methods(case_value, scope, storage.Return())
 
             # TODO: Figure out type rules for cases
             node.type = case_value.type
@@ -40,9 +314,9 @@ def set_types_and_storage_methods(
 
         if isinstance(node.type, types.Parser):
             # Naming a parser applies the name to the return value, not the parser itself.
-            scope[node.name] = node.type.ret
+            scope.define(node.name, node.type.ret)
         else:
-            scope[node.name] = node.type
+            scope.define(node.name, node.type)
 
     elif isinstance(node, ast.As):
         set_types_and_storage_methods(node.parser, scope, storage.Ignore())
@@ -51,38 +325,65 @@ def set_types_and_storage_methods(
 
     elif isinstance(node, ast.Error):
         set_types_and_storage_methods(node.parser, scope, storage_method)
+        if node.recovery:
+            set_types_and_storage_methods(node.recovery, scope, storage.Ignore())
         node.type = node.parser.type
 
     elif isinstance(node, ast.Debug):
-        set_types_and_storage_methods(node.expr, scope, storage_method)
+        # The value is always stored in a variable, so it can be printed before being used.
+        name = storage_method.name if isinstance(storage_method, storage.Var) else '__debug'
+        set_types_and_storage_methods(node.expr, scope, storage.Var(name))
         node.type = node.expr.type
 
     elif isinstance(node, ast.Var):
-        if node.name not in scope:
-            raise Exception('Undefined variable: {}'.format(node.name))
-
-        node.type = scope[node.name]
+        node.type = scope.lookup(node.name)
 
     elif isinstance(node, ast.Struct):
-        node.type = types.Struct(node.map)
+        node.type = types.Struct({key: scope.lookup(value) for key, value in node.map.items()})
 
     elif isinstance(node, ast.StatementSequence):
+        # Rules can be used before they're defined, so every rule is declared before any are typed.
+        # Declaring a rule shadows imported rules with the same name.
+        rules = [stmt for stmt in node.stmts if isinstance(stmt, ast.Def)]
+        for rule in rules:
+            scope.define(rule.name, types.Parser(...))
+
         for stmt in node.stmts:
-            set_types_and_storage_methods(stmt, scope, storage.Ignore())
+            if not isinstance(stmt, ast.Def):
+                set_types_and_storage_methods(stmt, scope, storage.Ignore())
+
+        # If a name is defined twice, the last definition wins.
+        last = {rule.name: rule for rule in rules}
+        for rule in typing_order(rules):
+            set_types_and_storage_methods(rule, scope, storage.Ignore())
+            if last[rule.name] is rule:
+                scope.define(rule.name, rule.type)
+
+        node.type = types.Null()
+
+    elif isinstance(node, ast.Import):
+        # The imported rules are already in scope. See modules.py.
+        node.type = types.Null()
 
-        node.type = types.Null
+    elif isinstance(node, ast.Skip):
+        for pattern in node.patterns:
+            set_types_and_storage_methods(pattern, scope, storage.Ignore())
+        node.type = types.Null()
 
     elif isinstance(node, ast.Def):
-        # TODO: Figure out recursion
-        inner_scope = copy.copy(scope)
-        inner_scope[node.name] = types.Parser(...)
-        set_types_and_storage_methods(node.expr, inner_scope, storage.Return())
-        node.type = types.Parser(node.expr.type)
-        scope[node.name] = node.type
+        # The rule itself is declared by the StatementSequence around it.
+        set_types_and_storage_methods(node.expr, scope.child(), storage.Return())
+        # A rule that ends by calling another rule returns what that rule returns.
+        ret = node.expr.type
+        node.type = types.Parser(ret.ret if isinstance(ret, types.Parser) else ret)
 
     else:
         raise Exception('Unknown node: {}'.format(type(node)))
 
 
-def set_additional_properties(ast: ast.Node):
-    set_types_and_storage_methods(ast, {}, storage.Ignore())
\ No newline at end of file
+def set_additional_properties(ast: ast.Node, imported: Dict[str, types.LLType] = None):
+    # Imported rules are typed by their own modules, so only their types are needed here.
+    scope = Scope()
+    for name, type in (imported or {}).items():
+        scope.define(name, type)
+    set_types_and_storage_methods(ast, scope, storage.Ignore())
\ No newline at end of file
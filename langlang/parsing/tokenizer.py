@@ -1,8 +1,9 @@
+import bisect
 from collections import namedtuple
 import re
-from typing import List
+from typing import List, Optional, Tuple
 
-Token = namedtuple('Token', ['type', 'value'])
+Token = namedtuple('Token', ['type', 'value', 'offset'])
 token_types = {
     # Ignored tokens
     'whitespace': re.compile(r'(?:\s|\n)+'),
@@ -16,6 +17,9 @@ token_types = {
     'kw_debug': re.compile(r'\bdebug\b'),
     'kw_template': re.compile(r'\btemplate\b'),
     'kw_as': re.compile(r'\bas\b'),
+    'kw_recover': re.compile(r'\brecover\b'),
+    'kw_import': re.compile(r'\bimport\b'),
+    'kw_skip': re.compile(r'\bskip\b'),
 
     # Symbols
     'oparen': re.compile(r'\('),
@@ -41,10 +45,35 @@ token_types = {
 }
 
 
+class SourcePositions:
+    """Converts source offsets into line and column numbers, both starting from 1.
+
+    The index of line starts is only built the first time a position is asked for, so sources
+    that tokenize and parse without errors never pay for it.
+    """
+    def __init__(self, source: str):
+        self.source = source
+        self.line_starts: Optional[List[int]] = None
+
+    def line_and_column(self, offset: int) -> Tuple[int, int]:
+        if self.line_starts is None:
+            self.line_starts = [0] + [match.end() for match in re.finditer('\n', self.source)]
+
+        line = bisect.bisect_right(self.line_starts, offset) - 1
+        return line + 1, offset - self.line_starts[line] + 1
+
+    def describe(self, offset: int) -> str:
+        line, column = self.line_and_column(offset)
+        return f'line {line}, column {column}'
+
+
 class TokenStream:
-    def __init__(self, tokens: List[Token]):
+    def __init__(self, tokens: List[Token], positions: SourcePositions = None):
         self.tokens = tokens
+        self.positions = positions
         self.index = 0
+        # Number of times a parser has rewound the stream, reported when profiling.
+        self.backtracks = 0
 
     def empty(self):
         return self.index >= len(self.tokens)
@@ -58,6 +87,10 @@ class TokenStream:
     def peek_type(self, type):
         return self.index < len(self.tokens) and self.peek().type == type
 
+    def backtrack(self, index: int):
+        self.index = index
+        self.backtracks += 1
+
     def next(self):
         token = self.peek()
 
@@ -68,7 +101,8 @@ class TokenStream:
         token = self.peek()
 
         if token.type != required_type:
-            raise Exception(f'Unexpected {token.type} ({token.value}); needed {required_type}')
+            location = f' at {self.positions.describe(token.offset)}' if self.positions else ''
+            raise Exception(f'Unexpected {token.type} ({token.value}){location}; needed {required_type}')
         
         self.index += 1
         return token
@@ -77,25 +111,24 @@ class TokenStream:
 def tokenize(source: str) -> TokenStream:
     index = 0
     tokens = []
+    positions = SourcePositions(source)
     # While there's still source left to consume...
     while index < len(source):
         # ...search through every available token...
         for token_type, regex in token_types.items():
-            match = regex.match(source[index:])
+            match = regex.match(source, index)
             # ...and if it matches the remaining text, add it to the list.
             if match:
                 if token_type != 'whitespace':
-                    tokens.append(Token(token_type, match.group(0)))
-                index += len(match.group(0))
+                    tokens.append(Token(token_type, match.group(0), index))
+                index = match.end()
                 break
         else:
             # Error case if no tokens matched.
-            line_start = source.rfind('\n', 0, index) + 1 # Off-by-one also fixes the not-found case!
-            line_end = source.find('\n', index)
-            if line_end is -1:
-                line_end = len(source) - 1
-            column = index - line_start
-            
-            raise ValueError(f'Unknown token: Column {column} of {source[line_start:line_end]} ("{source[index]}")')
-
-    return TokenStream(tokens)
\ No newline at end of file
+            line, column = positions.line_and_column(index)
+            line_start = positions.line_starts[line - 1]
+            line_end = source.find('\n', line_start)
+            line_text = source[line_start:line_end if line_end != -1 else len(source)]
+            raise ValueError(f'Unknown token at line {line}, column {column} of {line_text} ("{source[index]}")')
+
+    return TokenStream(tokens, positions)
@@ -1,28 +1,99 @@
-from dataclasses import dataclass
-from typing import Dict
+import threading
+from types import MappingProxyType
+from typing import Any, Mapping, Tuple
+import weakref
+
+# Every type still in use, keyed by its class and contents. Types are dropped once nothing refers
+# to them, so long-running processes (like the compile server) don't keep every type they've seen.
+interned: 'weakref.WeakValueDictionary[Tuple, LLType]' = weakref.WeakValueDictionary()
+# Held while adding a type, so two threads can't both add the same one.
+interned_lock = threading.Lock()
+
 
 class LLType:
-    pass
+    """Base class of all types.
+
+    Types are hash-consed: making a type equal to one that already exists returns the existing
+    object. Equality is identity, hashes are computed once, and types are immutable.
+    """
+    __slots__ = ('_key', '_hash', '__weakref__')
+
+    @classmethod
+    def _intern(cls, key: Tuple, **fields: Any) -> 'LLType':
+        key = (cls, *key)
+        existing = interned.get(key)
+        if existing is not None:
+            return existing
+
+        new = object.__new__(cls)
+        object.__setattr__(new, '_key', key)
+        object.__setattr__(new, '_hash', hash(key))
+        for name, value in fields.items():
+            object.__setattr__(new, name, value)
+        with interned_lock:
+            # Another thread may have made the same type in the meantime.
+            return interned.setdefault(key, new)
+
+    def __hash__(self):
+        return self._hash
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    # Copies of an interned type are the type itself.
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __repr__(self):
+        return f'{type(self).__name__}()'
+
 
-@dataclass
 class Null(LLType):
-    pass
+    __slots__ = ()
+
+    def __new__(cls):
+        return cls._intern(())
+
+    def __reduce__(self):
+        return (Null, ())
+
 
-@dataclass
 class String(LLType):
-    pass
+    __slots__ = ()
+
+    def __new__(cls):
+        return cls._intern(())
+
+    def __reduce__(self):
+        return (String, ())
+
 
-@dataclass
 class Parser(LLType):
-    ret: LLType
+    # `ret` is `...` while the rule itself is still being typed.
+    __slots__ = ('ret',)
+
+    def __new__(cls, ret: Any):
+        return cls._intern((ret,), ret=ret)
+
+    def __reduce__(self):
+        return (Parser, (self.ret,))
+
+    def __repr__(self):
+        return f'Parser({self.ret!r})'
+
 
-@dataclass
 class Struct(LLType):
-    fields: Dict[str, LLType]
+    __slots__ = ('fields',)
+
+    def __new__(cls, fields: Mapping[str, Any]):
+        # Field order doesn't matter.
+        return cls._intern(tuple(sorted(fields.items())), fields=MappingProxyType(dict(fields)))
 
-    def __eq__(self, other: LLType):
-        if not isinstance(other, Struct):
-            return False
+    def __reduce__(self):
+        return (Struct, (dict(self.fields),))
 
-        return all(self.fields[k] == other.fields[k] 
-            for k in set((*self.fields.keys(), *other.fields.keys())))
\ No newline at end of file
+    def __repr__(self):
+        return f'Struct({dict(self.fields)!r})'
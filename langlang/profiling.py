@@ -0,0 +1,70 @@
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+import json
+import time
+import tracemalloc
+from typing import Dict, Iterator, List, Optional
+
+
+@dataclass
+class Phase:
+    name: str
+    wall_ms: float = 0.0
+    # Only measured by profiles with `memory` set.
+    peak_memory_bytes: Optional[int] = None
+    counters: Dict[str, int] = field(default_factory=dict)
+
+
+class Profile:
+    """Wall time, peak memory and counters for each phase of a compile.
+
+    Pass one to `compile_source`, then print `report()` or `to_json()`.
+
+    Peak memory is only measured with `memory`, since tracing allocations slows some phases down
+    far more than others. The times from a profile that measures memory can't be compared with
+    each other, or with times measured without it.
+    """
+    def __init__(self, memory: bool = False):
+        self.memory = memory
+        self.phases: List[Phase] = []
+
+    def report(self) -> str:
+        lines = [f'{"phase":<28}{"wall ms":>10}{"peak KiB":>12}  counters']
+        for phase in self.phases:
+            counters = ', '.join(f'{k}={v}' for k, v in phase.counters.items())
+            peak = '-' if phase.peak_memory_bytes is None else f'{phase.peak_memory_bytes / 1024:.1f}'
+            lines.append(f'{phase.name:<28}{phase.wall_ms:>10.2f}{peak:>12}  {counters}')
+        lines.append(f'{"total":<28}{sum(p.wall_ms for p in self.phases):>10.2f}')
+        return '\n'.join(lines)
+
+    def to_json(self) -> str:
+        return json.dumps({'phases': [asdict(phase) for phase in self.phases]}, indent=2)
+
+
+@contextmanager
+def phase(profile: Optional[Profile], name: str) -> Iterator[Dict[str, int]]:
+    """Times the body as one phase of the profile, and yields its counters to fill in.
+
+    Does nothing but yield a throwaway dict if there's no profile.
+    """
+    if profile is None:
+        yield {}
+        return
+
+    started_tracing = profile.memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    if profile.memory:
+        tracemalloc.reset_peak()
+
+    result = Phase(name)
+    start = time.perf_counter()
+    try:
+        yield result.counters
+    finally:
+        result.wall_ms = (time.perf_counter() - start) * 1000
+        if profile.memory:
+            result.peak_memory_bytes = tracemalloc.get_traced_memory()[1]
+        if started_tracing:
+            tracemalloc.stop()
+        profile.phases.append(result)
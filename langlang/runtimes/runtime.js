@@ -3,46 +3,219 @@
 // This file autogenerated by langlang.
 // For details, see {{ help_url }}.
 
-class Parser {
+// Thrown by parsers when they fail. What failed is kept on the parser (see __fail), so failing,
+// which happens all the time while speculating, doesn't allocate or format anything. Only the
+// top-level functions turn failures into Errors.
+const __FAILED = Object.freeze({ failed: true });
+
+// Whitespace that isn't space, tab, or a newline, which __skip_whitespace checks by hand.
+const __OTHER_WHITESPACE = /\s/y;{% if token_whitespace %}
+
+// Whitespace that tokens can start with, which is only skipped where no token matches.
+const __TOKEN_WHITESPACE = {{ token_whitespace }};{% endif %}{% if skip %}
+
+// The grammar's `skip` patterns.
+const __SKIP = {{ skip }};{% endif %}
+
+{% if structs %}{{ structs }}
+
+{% endif %}class Parser {
     __tokens = {
 {{ tokens }}
-        "__whitespace": /^(?:\s|\n)+/,
-        "__unknown": /^[^\s\n]+/,
+        "__unknown": /[^\s\n]+/y,
     }
 
-    __tokenize(s) {
-        let tokens = [];
-        nextToken: while (s.length > 0) {
-            for (let type in this.__tokens) {
-                let result = this.__tokens[type].exec(s);
-                if (result !== null) {
-                    if (type != '__whitespace') {
-                        tokens.push({
-                            type: type,
-                            value: result[0],
-                        });
+    __skip_whitespace(input, position) {
+        // Returns the position after any whitespace and skipped text at position. The usual
+        // whitespace characters are checked by their codes, without running a regex.
+        while (position < input.length) {
+            let c = input.charCodeAt(position);
+            if (c === 32 || c === 10 || c === 9 || c === 13) {
+{% if token_whitespace %}                if (this.__starts_token(input, position)) {
+                    break;
+                }
+{% endif %}                position++;
+                continue;
+            }
+            if (c === 11 || c === 12 || c > 127) {
+                __OTHER_WHITESPACE.lastIndex = position;
+                if (__OTHER_WHITESPACE.test(input)) {
+{% if token_whitespace %}                    if (this.__starts_token(input, position)) {
+                        break;
                     }
-                    s = s.slice(result[0].length);
-                    continue nextToken;
+{% endif %}                    position++;
+                    continue;
                 }
+            }{% if skip %}
+
+            __SKIP.lastIndex = position;
+            if (__SKIP.test(input) && __SKIP.lastIndex > position) {
+                position = __SKIP.lastIndex;
+                continue;
+            }{% endif %}
+
+            break;
+        }
+        return position;
+    }{% if token_whitespace %}
+
+    __starts_token(input, position) {
+        // Whether a token starts with the whitespace at position.
+        if (!__TOKEN_WHITESPACE.includes(input[position])) {
+            return false;
+        }
+        for (let type in this.__tokens) {
+            let regex = this.__tokens[type];
+            regex.lastIndex = position;
+            if (regex.test(input)) {
+                return true;
             }
-            throw Error(`Internal error (this should never happen): ${s}`)
+        }
+        return false;
+    }{% endif %}
+
+    __lex(input, position) {
+        // Matches a single token starting at position, which mustn't be whitespace.
+        for (let type in this.__tokens) {
+            let regex = this.__tokens[type];
+            regex.lastIndex = position;
+            let result = regex.exec(input);
+            if (result !== null) {
+                return {
+                    type: type,
+                    value: result[0],
+                    offset: position,
+                };
+            }
+        }
+        throw Error(`Internal error (this should never happen): ${input.slice(position)}`)
+    }
+
+    __tokenize(input) {
+        let tokens = [];
+        let position = this.__skip_whitespace(input, 0);
+        while (position < input.length) {
+            let token = this.__lex(input, position);
+            tokens.push(token);
+            position = this.__skip_whitespace(input, position + token.value.length);
         }
         return tokens;
     }
 
-    constructor(input) {
-        this.tokens = this.__tokenize(input);
+    constructor(input, tokens = null) {
+        this.input = input;
+        this.tokens = tokens === null ? this.__tokenize(input) : tokens;
         this.index = 0;
+        // Only collected by __recover_all; null means errors are thrown immediately.
+        this.errors = null;
+        // Depth of __try and __test calls; errors while speculating are never recovered.
+        this.__speculating = 0;
+        // Offsets where each line starts, built by __location the first time an error needs it.
+        this.__line_starts = null;
+        // The last failure: where it happened, and either the token type expected there or a
+        // message. See __error.
+        this.__failed_index = 0;
+        this.__failed_expected = null;
+        this.__failed_message = null;
+        // The furthest index any token failed to match at, and every type expected there.
+        this.__furthest_failure = -1;
+        this.__furthest_expected = [];
+    }
+
+    __offset(index) {
+        // Where the token at index starts in the input.
+        let token = this.tokens[index];
+        return token === undefined ? this.input.length : token.offset;
+    }
+
+    __location(index) {
+        // Returns the offset, line and column (both from 1) of the token at index.
+        let offset = this.__offset(index);
+
+        if (this.__line_starts === null) {
+            this.__line_starts = [0];
+            for (let i = this.input.indexOf('\n'); i !== -1; i = this.input.indexOf('\n', i + 1)) {
+                this.__line_starts.push(i + 1);
+            }
+        }
+
+        let low = 0;
+        let high = this.__line_starts.length - 1;
+        while (low < high) {
+            let middle = (low + high + 1) >> 1;
+            if (this.__line_starts[middle] <= offset) {
+                low = middle;
+            }
+            else {
+                high = middle - 1;
+            }
+        }
+        return { offset: offset, line: low + 1, column: offset - this.__line_starts[low] + 1 };
+    }
+
+    __where(index) {
+        let { line, column } = this.__location(index);
+        return `line ${line}, column ${column}`;
+    }
+
+    __diagnostic(message) {
+        return Object.assign({ message: message }, this.__location(this.index));
+    }
+
+    __fail(type) {
+        // Fails because the token at the current index isn't the expected type.
+        let index = this.index;
+        this.__failed_index = index;
+        this.__failed_expected = type;
+        this.__failed_message = null;
+        if (index > this.__furthest_failure) {
+            this.__furthest_failure = index;
+            this.__furthest_expected.length = 0;
+        }
+        if (index === this.__furthest_failure && !this.__furthest_expected.includes(type)) {
+            this.__furthest_expected.push(type);
+        }
+        throw __FAILED;
+    }
+
+    __fail_with(message) {
+        // Fails with a custom error message.
+        this.__failed_index = this.index;
+        this.__failed_expected = null;
+        this.__failed_message = message;
+        throw __FAILED;
+    }
+
+    __error() {
+        // Builds an Error for the last failure, plus where the parse got furthest before failing.
+        let index = this.__failed_index;
+        let token = this.tokens[index];
+        let message = this.__failed_message;
+        if (message !== null) {
+            // Custom messages are used as they are.
+        }
+        else if (token === undefined) {
+            message = `Unexpected end of file at ${this.__where(index)}`;
+        }
+        else {
+            message = `Expected ${this.__failed_expected}, got ${token.type} at ${this.__where(index)}`;
+        }
+
+        let error = Error(message);
+        if (this.__furthest_failure >= 0) {
+            error.furthest = Object.assign(
+                { expected: this.__furthest_expected.slice() }, this.__location(this.__furthest_failure));
+        }
+        return error;
     }
 
     __next() {
         let token = this.tokens[this.index];
         if (token === undefined) {
-            throw Error('Unexpected end of file.')
+            this.__fail(null);
         }
         if (token.type === '___unknown') {
-            throw Error(`Unknown token: "${token.value}"`)
+            this.__fail_with(`Unknown token "${token.value}" at ${this.__where(this.index)}`);
         }
         this.index++;
         return token;
@@ -50,50 +223,659 @@ class Parser {
 
     __require(type) {
         // console.debug(`Requiring: ${type}`)
-        let token = this.__next();
-        if (token.type !== type) {
-            throw Error(`Expected ${type}, got ${token.type}`)
+        let token = this.tokens[this.index];
+        // Leave the index on the mismatched token, so recovery starts from there.
+        if (token === undefined || token.type !== type) {
+            this.__fail(type);
         }
+        this.index++;
         return token;
     }
 
-    __consume_all(parser) {
+    __skip(type) {
+        // Like __require, for tokens whose value isn't used.
+        let token = this.tokens[this.index];
+        if (token === undefined || token.type !== type) {
+            this.__require(type);
+        }
+        this.index++;
+    }
+
+    __require_seq(types) {
+        // Matches several tokens in a row with a single bounds check, and returns the last one.
+        let end = Math.min(this.index + types.length, this.tokens.length);
+        let i = 0;
+        while (this.index + i < end && this.tokens[this.index + i].type === types[i]) {
+            i++;
+        }
+        this.index += i;
+        if (i === types.length) {
+            return this.tokens[this.index - 1];
+        }
+        // Leaves the index on the mismatched token, like a sequence of __require calls would.
+        return this.__require(types[i]);
+    }
+
+    __consume(parser) {
+        // Runs the parser, and fails unless it matched every token.
         let result = this[parser]();
         if (this.index < this.tokens.length) {
-            throw Error(`Remaining tokens: ${this.tokens.slice(this.index).map((t) => t.value)}`)
+            this.__fail_with(`Remaining tokens at ${this.__where(this.index)}: ${this.tokens.slice(this.index).map((t) => t.value)}`);
         }
         return result;
     }
 
+    __consume_all(parser) {
+        try {
+            return this.__consume(parser);
+        }
+        catch (e) {
+            throw e === __FAILED ? this.__error() : e;
+        }
+    }
+
+    __recover_all(parser) {
+        // Like __consume_all, but collects every recoverable error and returns a partial result.
+        this.errors = [];
+        let result = null;
+        try {
+            result = this.__consume(parser);
+        }
+        catch (e) {
+            if (e !== __FAILED) {
+                throw e;
+            }
+            this.errors.push(this.__diagnostic(this.__error().message));
+        }
+        return { result: result, errors: this.errors };
+    }
+
+    __validate_all(parser) {
+        // Matches the input with the parser's validator, which builds no values, and returns where
+        // it failed, if it did.
+        try {
+            this.__consume(`__validate_${parser}`);
+            return { valid: true, error: null };
+        }
+        catch (e) {
+            if (e !== __FAILED) {
+                throw e;
+            }
+            return { valid: false, error: this.__diagnostic(this.__error().message) };
+        }
+    }
+
+    __recover(message, recovery) {
+        // Records the error, then skips tokens until the recovery parser matches.
+        if (this.errors === null || this.__speculating > 0) {
+            this.__fail_with(message);
+        }
+        this.errors.push(this.__diagnostic(message));
+        this.__speculating++;
+        try {
+            while (this.index < this.tokens.length) {
+                let backup = this.index;
+                try {
+                    recovery.call(this);
+                    return;
+                }
+                catch (e) {
+                    if (e !== __FAILED) {
+                        throw e;
+                    }
+                    this.index = backup + 1;
+                }
+            }
+        }
+        finally {
+            this.__speculating--;
+        }
+    }
+
     // Parser helper functions
     __try(parser) {
         // Returns the parser result, or null if the parser failed.
         let backup = this.index;
+        this.__speculating++;
         try {
             return parser.call(this);
         }
         catch (e) {
+            if (e !== __FAILED) {
+                throw e;
+            }
             this.index = backup;
             return null;
         }
+        finally {
+            this.__speculating--;
+        }
     }
 
     __test(parser) {
         // Returns true if the parser would succeed, false if it would not.
         let backup = this.index;
+        this.__speculating++;
         try {
             parser.call(this);
             return true;
         }
         catch (e) {
+            if (e !== __FAILED) {
+                throw e;
+            }
             return false;
         }
         finally {
             this.index = backup;
+            this.__speculating--;
         }
     }
-
+{% if program %}
+    __exec(pc, locals) {
+        // Runs a block of bytecode and returns its value. See Op in assemblers/javascript.py.
+        let value;
+        while (true) {
+            switch (__code[pc]) {
+                case 0: // END
+                    return value;
+                case 1: // REQUIRE token
+                    value = this.__require(__constants[__code[pc + 1]]).value;
+                    pc += 2;
+                    break;
+                case 2: // SKIP token
+                    this.__skip(__constants[__code[pc + 1]]);
+                    pc += 2;
+                    break;
+                case 3: // REQUIRE_SEQ tokens
+                    value = this.__require_seq(__constants[__code[pc + 1]]).value;
+                    pc += 2;
+                    break;
+                case 4: // CALL rule
+                    value = this[__constants[__code[pc + 1]]]();
+                    pc += 2;
+                    break;
+                case 5: // STORE local
+                    locals[__code[pc + 1]] = value;
+                    pc += 2;
+                    break;
+                case 6: // LOAD local
+                    value = locals[__code[pc + 1]];
+                    pc += 2;
+                    break;
+                case 7: // CONST constant
+                    value = __constants[__code[pc + 1]];
+                    pc += 2;
+                    break;
+                case 8: { // BUILD shape, local...
+                    let shape = __code[pc + 1];
+                    let [name, fields] = __shapes[shape];
+                    value = name === null ? {} : new (__struct_classes[shape] ??= __struct_class(name, fields))();
+                    for (let i = 0; i < fields.length; i++) {
+                        value[fields[i]] = locals[__code[pc + 2 + i]];
+                    }
+                    pc += 2 + fields.length;
+                    break;
+                }
+                case 9: { // PEEK count, binds, (test, body)...
+                    // Like the match functions the other backend makes, tests and cases that bind
+                    // names run on their own copy of the locals, so the names aren't seen after
+                    // the peek.
+                    let count = __code[pc + 1];
+                    let binds = __code[pc + 2];
+                    value = undefined;
+                    for (let i = pc + 3; i < pc + 3 + 2 * count; i += 2) {
+                        let test = __code[i];
+                        if (test < 0 || this.__test(function() { this.__exec(test, binds ? locals.slice() : locals); })) {
+                            value = this.__exec(__code[i + 1], binds ? locals.slice() : locals);
+                            break;
+                        }
+                    }
+                    pc += 3 + 2 * count;
+                    break;
+                }
+                case 10: { // TRY message, parser, recovery
+                    let message = __constants[__code[pc + 1]];
+                    let recovery = __code[pc + 3];
+                    try {
+                        value = this.__exec(__code[pc + 2], locals);
+                    }
+                    catch (e) {
+                        if (e !== __FAILED) {
+                            throw e;
+                        }
+                        if (recovery < 0) {
+                            this.__fail_with(message);
+                        }
+                        this.__recover(message, function() { this.__exec(recovery, locals); });
+                        value = undefined;
+                    }
+                    pc += 4;
+                    break;
+                }
+                case 11: // DEBUG
+                    console.log(JSON.stringify(value));
+                    pc += 1;
+                    break;
+                default:
+                    throw Error(`Internal error (this should never happen): opcode ${__code[pc]} at ${pc}`);
+            }
+        }
+    }
+{% endif %}
 {{ parsers }}
 }
+{% if program %}
+// ===============
+// Bytecode
+// ===============
+// Big literals load faster as JSON than as JavaScript.
+const __code = JSON.parse({{ program.code }});
+const __constants = {{ program.constants }};
+// Name (null if unnamed) and fields of each struct.
+const __shapes = JSON.parse({{ program.shapes }});
+
+// Makes the same class the non-bytecode output writes out for a named struct, the first time it's
+// built. Fields are always assigned in the same order, so instances still share a layout.
+function __struct_class(name, fields) {
+    const cls = class {
+        toJSON() {
+            const json = {};
+            for (const field of fields) {
+                json[field] = this[field];
+            }
+            json._type = this._type;
+            return json;
+        }
+    };
+    Object.defineProperty(cls, "name", { value: name });
+    cls.prototype._type = name;
+    return cls;
+}
+
+const __struct_classes = [];
+
+// Gathered first, like in IncrementalParser below.
+const __bytecode_rules = {};
+for (let [rule, block, size] of JSON.parse({{ program.rules }})) {
+    __bytecode_rules[rule] = function() {
+        return this.__exec(block, new Array(size));
+    };
+    // There's no separate validator; values are cheap to build here anyway.
+    __bytecode_rules[`__validate_${rule}`] = __bytecode_rules[rule];
+}
+Object.assign(Parser.prototype, __bytecode_rules);
+{% endif %}
+Parser.__rules = [{{ rules }}];
+{% if instrument %}
+
+// ===============
+// Instrumentation
+// ===============
+// Per-rule counters. Tokens and total_ms include nested rules, while self_ms doesn't. Time spent in
+// a recursive rule only counts towards its total_ms once.
+const __stats = {};
+// One frame per running rule, to attribute speculation and time spent in callees.
+const __stack = [];
+
+for (let rule of Parser.__rules) {
+    let stats = __stats[rule] = {
+        calls: 0, speculations: 0, try_failures: 0, exceptions: 0, tokens: 0, total_ms: 0, self_ms: 0,
+    };
+    let active = 0;
+
+    // Calls to the rule's validator (if it has one) count as calls to the rule.
+    for (let name of [rule, `__validate_${rule}`]) {
+        let body = Parser.prototype[name];
+        if (body === undefined) continue;
+        Parser.prototype[name] = function() {
+            let frame = { stats: stats, children_ms: 0 };
+            let index = this.index;
+            let start = performance.now();
+            stats.calls++;
+            active++;
+            __stack.push(frame);
+            try {
+                let result = body.call(this);
+                stats.tokens += this.index - index;
+                return result;
+            }
+            catch (e) {
+                stats.exceptions++;
+                throw e;
+            }
+            finally {
+                let elapsed = performance.now() - start;
+                __stack.pop();
+                active--;
+                stats.self_ms += elapsed - frame.children_ms;
+                if (active === 0) {
+                    stats.total_ms += elapsed;
+                }
+                if (__stack.length > 0) {
+                    __stack[__stack.length - 1].children_ms += elapsed;
+                }
+            }
+        };
+    }
+}
+
+const __test = Parser.prototype.__test;
+Parser.prototype.__test = function(parser) {
+    if (__stack.length > 0) {
+        __stack[__stack.length - 1].stats.speculations++;
+    }
+    return __test.call(this, parser);
+};
+
+const __try = Parser.prototype.__try;
+Parser.prototype.__try = function(parser) {
+    let result = __try.call(this, parser);
+    if (result === null && __stack.length > 0) {
+        __stack[__stack.length - 1].stats.try_failures++;
+    }
+    return result;
+};
+
+exports.__stats = () => JSON.parse(JSON.stringify(__stats));
+exports.__stats.reset = () => {
+    for (let stats of Object.values(__stats)) {
+        for (let key in stats) {
+            stats[key] = 0;
+        }
+    }
+};
+{% endif %}
+{% if sample_every %}
+
+// ===============
+// Sampling
+// ===============
+// Every {{ sample_every }} tokens consumed, the stack of running rules is counted. Speculation
+// shows up as a "peek" frame. __samples() returns the counts in the collapsed stack format
+// read by flamegraph tools.
+const __frames = [];
+const __samples = new Map();
+let __countdown = {{ sample_every }};
+
+for (let rule of Parser.__rules) {
+    for (let name of [rule, `__validate_${rule}`]) {
+        let body = Parser.prototype[name];
+        if (body === undefined) continue;
+        Parser.prototype[name] = function() {
+            __frames.push(rule);
+            try {
+                return body.call(this);
+            }
+            finally {
+                __frames.pop();
+            }
+        };
+    }
+}
+
+const __sampled_test = Parser.prototype.__test;
+Parser.prototype.__test = function(parser) {
+    __frames.push('peek');
+    try {
+        return __sampled_test.call(this, parser);
+    }
+    finally {
+        __frames.pop();
+    }
+};
+
+const __sampled_require = Parser.prototype.__require;
+Parser.prototype.__require = function(type) {
+    let token = __sampled_require.call(this, type);
+    if (--__countdown === 0) {
+        __countdown = {{ sample_every }};
+        let stack = __frames.join(';');
+        __samples.set(stack, (__samples.get(stack) || 0) + 1);
+    }
+    return token;
+};
+
+Parser.prototype.__skip = function(type) {
+    this.__require(type);
+};
+
+// Fused sequences match one token at a time here, so every token is counted.
+Parser.prototype.__require_seq = function(types) {
+    let token;
+    for (let type of types) {
+        token = this.__require(type);
+    }
+    return token;
+};
+
+exports.__samples = () => Array.from(__samples, ([stack, count]) => `${stack} ${count}\n`).join('');
+exports.__samples.reset = () => {
+    __samples.clear();
+    __countdown = {{ sample_every }};
+};
+exports.__samples.write = (path) => require('fs').writeFileSync(path, exports.__samples());
+{% endif %}
+
+class IncrementalParser extends Parser {
+    // Memoizes every rule by starting token, so a reparse after a small edit only reruns the
+    // rules that looked at tokens inside the edited window.
+    //
+    // Nothing after an edit is rewritten to account for it. Memo entries are kept in an array that
+    // lines up with the tokens, and only store token counts relative to where they start. Tokens
+    // from __split on store their offset relative to the end of the input, and tokens before it
+    // store their offset from the start. Each reparse moves __split to the edit, so only the tokens
+    // between it and the previous edit are converted.
+
+    constructor(input, tokens = null, memo = null, split = null) {
+        super(input, tokens);
+        // For each token index (and the end of the input), a map from rule to the entry for a call
+        // that started there.
+        this.memo = memo === null ? new Array(this.tokens.length + 1).fill(undefined) : memo;
+        this.__split = split === null ? this.tokens.length : split;
+        // Highest token index looked at by the rules currently running.
+        this.__furthest = 0;
+        this.result = null;
+        this.error = null;
+    }
+
+    __offset(index) {
+        let token = this.tokens[index];
+        if (token === undefined) {
+            return this.input.length;
+        }
+        return index < this.__split ? token.offset : token.offset + this.input.length;
+    }
+
+    __require(type) {
+        if (this.index > this.__furthest) {
+            this.__furthest = this.index;
+        }
+        return super.__require(type);
+    }
+
+    __skip(type) {
+        if (this.index > this.__furthest) {
+            this.__furthest = this.index;
+        }
+        super.__skip(type);
+    }
+
+    __require_seq(types) {
+        // Counts the whole sequence as looked at, even if it fails early.
+        let last = this.index + types.length - 1;
+        if (last > this.__furthest) {
+            this.__furthest = last;
+        }
+        return super.__require_seq(types);
+    }
+
+    __memoized(rule, body) {
+        let start = this.index;
+        let table = this.memo[start];
+        if (table === undefined) {
+            table = this.memo[start] = new Map();
+        }
+
+        // Entries count tokens from start: how many the rule consumed, and how far it looked.
+        let entry = table.get(rule);
+        if (entry === undefined) {
+            let furthest = this.__furthest;
+            this.__furthest = start;
+            entry = { length: 0, examined: 0, result: undefined, error: null };
+            try {
+                entry.result = body.call(this);
+            }
+            catch (e) {
+                if (e !== __FAILED) {
+                    throw e;
+                }
+                entry.error = {
+                    index: this.__failed_index - start,
+                    expected: this.__failed_expected,
+                    message: this.__failed_message,
+                };
+            }
+            entry.length = this.index - start;
+            entry.examined = this.__furthest - start;
+            this.__furthest = Math.max(furthest, this.__furthest);
+            table.set(rule, entry);
+        }
+        else {
+            this.__furthest = Math.max(this.__furthest, start + entry.examined);
+        }
+
+        this.index = start + entry.length;
+        if (entry.error !== null) {
+            this.__failed_index = start + entry.error.index;
+            this.__failed_expected = entry.error.expected;
+            this.__failed_message = entry.error.message;
+            throw __FAILED;
+        }
+        return entry.result;
+    }
+
+    __parse(parser) {
+        try {
+            this.result = this.__consume_all(parser);
+            this.error = null;
+        }
+        catch (e) {
+            this.result = null;
+            this.error = e;
+        }
+        return this;
+    }
+
+    __first_token_ending_at(offset) {
+        // Binary search for the first token that ends at or after offset.
+        let low = 0;
+        let high = this.tokens.length;
+        while (low < high) {
+            let middle = (low + high) >> 1;
+            if (this.__offset(middle) + this.tokens[middle].value.length < offset) {
+                low = middle + 1;
+            }
+            else {
+                high = middle;
+            }
+        }
+        return low;
+    }
+
+    __reparse({ offset, deleted, inserted }) {
+        // Returns a new parser for the edited input, reusing every token and memoized rule result
+        // outside the edited window. They're moved into the new parser rather than copied, so this
+        // one can't be reparsed again.
+        if (this.memo === null) {
+            throw Error('This parse has already been reparsed');
+        }
+        let tokens = this.tokens;
+        let memo = this.memo;
+        let input = this.input.slice(0, offset) + inserted + this.input.slice(offset + deleted);
+        let delta = inserted.length - deleted;
+
+        // Tokens are matched greedily, so a token that ends right where the edit starts may grow.
+        // Relexing starts at the end of the token before it, in case the edit is inside skipped
+        // text like a comment.
+        let relexed = this.__first_token_ending_at(offset);
+        let position = relexed === 0 ? 0 : this.__offset(relexed - 1) + tokens[relexed - 1].value.length;
+        let relexed_tokens = [];
+
+        // Relex until the lexer lands on the (shifted) start of an old token after the edit.
+        let resume = relexed;
+        while (resume < tokens.length && this.__offset(resume) < offset + deleted) {
+            resume++;
+        }
+        while (true) {
+            position = this.__skip_whitespace(input, position);
+            while (resume < tokens.length && this.__offset(resume) + delta < position) {
+                resume++;
+            }
+            if (resume < tokens.length && this.__offset(resume) + delta === position) {
+                break;
+            }
+            if (position >= input.length) {
+                resume = tokens.length;
+                break;
+            }
+            let token = this.__lex(input, position);
+            relexed_tokens.push(token);
+            position += token.value.length;
+        }
+
+        // Move the split to the edit. Offsets measured from the end don't change when text is
+        // inserted or deleted before them.
+        for (let i = this.__split; i < relexed; i++) {
+            tokens[i].offset += this.input.length;
+        }
+        for (let i = resume; i < this.__split; i++) {
+            tokens[i].offset -= this.input.length;
+        }
+        let split = relexed + relexed_tokens.length;
+
+        // Results that started before the edit are kept if they never looked at the relexed
+        // tokens, and results that started after it are kept as they are.
+        for (let start = 0; start < relexed; start++) {
+            let table = memo[start];
+            if (table === undefined) {
+                continue;
+            }
+            for (let [rule, entry] of table) {
+                if (start + entry.examined >= relexed) {
+                    table.delete(rule);
+                }
+            }
+        }
+        let removed = resume - relexed;
+        tokens = __splice(tokens, relexed, removed, relexed_tokens);
+        memo = __splice(memo, relexed, removed, new Array(relexed_tokens.length).fill(undefined));
+
+        this.tokens = null;
+        this.memo = null;
+        return new IncrementalParser(input, tokens, memo, split);
+    }
+}
+
+function __splice(array, start, count, items) {
+    // Like array.splice(start, count, ...items), which runs out of stack for huge paste-sized edits.
+    if (items.length <= 1000) {
+        array.splice(start, count, ...items);
+        return array;
+    }
+    return array.slice(0, start).concat(items, array.slice(start + count));
+}
+
+// Adding thousands of methods to a prototype one at a time is slow, so they're gathered first.
+const __memoized_rules = {};
+for (let rule of Parser.__rules) {
+    let body = Parser.prototype[rule];
+    __memoized_rules[rule] = function() {
+        return this.__memoized(rule, body);
+    };
+    // Validators aren't memoized, so ignored calls use the rule itself and share its results.
+    __memoized_rules[`__validate_${rule}`] = __memoized_rules[rule];
+}
+Object.assign(IncrementalParser.prototype, __memoized_rules);
 
 {{ exports }}
\ No newline at end of file
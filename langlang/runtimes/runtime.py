@@ -0,0 +1,162 @@
+# This file autogenerated by langlang.
+# For details, see {{ help_url }}.
+
+import bisect
+from collections import namedtuple
+import json
+import re
+
+Token = namedtuple('Token', ['type', 'value', 'offset'])
+
+
+class ParseError(Exception):
+    pass
+
+
+class Parser:
+    _tokens = [
+{{ tokens }}
+        ('__unknown', re.compile(r'[^\s\n]+')),
+    ]
+    # Whitespace, and the grammar's `skip` patterns.
+    _skip = re.compile({{ skip }}){% if token_whitespace %}
+    # Whitespace that tokens can start with, which is only skipped where no token matches.
+    _token_whitespace = {{ token_whitespace }}{% endif %}
+
+    def __init__(self, input):
+        self.input = input
+        self.tokens = self._tokenize(input)
+        self.index = 0
+        # Only collected by _recover_all; None means errors are raised immediately.
+        self.errors = None
+        # Depth of _try and _test calls; errors while speculating are never recovered.
+        self._speculating = 0
+        # Offsets where each line starts, built by _location the first time an error needs it.
+        self._line_starts = None
+
+    def _skip_whitespace(self, input, position):
+        # Returns the position after any whitespace and skipped text at position.
+        position = self._skip.match(input, position).end(){% if token_whitespace %}
+        while (position < len(input) and input[position] in self._token_whitespace
+                and not any(regex.match(input, position) for _, regex in self._tokens)):
+            position = self._skip.match(input, position + 1).end(){% endif %}
+        return position
+
+    def _tokenize(self, input):
+        tokens = []
+        position = self._skip_whitespace(input, 0)
+        while position < len(input):
+            for type, regex in self._tokens:
+                match = regex.match(input, position)
+                if match:
+                    tokens.append(Token(type, match.group(0), position))
+                    position = self._skip_whitespace(input, match.end())
+                    break
+            else:
+                raise ParseError(f'Internal error (this should never happen): {input[position:]}')
+        return tokens
+
+    def _location(self, index):
+        # Returns the offset, line and column (both from 1) of the token at index.
+        offset = self.tokens[index].offset if index < len(self.tokens) else len(self.input)
+
+        if self._line_starts is None:
+            self._line_starts = [0] + [match.end() for match in re.finditer('\n', self.input)]
+
+        line = bisect.bisect_right(self._line_starts, offset) - 1
+        return {'offset': offset, 'line': line + 1, 'column': offset - self._line_starts[line] + 1}
+
+    def _where(self, index):
+        location = self._location(index)
+        return f'line {location["line"]}, column {location["column"]}'
+
+    def _diagnostic(self, message):
+        return {'message': message, **self._location(self.index)}
+
+    def _require(self, type):
+        if self.index >= len(self.tokens):
+            raise ParseError(f'Unexpected end of file at {self._where(self.index)}')
+        token = self.tokens[self.index]
+        # Leave the index on the mismatched token, so recovery starts from there.
+        if token.type != type:
+            raise ParseError(f'Expected {type}, got {token.type} at {self._where(self.index)}')
+        self.index += 1
+        return token
+
+    def _require_seq(self, types):
+        # Matches several tokens in a row, and returns the last one.
+        i = 0
+        for token in self.tokens[self.index:self.index + len(types)]:
+            if token.type != types[i]:
+                break
+            i += 1
+        self.index += i
+        if i == len(types):
+            return self.tokens[self.index - 1]
+        # Leaves the index on the mismatched token, like a sequence of _require calls would.
+        return self._require(types[i])
+
+    def _consume_all(self, parser):
+        result = getattr(self, parser)()
+        if self.index < len(self.tokens):
+            remaining = ','.join(token.value for token in self.tokens[self.index:])
+            raise ParseError(f'Remaining tokens at {self._where(self.index)}: {remaining}')
+        return result
+
+    def _recover_all(self, parser):
+        # Like _consume_all, but collects every recoverable error and returns a partial result.
+        self.errors = []
+        result = None
+        try:
+            result = self._consume_all(parser)
+        except ParseError as e:
+            self.errors.append(self._diagnostic(str(e)))
+        return {'result': result, 'errors': self.errors}
+
+    def _recover(self, error, recovery):
+        # Records the error, then skips tokens until the recovery parser matches.
+        if self.errors is None or self._speculating > 0:
+            raise error
+        self.errors.append(self._diagnostic(str(error)))
+        self._speculating += 1
+        try:
+            while self.index < len(self.tokens):
+                backup = self.index
+                try:
+                    recovery()
+                    return
+                except ParseError:
+                    self.index = backup + 1
+        finally:
+            self._speculating -= 1
+
+    # Parser helper functions
+    def _try(self, parser):
+        # Returns the parser result, or None if the parser failed.
+        backup = self.index
+        self._speculating += 1
+        try:
+            return parser()
+        except ParseError:
+            self.index = backup
+            return None
+        finally:
+            self._speculating -= 1
+
+    def _test(self, parser):
+        # Returns True if the parser would succeed, False if it would not.
+        backup = self.index
+        self._speculating += 1
+        try:
+            parser()
+            return True
+        except ParseError:
+            return False
+        finally:
+            self.index = backup
+            self._speculating -= 1
+
+{{ parsers }}
+
+
+{{ exports }}
@@ -1,5 +1,145 @@
 process.stdin.setEncoding('utf8');
+{% if sample_every %}
 
+process.on('exit', () => {
+    if (process.env.LANGLANG_SAMPLES) {
+        exports.__samples.write(process.env.LANGLANG_SAMPLES);
+    }
+});
+{% endif %}
+{% if ndjson %}
+
+// Every record is parsed on its own, and written out as soon as it's parsed, as a line of JSON:
+// {"result": ...} if it parsed, or {"error": "..."} if it didn't.
+const __DELIMITER = {{ delimiter }};
+
+// Whatever came after the last delimiter so far.
+let __partial = '';
+
+function __take_records(chunk) {
+    // Returns the text of every record the chunk completes.
+    let text = __partial + chunk;
+    let end = text.lastIndexOf(__DELIMITER);
+    if (end === -1) {
+        __partial = text;
+        return '';
+    }
+    __partial = text.slice(end + __DELIMITER.length);
+    return text.slice(0, end);
+}
+
+function __parse_records(text) {
+    // Returns the output lines for the records in text, and whether any of them failed. Empty
+    // records are skipped.
+    let output = '';
+    let failed = false;
+    for (let record of text.split(__DELIMITER)) {
+        if (__DELIMITER === '\n' && record.endsWith('\r')) {
+            record = record.slice(0, -1);
+        }
+        if (record === '') {
+            continue;
+        }
+        try {
+            output += JSON.stringify({ result: exports.{{ entrypoint }}(record) }) + '\n';
+        }
+        catch (e) {
+            output += JSON.stringify({ error: e.message }) + '\n';
+            failed = true;
+        }
+    }
+    return { output: output, failed: failed };
+}
+
+let __failed = false;
+
+function __write({ output, failed }) {
+    // Stops reading input until stdout catches up, so a slow reader doesn't fill up memory.
+    __failed = __failed || failed;
+    if (output !== '' && !process.stdout.write(output)) {
+        process.stdin.pause();
+        process.stdout.once('drain', () => process.stdin.resume());
+    }
+}
+{% if workers is not none %}
+const { isMainThread, parentPort, Worker } = require('worker_threads');
+
+if (isMainThread) {
+    // Each chunk of input is a batch, parsed by whichever worker is free. Batches can finish in
+    // any order, but are written in the order they were read.
+    const workers = [];
+    const idle = [];
+    const queue = [];
+    const finished = new Map();
+    let read = 0;
+    let written = 0;
+    let ended = false;
+
+    function dispatch() {
+        while (idle.length > 0 && queue.length > 0) {
+            idle.pop().postMessage(queue.shift());
+        }
+        if (queue.length >= workers.length || process.stdout.writableNeedDrain) {
+            process.stdin.pause();
+        }
+        else if (!ended) {
+            process.stdin.resume();
+        }
+    }
+
+    const count = {{ workers }} || require('os').cpus().length;
+    for (let i = 0; i < count; i++) {
+        let worker = new Worker(__filename);
+        worker.on('message', ({ id, output, failed }) => {
+            idle.push(worker);
+            finished.set(id, { output: output, failed: failed });
+            while (finished.has(written)) {
+                __write(finished.get(written));
+                finished.delete(written++);
+            }
+            dispatch();
+            if (ended && written === read) {
+                workers.forEach((worker) => worker.terminate());
+                process.exitCode = __failed ? 1 : 0;
+            }
+        });
+        worker.on('error', (e) => {
+            console.error(e.message);
+            process.exit(1);
+        });
+        workers.push(worker);
+        idle.push(worker);
+    }
+
+    process.stdin.on('data', (chunk) => {
+        let text = __take_records(chunk);
+        if (text !== '') {
+            queue.push({ id: read++, text: text });
+            dispatch();
+        }
+    });
+    process.stdin.on('end', () => {
+        ended = true;
+        queue.push({ id: read++, text: __partial });
+        dispatch();
+    });
+}
+else {
+    parentPort.on('message', ({ id, text }) => {
+        let { output, failed } = __parse_records(text);
+        parentPort.postMessage({ id: id, output: output, failed: failed });
+    });
+}
+{% else %}
+process.stdin.on('data', (chunk) => {
+    __write(__parse_records(__take_records(chunk)));
+});
+process.stdin.on('end', () => {
+    __write(__parse_records(__partial));
+    process.exitCode = __failed ? 1 : 0;
+});
+{% endif %}
+{% else %}
 // I just want to say - Node IO is stupid.
 process.stdin.on('readable', () => {
     let input = '';
@@ -15,4 +155,4 @@ process.stdin.on('readable', () => {
         console.error(e.message);
         process.exit(1);
     }
-});
\ No newline at end of file
+});{% endif %}
\ No newline at end of file
@@ -0,0 +1,10 @@
+
+
+if __name__ == '__main__':
+    import sys
+
+    try:
+        print(json.dumps({{ entrypoint }}(sys.stdin.read()), indent=2))
+    except ParseError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
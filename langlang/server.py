@@ -0,0 +1,139 @@
+"""A compile server, for editors and build tools that compile the same grammars over and over.
+
+Clients connect to a Unix socket and send requests as lines of JSON. Each one is answered with a
+line of JSON carrying the same "id", in the order the requests were sent:
+
+    {"id": 1, "command": "compile", "path": "/src/calc.ll", "target": "python"}
+    {"id": 1, "output": "..."}
+    {"id": 2, "command": "check", "path": "/src/calc.ll", "source": "export calc :: numbr"}
+    {"id": 2, "error": "..."}
+
+Every command but "stats" names a grammar file by "path", and can send its "source" to use
+instead of what's on disk (like an editor's unsaved buffer). The commands are:
+
+    compile: responds with the compiled "output". Takes "entrypoint", "target",
+             "optimization_level" and "options", which mean the same as compile_tree's arguments.
+    check: parses and types the grammar, and responds with "ok".
+    analyze: responds with the "report" and "warnings" from parsing.analysis.
+    stats: responds with how often the caches below were used.
+
+Typed modules and compiled outputs are kept in memory (up to `cache_size` of each, dropping the
+least recently used first), so recompiling a grammar only redoes the work for the files that
+changed. Each connection is served by its own thread.
+"""
+from collections import OrderedDict
+import json
+import socketserver
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+from parsing.analysis import analyze
+import modules
+
+
+class LRUCache:
+    """A mapping that drops its least recently used entries once it holds more than `size`.
+
+    Safe to share between threads.
+    """
+    def __init__(self, size: int):
+        self.size = size
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def __setitem__(self, key: Hashable, value: Any):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def stats(self) -> Dict[str, int]:
+        return {'entries': len(self), 'hits': self.hits, 'misses': self.misses}
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError('expected an object')
+            except ValueError as e:
+                response = {'id': None, 'error': f'Bad request: {e}'}
+            else:
+                response = self.server.respond(request)
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+
+
+class CompileServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, compile_tree: Callable, cache_size: int = 64):
+        # langlang.py is usually run as a script, so it passes its compile_tree in instead of this
+        # module importing it.
+        super().__init__(socket_path, Handler)
+        self.compile_tree = compile_tree
+        # Typed modules by path, shared by every request's ModuleLoader.
+        self.modules = LRUCache(cache_size)
+        self.outputs = LRUCache(cache_size)
+
+    def load(self, request: Dict) -> modules.Module:
+        if not isinstance(request.get('path'), str):
+            raise ValueError('Requests need the "path" of a grammar')
+        # Nothing is written to the disk cache, so the server never races a build that uses it.
+        loader = modules.ModuleLoader(use_cache=False, memory=self.modules)
+        return loader.load(request['path'], request.get('source'))
+
+    def compile(self, request: Dict) -> str:
+        module = self.load(request)
+        entrypoint = request.get('entrypoint')
+        target = request.get('target', 'javascript')
+        optimization_level = request.get('optimization_level', 1)
+        options = request.get('options', {})
+
+        # The module key covers the source of the grammar and everything it imports.
+        key = (module.key, entrypoint, target, optimization_level, json.dumps(options, sort_keys=True))
+        output = self.outputs.get(key)
+        if output is None:
+            tree = modules.link(module.tree, module.imports)
+            output = self.compile_tree(tree, entrypoint, target, None, optimization_level, **options)
+            self.outputs[key] = output
+        return output
+
+    def respond(self, request: Dict) -> Dict:
+        response = {'id': request.get('id')}
+        command = request.get('command')
+        try:
+            if command == 'compile':
+                response['output'] = self.compile(request)
+            elif command == 'check':
+                self.load(request)
+                response['ok'] = True
+            elif command == 'analyze':
+                module = self.load(request)
+                analysis = analyze(modules.link(module.tree, module.imports))
+                response['report'] = analysis.report()
+                response['warnings'] = analysis.warnings
+            elif command == 'stats':
+                response['modules'] = self.modules.stats()
+                response['outputs'] = self.outputs.stats()
+            else:
+                raise ValueError(f'Unknown command: {command}')
+        except Exception as e:
+            response['error'] = str(e)
+        return response
@@ -0,0 +1,132 @@
+"""Recompiles grammar files when they change, for --watch.
+
+Editors often save with a burst of events (or by writing a temporary file and renaming it over the
+original), so each file is only compiled once it's gone `debounce` seconds without changing. Files
+are compiled one at a time on a background thread, and if a file changes again while it's being
+compiled, that compile's output is thrown away instead of written.
+
+The files each grammar imports are watched too, and changing one recompiles every grammar that
+imports it. They're found again whenever the grammar is recompiled, in case its imports changed.
+"""
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+
+from watchdog.events import (EVENT_TYPE_CLOSED, EVENT_TYPE_CREATED, EVENT_TYPE_MODIFIED,
+    EVENT_TYPE_MOVED, FileSystemEvent, FileSystemEventHandler)
+
+# Events that can leave a file with new contents.
+CHANGE_EVENTS = {EVENT_TYPE_CLOSED, EVENT_TYPE_CREATED, EVENT_TYPE_MODIFIED, EVENT_TYPE_MOVED}
+
+
+class Watcher(FileSystemEventHandler):
+    def __init__(self, paths: Iterable[str], compile: Callable[[str], Tuple[str, bytes]],
+            debounce: float = 0.1, imports: Optional[Callable[[str], Iterable[str]]] = None,
+            schedule: Optional[Callable[[str], None]] = None):
+        # `compile` takes a path, and returns the file to write the output to and the output.
+        # `imports` takes a path, and returns every file it imports, directly or not. `schedule` is
+        # called with each directory that has files to watch, as they're found.
+        self.paths = {os.path.abspath(path) for path in paths}
+        self.compile = compile
+        self.debounce = debounce
+        self.imports = imports
+        self.schedule = schedule
+        self.directories: Set[str] = set()
+        # For each imported file, the watched files that import it.
+        self.dependents: Dict[str, Set[str]] = {}
+        self.condition = threading.Condition()
+        # When each changed file will have been quiet for long enough to compile.
+        self.due: Dict[str, float] = {}
+        # Bumped by every change, so a compile can tell whether its file changed after it started.
+        self.generations: Dict[str, int] = {path: 0 for path in self.paths}
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        for path in sorted(self.paths):
+            self.watch_directory(os.path.dirname(path))
+            self.find_imports(path)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.thread.join()
+
+    def on_any_event(self, event: FileSystemEvent):
+        if event.event_type not in CHANGE_EVENTS:
+            return
+        # Renaming a temporary file over a watched one changes the file at dest_path.
+        for path in {event.src_path, getattr(event, 'dest_path', '')}:
+            path = os.path.abspath(os.fsdecode(path))
+            with self.condition:
+                affected = ({path} & self.paths) | self.dependents.get(path, set())
+            for changed in sorted(affected):
+                self.changed(changed)
+
+    def watch_directory(self, directory: str):
+        if directory not in self.directories:
+            self.directories.add(directory)
+            if self.schedule:
+                self.schedule(directory)
+
+    def find_imports(self, path: str):
+        if self.imports is None:
+            return
+        try:
+            imports = {os.path.abspath(imported) for imported in self.imports(path)}
+        except Exception:
+            # Compiling it will report what's wrong. Until then, keep watching what it imported.
+            return
+        with self.condition:
+            for dependents in self.dependents.values():
+                dependents.discard(path)
+            for imported in imports:
+                self.dependents.setdefault(imported, set()).add(path)
+        for imported in sorted(imports):
+            self.watch_directory(os.path.dirname(imported))
+
+    def changed(self, path: str):
+        with self.condition:
+            self.generations[path] += 1
+            self.due[path] = time.monotonic() + self.debounce
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while True:
+                    if self.stopped:
+                        return
+                    now = time.monotonic()
+                    ready = [path for path, due in self.due.items() if due <= now]
+                    if ready:
+                        break
+                    self.condition.wait(min(self.due.values()) - now if self.due else None)
+                path = min(ready, key=self.due.__getitem__)
+                del self.due[path]
+                generation = self.generations[path]
+            self.recompile(path, generation)
+
+    def recompile(self, path: str, generation: int):
+        print(f'Recompiling {path}')
+        self.find_imports(path)
+        try:
+            outfile, output = self.compile(path)
+        except Exception as e:
+            print(f'Failed to compile {path}: {e}')
+            return
+
+        with self.condition:
+            if self.generations[path] != generation:
+                # It'll be compiled again once it's quiet.
+                print(f'{path} changed while compiling, so the output was dropped')
+                return
+        try:
+            with open(outfile, 'wb') as f:
+                print(f'Writing output to {outfile}')
+                f.write(output)
+        except OSError as e:
+            print(f'Failed to write {outfile}: {e}')
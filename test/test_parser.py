@@ -1,6 +1,13 @@
+import copy
+import gc
+import pickle
 import unittest
 
+from parsing import ir
+from parsing import types
 from parsing import syntax_tree as ast
+from parsing.analysis import analyze
+from parsing.syntax_tree_utilities import recursive_rules, set_additional_properties, walk
 from parsing.tokenizer import tokenize
 from parsing.ll_parser import (
     parse_atom,
@@ -13,6 +20,7 @@ from parsing.ll_parser import (
     parse_peek,
     parse_regex_parser,
     parse_sequence,
+    parse_skip,
     parse_string,
     parse_struct,
     parse_suffix,
@@ -20,6 +28,14 @@ from parsing.ll_parser import (
 )
 
 class TestParser(unittest.TestCase):
+    def test_token_positions(self):
+        tokens = tokenize('foo :: `bar`\n  baz')
+        self.assertEqual([token.offset for token in tokens.tokens], [0, 4, 7, 15])
+        self.assertEqual(tokens.positions.line_and_column(0), (1, 1))
+        self.assertEqual(tokens.positions.line_and_column(15), (2, 3))
+        self.assertRaisesRegex(ValueError, 'line 2, column 3', tokenize, 'foo\n  %')
+        self.assertRaisesRegex(Exception, 'line 2, column 3', parse_literal_parser, tokenize('\n  foo'))
+
     def test_parse_literal_parser(self):
         self.assertEqual(parse_literal_parser(tokenize(r'`foo`')).value, r'foo')
         self.assertEqual(parse_literal_parser(tokenize(r'`f\`oo`')).value, r'f`oo')
@@ -74,6 +90,12 @@ class TestParser(unittest.TestCase):
         self.assertIsInstance(parse_parser(tokenize(r'`foo` `bar`')), ast.Sequence)
         self.assertIsInstance(parse_parser(tokenize(r'`foo` as "bar"')), ast.As)
         self.assertIsInstance(parse_parser(tokenize(r'`foo` ! "Error!"')), ast.Error)
+        self.assertIsInstance(parse_parser(tokenize(r'`foo` ! "Error!" recover `;`')), ast.Error)
+
+    def test_parse_recovery(self):
+        self.assertIsNone(parse_suffix(tokenize(r'`foo` ! "Error!"')).recovery)
+        self.assertIsInstance(parse_suffix(tokenize(r'`foo` ! "Error!" recover `;`')).recovery, ast.LiteralParser)
+        self.assertIsInstance(parse_suffix(tokenize(r'`foo` ! "Error!" recover `;` `bar`')), ast.Sequence)
 
     def test_parse_peek(self):
         parse_peek(tokenize(r'peek { case `foo` => `bar` }'))
@@ -121,6 +143,170 @@ class TestParser(unittest.TestCase):
             export expression :: add
         '''))
 
+    def test_parse_skip(self):
+        skip = parse_skip(tokenize(r'skip r`#[^\n]*` `/*`'))
+        self.assertIsInstance(skip, ast.Skip)
+        self.assertEqual([type(pattern) for pattern in skip.patterns], [ast.RegexParser, ast.LiteralParser])
+        self.assertRaises(Exception, parse_skip, tokenize(r'skip'))
+        self.assertIsInstance(parse_file(tokenize(r'skip r`#[^\n]*` export x :: `x`')).stmts[0], ast.Skip)
+
+    def test_analysis(self):
+        tree = parse_file(tokenize(r'''
+            number :: r`[0-9]+`
+            export list :: [number: head] peek {
+                case `,` => `,` [list: tail] as struct List { head: head, tail: tail }
+                case _ => head
+            }
+            export statement :: peek {
+                case `(` `a` => `(` `a` `)`
+                case `(` list `)` => `(` list `)`
+                case _ => list
+                case `;` => `;`
+            }
+        '''))
+        set_additional_properties(tree)
+        analysis = analyze(tree)
+
+        self.assertEqual(analysis.first['list'], {'r`[0-9]+`'})
+        self.assertEqual(analysis.first['statement'], {'`(`', '`;`', 'r`[0-9]+`'})
+        self.assertEqual(analysis.follow['number'], {'$', '`,`', '`)`'})
+        self.assertEqual(analysis.follow['list'], {'$', '`)`'})
+        self.assertFalse(analysis.nullable['statement'])
+        self.assertEqual(analysis.speculation_depth['list'], 1)
+        self.assertEqual(analysis.speculation_depth['statement'], 2)
+        self.assertEqual(analysis.warnings, [
+            'statement, peek: cases after the default case 3 can never match.',
+            'statement, peek: case 2 calls a recursive rule, so testing it can read unbounded input '
+                'before failing.',
+            'statement, peek: cases 1 and 2 can both start with `(`, so telling them apart takes more '
+                'than one token of lookahead.',
+            'statement, peek: testing a case speculates 2 levels deep, so backtracking can be '
+                'exponential in the input.',
+        ])
+
+        # Guarded bodies count as deep as the rules they call.
+        tree = parse_file(tokenize('''
+            innermost :: peek {
+                case `x` `y` => `x` `y`
+                case _ => `x`
+            }
+            inner :: peek {
+                case innermost `z` => innermost `z`
+                case _ => `w`
+            }
+            export outer :: peek {
+                case `a` => `a` inner
+                case _ => `b`
+            }
+        '''))
+        set_additional_properties(tree)
+        analysis = analyze(tree)
+        self.assertEqual(analysis.speculation_depth['inner'], 2)
+        self.assertEqual(analysis.speculation_depth['outer'], 2)
+
+        # Rules reached by many paths are only expanded once.
+        layers = '\n'.join(f'layer{i} :: layer{i + 1} layer{i + 1}' for i in range(40))
+        tree = parse_file(tokenize(f'''
+            {layers}
+            layer40 :: `x`
+            export test :: peek {{
+                case layer0 => layer0
+                case _ => `y`
+            }}
+        '''))
+        set_additional_properties(tree)
+        self.assertEqual(analyze(tree).warnings, [])
+
+    def test_ir(self):
+        tree = parse_file(tokenize(r'''
+            number :: r`[0-9]+`
+            export list :: [number: head] ! "Expected a number" recover `;` peek {
+                case `,` => `,` [list: tail] as struct List { head: head, tail: tail }
+                case _ => head
+            }
+            debug(list)
+            skip r`#[^\n]*`
+        '''))
+        set_additional_properties(tree)
+
+        data = ir.dumps(tree)
+        self.assertTrue(ir.is_ir(data))
+        loaded = ir.loads(data)
+        self.assertEqual(ir.dumps(loaded), data)
+        self.assertEqual([type(node) for node in walk(loaded)], [type(node) for node in walk(tree)])
+        self.assertEqual(loaded.stmts[1].type, tree.stmts[1].type)
+        self.assertEqual(loaded.stmts[1].expr.storage_method, tree.stmts[1].expr.storage_method)
+
+        self.assertRaisesRegex(ir.IRError, 'Not a langlang IR file', ir.loads, b'number :: r`[0-9]+`')
+        self.assertRaisesRegex(ir.IRError, 'IR version 0 is not supported', ir.loads, ir.MAGIC + b'\0\0')
+        self.assertRaisesRegex(ir.IRError, 'Truncated', ir.loads, data[:-3])
+
+    def test_interned_types(self):
+        self.assertIs(types.Parser(types.String()), types.Parser(types.String()))
+        self.assertIs(types.Null(), types.Null())
+        self.assertIs(types.Struct({'a': types.String(), 'b': types.Null()}),
+                      types.Struct({'b': types.Null(), 'a': types.String()}))
+        self.assertIsNot(types.Struct({'a': types.String()}), types.Struct({'b': types.String()}))
+        self.assertNotEqual(types.Struct({'a': types.String()}), types.String())
+
+        struct = types.Struct({'a': types.Parser(...)})
+        self.assertEqual({struct: 1}[types.Struct({'a': types.Parser(...)})], 1)
+        self.assertIs(copy.deepcopy(struct), struct)
+        self.assertIs(pickle.loads(pickle.dumps(struct)), struct)
+        self.assertRaises(AttributeError, setattr, struct, 'fields', {})
+
+        # Types nothing refers to any more are forgotten.
+        key = (types.Struct, ('unused', types.String()))
+        unused = types.Struct({'unused': types.String()})
+        self.assertIn(key, types.interned)
+        del unused
+        gc.collect()
+        self.assertNotIn(key, types.interned)
+
+        tree = parse_file(tokenize('export test :: [`foo`: a] `bar` as struct Foo { a: a }'))
+        set_additional_properties(tree)
+        self.assertIs(tree.stmts[0].type, types.Parser(types.Struct({'a': types.String()})))
+        self.assertRaisesRegex(Exception, 'Undefined variable: b', set_additional_properties,
+            parse_file(tokenize('export test :: `foo` as struct Foo { a: b }')))
+
+    def test_scopes(self):
+        tree = parse_file(tokenize('''
+            export test :: [pair: p] as struct Test { p: p }
+            pair :: [number: a] `,` [number: b] as struct Pair { a: a, b: b }
+            number :: r`[0-9]+`
+            even :: `a` odd
+            odd :: `b` even
+        '''))
+        set_additional_properties(tree)
+
+        pair = types.Struct({'a': types.String(), 'b': types.String()})
+        self.assertIs(tree.stmts[0].type, types.Parser(types.Struct({'p': pair})))
+        self.assertIs(tree.stmts[1].type, types.Parser(pair))
+        # Mutually recursive rules don't know what they return.
+        self.assertIs(tree.stmts[3].type, types.Parser(...))
+        self.assertIs(tree.stmts[4].type, types.Parser(...))
+
+        # Names bound inside a rule aren't visible from other rules.
+        self.assertRaisesRegex(Exception, 'Undefined variable: x', set_additional_properties,
+            parse_file(tokenize('a :: [`a`: x] x\nb :: a as struct B { x: x }')))
+
+        # Local rules shadow imported ones.
+        tree = parse_file(tokenize('export test :: number\nnumber :: r`[0-9]+`'))
+        set_additional_properties(tree, {'number': types.Parser(types.Null())})
+        self.assertIs(tree.stmts[0].type, types.Parser(types.String()))
+
+    def test_recursive_rules(self):
+        tree = parse_file(tokenize('''
+            export test :: even value list
+            even :: `a` peek { case `b` => odd case _ => `c` }
+            odd :: `b` even
+            value :: number
+            number :: r`[0-9]+`
+            list :: peek { case `,` => `,` list case _ => `.` }
+        '''))
+        set_additional_properties(tree)
+        self.assertEqual(recursive_rules(tree), {'even', 'odd', 'list'})
+
     # def test_basic_def(self):
     #     parse(tokenize('export example :: `foo`'))
     #     parse(tokenize('export example :: r`foo`'))
@@ -1,16 +1,27 @@
 import json
 import os
+import socket
 import string
 import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
 from typing import Dict
 import unittest
 
-from langlang.langlang import compile_source
+from langlang.langlang import compile_source, compile_tree, load
+from langlang.modules import imported_files
+from langlang.parsing import ir
+from langlang.profiling import Profile
+from langlang.server import CompileServer
+from langlang.watcher import Watcher
 
 from jinja2 import Template
+from watchdog.events import FileModifiedEvent, FileMovedEvent
 
 FAILURE_OUTPUT_DIR = 'failed_tests'
-TEST_RUNTIME = '''
+TEST_RUNTIME = Template('''
 
 
 // ===============
@@ -27,7 +38,7 @@ process.stdin.on('readable', () => {
     }
     try {
         let start = process.hrtime();
-        let output = exports.test(input);
+        let output = ({{ parse_function or 'exports.' + entrypoint }})(input);
         let [s, ns] = process.hrtime(start);
         console.log(JSON.stringify({
             output: output || 'undefined',
@@ -39,7 +50,19 @@ process.stdin.on('readable', () => {
         console.error(e.message);
         process.exit(1);
     }
-});'''
+});''')
+
+
+def are_equal(value1, value2):
+    if type(value1) != type(value2):
+        return False
+
+    if isinstance(value1, list):
+        return all(are_equal(e1, e2) for e1, e2 in zip(value1, value2))
+    elif isinstance(value1, dict):
+        return all(are_equal(value1[k], v) for k, v in value2.items())
+    else:
+        return value1 == value2
 
 
 class TestBasicPrograms(unittest.TestCase):
@@ -48,12 +71,14 @@ class TestBasicPrograms(unittest.TestCase):
             source: str,
             tests: Dict[str, str],
             entrypoint='test',
-            max_time_ms=None):
-        parser = compile_source(source, None)
+            parse_function=None,
+            max_time_ms=None,
+            options={}):
+        parser = compile_source(source, None, **options)
         filepath = ''.join(c for c in name.lower() if c in string.ascii_letters) + '.js'
         
         with open(filepath, 'w') as f:
-            f.write(parser + TEST_RUNTIME)
+            f.write(parser + TEST_RUNTIME.render(entrypoint=entrypoint, parse_function=parse_function))
         
         failures = {}
         for input, expected in tests.items():
@@ -75,17 +100,6 @@ class TestBasicPrograms(unittest.TestCase):
                     self.assertEqual(stderr.decode().rstrip('\n'), str(expected))
                 else:
                     self.assertEqual(compiler.returncode, 0, 'Parser should have returned 0')
-                    def are_equal(value1, value2):
-                        if type(value1) != type(value2):
-                            return False
-
-                        if isinstance(value1, list):
-                            return all(are_equal(e1, e2) for e1, e2 in zip(value1, value2))
-                        elif isinstance(value1, dict):
-                            return all(are_equal(value1[k], v) for k, v in value2.items())
-                        else:
-                            return value1 == value2
-
                     if expected:
                         decoded_stdout = json.loads(stdout)['output']
                         self.assertTrue(are_equal(decoded_stdout, expected), f'{decoded_stdout} != {expected}')
@@ -171,6 +185,67 @@ class TestBasicPrograms(unittest.TestCase):
             }
         )
 
+    def test_skip(self):
+        self.run_parser(
+            'Skip',
+            r'''
+            skip r`#[^\n]*` r`/\*(?:[^*]|\*(?!/))*\*/`
+            number :: r`[0-9]+`
+            export test :: number `,` number
+            ''',
+            {
+                '1, 2': '2',
+                '# one\n1, # two\n 2 # end': '2',
+                '/* a, b */ 1 /* multi\nline */, 2': '2',
+                '\u00a01,\t\u30002\r\n': '2',
+                '1, # 2': Exception,
+                '1 /* , 2': Exception,
+            }
+        )
+
+    def test_whitespace_tokens(self):
+        # Whitespace is only skipped where no token starts with it.
+        self.run_parser(
+            'Whitespace tokens',
+            r'''
+            word :: r`[a-z]+`
+            export test :: [word: a] r`\n` [word: b] r`\t` as struct L { a: a, b: b }
+            ''',
+            {
+                'ab\ncd\t': {'a': 'ab', 'b': 'cd', '_type': 'L'},
+                ' ab \n cd \t ': {'a': 'ab', 'b': 'cd', '_type': 'L'},
+                'ab cd\t': Exception,
+                'ab\ncd': Exception,
+            }
+        )
+
+    def test_literal_letters(self):
+        self.run_parser(
+            'Literal letters',
+            '''
+            export test :: `class` `s`
+            ''',
+            {
+                'class s': 's',
+                'cla   s s': Exception,
+            }
+        )
+
+    def test_unreachable_rules(self):
+        # The unused rule's token would otherwise be lexed before the regex.
+        self.run_parser(
+            'Unreachable rules',
+            '''
+            unused :: `foo`
+            word :: r`[a-z]+`
+            export test :: word
+            ''',
+            {
+                'foo': 'foo',
+                'bar': 'bar',
+            }
+        )
+
     # def test_debug(self):
     #     self.run_parser(
     #         'Debug',
@@ -326,6 +401,530 @@ class TestBasicPrograms(unittest.TestCase):
             }
         )
 
+    def test_error_positions(self):
+        self.run_parser(
+            'Error Positions',
+            '''
+            export test :: `foo` `bar`
+            ''',
+            {
+                'foo\n  baz': Exception('Expected lit_bar, got __unknown at line 2, column 3'),
+                'foo\n': Exception('Unexpected end of file at line 2, column 1'),
+                'foo bar\n\n bar': Exception('Remaining tokens at line 3, column 2: bar'),
+            }
+        )
+
+    def test_furthest_failure(self):
+        # Errors also say how far the parser got, including while testing peek cases.
+        self.run_parser(
+            'Furthest failure',
+            '''
+            export test :: peek {
+                case `(` `a` => `(` `a` `)`
+                case `(` `b` => `(` `b` `)`
+            }
+            ''',
+            {
+                '( c )': {
+                    'message': 'Remaining tokens at line 1, column 1: (,c,)',
+                    'furthest': {'expected': ['lit_a', 'lit_b'], 'offset': 2, 'line': 1, 'column': 3},
+                },
+                '( a': {
+                    'message': 'Unexpected end of file at line 1, column 4',
+                    'furthest': {'expected': ['lit_)'], 'offset': 3, 'line': 1, 'column': 4},
+                },
+            },
+            parse_function='''(input) => {
+                try {
+                    exports.test(input);
+                }
+                catch (e) {
+                    return { message: e.message, furthest: e.furthest };
+                }
+            }'''
+        )
+
+    def test_rule_aliases(self):
+        # Without inlining, x holds what alias returns rather than a parser.
+        self.run_parser(
+            'Rule aliases',
+            '''
+            word :: r`[a-z]+`
+            alias :: word
+            export test :: [alias: x] `;` as x
+            ''',
+            {
+                'foo;': 'foo',
+            },
+            options={'optimization_level': 0}
+        )
+
+    def test_forward_references(self):
+        # Rules can call rules defined after them, including ones that call them back.
+        self.run_parser(
+            'Forward references',
+            '''
+            export test :: [item: first] `;` as first
+            item :: peek {
+                case `(` => `(` [list: l] `)` as l
+                case _ => number
+            }
+            list :: [item: head] peek {
+                case `,` => `,` [list: tail] as struct List { head: head, tail: tail }
+                case _ => head
+            }
+            number :: r`[0-9]+`
+            ''',
+            {
+                '1;': '1',
+                '(1, (2));': {'head': '1', 'tail': '2', '_type': 'List'},
+                '(1, 2;': Exception('Expected lit_), got lit_; at line 1, column 6'),
+            },
+            options={'optimization_level': 0}
+        )
+
+    def test_optimizations(self):
+        # Inlined rules and fused tokens have to fail in the same places as the rules they replace.
+        self.run_parser(
+            'Optimizations',
+            '''
+            number :: r`[0-9]+`
+            pair :: `(` number `,` number `)`
+            export test :: `let` `x` `=` [pair: p] `;` as p
+            ''',
+            {
+                'let x = (1, 2);': ')',
+                'let x = (1 2);': Exception('Expected lit_,, got [0-9]+ at line 1, column 12'),
+                'let y = (1, 2);': Exception('Expected lit_x, got __unknown at line 1, column 5'),
+                'let x = (1, 2)': Exception('Unexpected end of file at line 1, column 15'),
+            },
+            options={'optimization_level': 2}
+        )
+
+    def test_error_recovery(self):
+        self.run_parser(
+            'Error Recovery',
+            '''
+            stmt :: `let` [r`[a-z]+`: name] `;` as name
+            export test :: [stmt: first] ! "Bad first statement" recover `;`
+                           [stmt: second] ! "Bad second statement" recover `;`
+                           `.` as struct Program { first: first, second: second }
+            ''',
+            {
+                'let x; let y; .': {
+                    'result': {'_type': 'Program', 'first': 'x', 'second': 'y'},
+                    'errors': [],
+                },
+                'let x; let 1 ; .': {
+                    'result': {'_type': 'Program', 'first': 'x'},
+                    'errors': [{'message': 'Bad second statement', 'offset': 11, 'line': 1, 'column': 12}],
+                },
+                'let; let ; .': {
+                    'result': {'_type': 'Program'},
+                    'errors': [
+                        {'message': 'Bad first statement', 'offset': 3, 'line': 1, 'column': 4},
+                        {'message': 'Bad second statement', 'offset': 9, 'line': 1, 'column': 10},
+                    ],
+                },
+                'let x; let y;': {
+                    'result': None,
+                    'errors': [{'message': 'Unexpected end of file at line 1, column 14', 'offset': 13}],
+                },
+            },
+            entrypoint='test.recover'
+        )
+
+        self.run_parser(
+            'Error Recovery Disabled',
+            '''
+            stmt :: `let` [r`[a-z]+`: name] `;` as name
+            export test :: [stmt: first] ! "Bad statement" recover `;` `.`
+            ''',
+            {
+                'let x; .': '.',
+                'let 1; .': Exception('Bad statement'),
+            }
+        )
+
+    def test_recovery_rethrows(self):
+        # Only parse failures are recovered from. Anything else thrown inside a `!` block is a bug,
+        # and is passed through instead of skipped.
+        self.run_parser(
+            'Recovery rethrows',
+            '''
+            number :: r`[0-9]+`
+            export test :: [number: n] ! "Bad number" recover `;` `;` as n
+            ''',
+            {
+                '1;': Exception('Broken rule'),
+            },
+            parse_function='''(input) => {
+                Parser.prototype.number = function() {
+                    throw Error('Broken rule');
+                };
+                return exports.test.recover(input);
+            }''',
+            options={'optimization_level': 0}
+        )
+
+    def test_error_rethrows(self):
+        # A custom error message only replaces parse failures, not other exceptions.
+        self.run_parser(
+            'Error rethrows',
+            '''
+            number :: r`[0-9]+`
+            export test :: [number: n] ! "Bad number" `;` as n
+            ''',
+            {
+                '1;': Exception('Broken rule'),
+            },
+            parse_function='''(input) => {
+                Parser.prototype.number = function() {
+                    throw Error('Broken rule');
+                };
+                return exports.test(input);
+            }''',
+            options={'optimization_level': 0}
+        )
+
+    def test_struct_classes(self):
+        # Structs with the same name and fields share a class, whatever order the fields are in.
+        self.run_parser(
+            'Struct classes',
+            '''
+            number :: r`[0-9]+`
+            pair :: `(` [number: right] `,` [number: left] `)` as struct Pair { right: right, left: left }
+            export test :: [number: left] [pair: right] as struct Pair { left: left, right: right }
+            ''',
+            {
+                '1 (2, 3)': {
+                    'json': {'left': '1', 'right': {'left': '3', 'right': '2', '_type': 'Pair'}, '_type': 'Pair'},
+                    'type': 'Pair',
+                    'keys': ['left', 'right'],
+                    'same_class': True,
+                },
+            },
+            parse_function='''(input) => {
+                let result = exports.test(input);
+                return {
+                    json: JSON.parse(JSON.stringify(result)),
+                    type: result._type,
+                    keys: Object.keys(result).sort(),
+                    same_class: result.constructor === result.right.constructor,
+                };
+            }'''
+        )
+
+    def test_peek_scope(self):
+        # Names bound in a peek's tests and cases aren't seen after it, even if a test fails
+        # partway through.
+        self.run_parser(
+            'Peek scope',
+            '''
+            word :: r`[a-z]+`
+            export test :: [word: a] peek {
+                case [word: a] `!` => `!`
+                case _ => [word: a] as a
+            } [word: b] as struct R { a: a, b: b }
+            ''',
+            {
+                'foo bar baz': {'a': 'foo', 'b': 'baz', '_type': 'R'},
+            }
+        )
+
+    def test_keyword_struct_names(self):
+        self.run_parser(
+            'Keyword struct names',
+            '''
+            word :: r`[a-z]+`
+            export test :: [word: a] as struct new { default: a, new: a }
+            ''',
+            {
+                'x': {'default': 'x', 'new': 'x', '_type': 'new'},
+            }
+        )
+
+    def test_ignored_values(self):
+        # Rules, peeks and tokens whose values are thrown away are matched without building them.
+        self.run_parser(
+            'Ignored values',
+            '''
+            number :: r`[0-9]+`
+            tuple :: `(` number peek {
+                case `,` => `,` tuple
+                case _ => `)`
+            }
+            export test :: `let` tuple `=` [number: n] ! "Expected a number" recover `;` `;` as n
+            ''',
+            {
+                'let (1) = 3;': '3',
+                'let (1, (2) = 3;': '3',
+                'let (1 2) = 3;': Exception('Expected lit_), got [0-9]+ at line 1, column 8'),
+                'let (1) = x;': Exception('Expected a number'),
+            },
+            options={'optimization_level': 0}
+        )
+
+    def test_validate(self):
+        # Validators match exactly what the full parser does, without building anything.
+        self.run_parser(
+            'Validate',
+            '''
+            number :: r`[0-9]+`
+            pair :: `(` [number: left] `,` [number: right] `)` as struct Pair { left: left, right: right }
+            statement :: peek {
+                case `(` => pair
+                case `let` => `let` `x` `=` [number: n] as n
+                case _ => number
+            }
+            export test :: [statement: first] ! "Bad statement" recover `;` peek {
+                case `;` => `;` [test: rest] as struct Statements { first: first, rest: rest }
+                case _ => first
+            }
+            ''',
+            {
+                '(1, 2); let x = 3; 4': {'valid': True, 'error': None, 'matches': True},
+                '(1 2)': {
+                    'valid': False,
+                    'error': {'message': 'Bad statement', 'offset': 3, 'line': 1, 'column': 4},
+                    'matches': True,
+                },
+                'let x = 1; 2 3': {
+                    'valid': False,
+                    'error': {'message': 'Remaining tokens at line 1, column 14: 3', 'offset': 13},
+                    'matches': True,
+                },
+            },
+            parse_function='''(input) => {
+                let result = exports.test.validate(input);
+                let parsed = true;
+                try {
+                    exports.test(input);
+                }
+                catch (e) {
+                    parsed = false;
+                }
+                return Object.assign(result, { matches: result.valid === parsed });
+            }''',
+            options={'optimization_level': 2, 'validate': True}
+        )
+
+    def test_validators_only_when_called(self):
+        # Without `validate`, only rules whose values are thrown away get validators.
+        output = compile_source('''
+            number :: r`[0-9]+`
+            export test :: number `,` [number: n] as n
+            ''', None, optimization_level=0)
+        self.assertIn('__validate_number()', output)
+        self.assertNotIn('__validate_test()', output)
+        self.assertNotIn('.validate =', output)
+
+    def test_incremental_reparse(self):
+        # Input is a JSON edit [offset, deleted, inserted] applied to the original expression.
+        self.run_parser(
+            'Incremental Reparse',
+            '''
+            number :: r`[0-9]+`
+            mul :: [number: left] peek {
+                case `*` => `*` [mul: right] as struct Mul { left: left, right: right }
+                case _ => left
+            }
+            export test :: [mul: left] peek {
+                case `+` => `+` [test: right] as struct Add { left: left, right: right }
+                case _ => left
+            }
+            ''',
+            {
+                '[8, 1, "4"]': {
+                    'result': {'left': {'left': '1', 'right': '2'}, 'right': '4'},
+                    'matches_full_parse': True,
+                    'reused_left': True,
+                },
+                '[9, 0, " + 5"]': {
+                    'result': {'left': {'left': '1', 'right': '2'}, 'right': {'left': '3', 'right': '5'}},
+                    'matches_full_parse': True,
+                    'reused_left': True,
+                },
+                '[5, 0, "0"]': {
+                    'result': {'left': {'left': '1', 'right': '20'}, 'right': '3'},
+                    'matches_full_parse': True,
+                    'reused_left': False,
+                },
+                '[0, 0, "4 + "]': {
+                    'result': {'left': '4', 'right': {'left': {'left': '1', 'right': '2'}, 'right': '3'}},
+                    'matches_full_parse': True,
+                    'reused_left': False,
+                },
+                '[3, 6, ""]': {
+                    'error': 'Unexpected end of file at line 1, column 4',
+                },
+            },
+            parse_function='''(input) => {
+                let source = '1 * 2 + 3';
+                let [offset, deleted, inserted] = JSON.parse(input);
+                let edited = source.slice(0, offset) + inserted + source.slice(offset + deleted);
+
+                let previous = exports.test.incremental(source);
+                let next = exports.test.reparse(previous, { offset, deleted, inserted });
+                if (next.error) {
+                    return { error: next.error.message };
+                }
+                return {
+                    result: next.result,
+                    matches_full_parse: JSON.stringify(next.result) === JSON.stringify(exports.test(edited)),
+                    reused_left: next.result.left === previous.result.left,
+                };
+            }'''
+        )
+
+    def test_incremental_skip(self):
+        # Edits inside skipped text change which tokens there are.
+        self.run_parser(
+            'Incremental Skip',
+            r'''
+            skip r`#[^\n]*`
+            number :: r`[0-9]+`
+            export test :: [number: left] peek {
+                case `+` => `+` [test: right] as struct Add { left: left, right: right }
+                case _ => left
+            }
+            ''',
+            {
+                '[4, 1, ""]': {'result': {'left': '1', 'right': {'left': '2', 'right': '3'}}, 'matches_full_parse': True},
+                '[6, 0, "#"]': {'result': {'left': '1', 'right': '3'}, 'matches_full_parse': True},
+                '[0, 0, "# "]': {'result': '3', 'matches_full_parse': True},
+                '[9, 1, ""]': {'error': 'Unexpected end of file at line 1, column 11'},
+            },
+            parse_function='''(input) => {
+                let source = '1 + # 2 +\\n3';
+                let [offset, deleted, inserted] = JSON.parse(input);
+                let edited = source.slice(0, offset) + inserted + source.slice(offset + deleted);
+
+                let next = exports.test.reparse(exports.test.incremental(source), { offset, deleted, inserted });
+                if (next.error) {
+                    return { error: next.error.message };
+                }
+                return {
+                    result: next.result,
+                    matches_full_parse: JSON.stringify(next.result) === JSON.stringify(exports.test(edited)),
+                };
+            }'''
+        )
+
+    def test_incremental_edit_sequence(self):
+        # Input is a JSON list of edits, each applied to the result of the one before. Every step
+        # has to match a full parse of the same text, including where errors are reported.
+        self.run_parser(
+            'Incremental Edit Sequence',
+            r'''
+            skip r`#[^\n]*`
+            number :: r`[0-9]+`
+            export test :: [number: left] peek {
+                case `+` => `+` [test: right] as struct Add { left: left, right: right }
+                case _ => left
+            }
+            ''',
+            {
+                # Typing forwards, then going back to the start, then to the end.
+                '[[5, 0, "0"], [6, 0, "0"], [0, 0, "9 + "], [19, 0, " + 4"], [4, 1, "7"]]':
+                    {'text': '9 + 7 + 200 + # 3\n3 + 4\n+ 4', 'matches_full_parse': True},
+                # Breaking the input in one place and fixing it in another.
+                '[[14, 0, "+ "], [2, 0, "#"], [2, 1, ""], [16, 2, ""]]':
+                    {'text': '1 + 2 + # 3\n3\n+ 4', 'matches_full_parse': True},
+                '[[0, 12, ""], [2, 0, "# x\\n"], [0, 0, "5"]]':
+                    {'text': '53\n# x\n+ 4', 'matches_full_parse': True},
+                '[[0, 0, "7 + "], [20, 1, ""]]':
+                    {'text': '7 + 1 + 2 + # 3\n3\n+ ', 'matches_full_parse': True},
+            },
+            parse_function='''(input) => {
+                let text = '1 + 2 + # 3\\n3\\n+ 4';
+                let tree = exports.test.incremental(text);
+                let matches = true;
+                for (let [offset, deleted, inserted] of JSON.parse(input)) {
+                    text = text.slice(0, offset) + inserted + text.slice(offset + deleted);
+                    tree = exports.test.reparse(tree, { offset, deleted, inserted });
+                    let full = exports.test.incremental(text);
+                    matches = matches && JSON.stringify(tree.result) === JSON.stringify(full.result)
+                        && (tree.error && tree.error.message) === (full.error && full.error.message);
+                }
+                return { text: text, matches_full_parse: matches };
+            }'''
+        )
+
+    def test_instrumentation(self):
+        self.run_parser(
+            'Instrumentation',
+            '''
+            number :: r`[0-9]+`
+            export test :: [number: left] peek {
+                case `+` => `+` [test: right] as struct Add { left: left, right: right }
+                case _ => left
+            }
+            ''',
+            {
+                '1': {
+                    'number': {'calls': 1, 'exceptions': 0, 'tokens': 1},
+                    'test': {'calls': 1, 'speculations': 1, 'exceptions': 0, 'tokens': 1},
+                },
+                '1 + 2 + 3': {
+                    'number': {'calls': 3, 'exceptions': 0, 'tokens': 3},
+                    'test': {'calls': 3, 'speculations': 3, 'exceptions': 0, 'tokens': 9},
+                },
+                '1 + +': {
+                    'number': {'calls': 2, 'exceptions': 1, 'tokens': 1},
+                    'test': {'calls': 2, 'speculations': 1, 'exceptions': 2, 'tokens': 0},
+                },
+            },
+            parse_function='''(input) => {
+                exports.__stats.reset();
+                try {
+                    exports.test(input);
+                }
+                catch (e) {}
+                return exports.__stats();
+            }''',
+            options={'instrument': True, 'optimization_level': 0}
+        )
+
+    def test_sampling(self):
+        self.run_parser(
+            'Sampling',
+            '''
+            number :: r`[0-9]+`
+            export test :: [number: left] peek {
+                case `+` => `+` [test: right] as struct Add { left: left, right: right }
+                case _ => left
+            }
+            ''',
+            {
+                '1 + 2': 'test;number 1\ntest;peek 1\ntest 1\ntest;test;number 1\n',
+                '1 + 2 + 3': 'test;number 1\ntest;peek 1\ntest 1\ntest;test;number 1\n'
+                    'test;test;peek 1\ntest;test 1\ntest;test;test;number 1\n',
+            },
+            parse_function='''(input) => {
+                exports.__samples.reset();
+                exports.test(input);
+                return exports.__samples();
+            }''',
+            options={'sample_every': 1, 'optimization_level': 0}
+        )
+
+        self.run_parser(
+            'Sparse Sampling',
+            '''
+            export test :: `a` `b` `c` `d`
+            ''',
+            {
+                'a b c d': 'test 2\n',
+            },
+            parse_function='''(input) => {
+                exports.__samples.reset();
+                exports.test(input);
+                return exports.__samples();
+            }''',
+            options={'sample_every': 2, 'optimization_level': 0}
+        )
+
     # def test_template_parser(self):
     #     self.run_parser(
     #         'Template Parser',
@@ -372,5 +971,343 @@ class TestBasicPrograms(unittest.TestCase):
             max_time_ms=16
         )
 
+class TestPythonPrograms(TestBasicPrograms):
+    # Runs every program above through the Python target, in-process.
+    def run_parser(self,
+            name: str,
+            source: str,
+            tests: Dict[str, str],
+            entrypoint='test',
+            parse_function=None,
+            max_time_ms=None,
+            options={}):
+        if parse_function or options:
+            self.skipTest('Custom parse functions and options are JavaScript')
+
+        grammar = load(source)
+        parser = grammar
+        for attribute in entrypoint.split('.'):
+            parser = getattr(parser, attribute)
+
+        for input, expected in tests.items():
+            with self.subTest(input=input):
+                if expected == Exception:
+                    self.assertRaises(grammar.ParseError, parser, input)
+                elif isinstance(expected, Exception):
+                    with self.assertRaises(grammar.ParseError) as context:
+                        parser(input)
+                    self.assertEqual(str(context.exception), str(expected))
+                else:
+                    start = time.perf_counter()
+                    output = parser(input)
+                    actual_time_ms = (time.perf_counter() - start) * 1000
+
+                    if expected:
+                        self.assertTrue(are_equal(output, expected), f'{output} != {expected}')
+                    if max_time_ms:
+                        self.assertLess(actual_time_ms, max_time_ms)
+
+
+class TestBytecodePrograms(TestBasicPrograms):
+    # Runs every program above through the bytecode interpreter.
+    def run_parser(self, *args, options={}, **kwargs):
+        super().run_parser(*args, options={**options, 'bytecode': True}, **kwargs)
+
+
+class TestStandalone(unittest.TestCase):
+    GRAMMAR = '''
+    number :: r`[0-9]+`
+    export test :: [number: left] peek {
+        case `+` => `+` [test: right] as struct Add { left: left, right: right }
+        case _ => left
+    }
+    '''
+
+    def run_standalone(self, input: str, **options):
+        # Returns the exit code and output lines of the stand-alone parser.
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'parser.js')
+            with open(path, 'w') as f:
+                f.write(compile_source(self.GRAMMAR, 'test', **options))
+            output = subprocess.run(['node', path], input=input.encode(), capture_output=True)
+            return output.returncode, [json.loads(line) for line in output.stdout.decode().splitlines()]
+
+    def test_ndjson(self):
+        add = {'left': '1', 'right': '2', '_type': 'Add'}
+        self.assertEqual(self.run_standalone('1 + 2\r\n\n3\n', ndjson=True), (0, [{'result': add}, {'result': '3'}]))
+        self.assertEqual(self.run_standalone('1 +\n3', ndjson=True),
+            (1, [{'error': 'Unexpected end of file at line 1, column 4'}, {'result': '3'}]))
+        self.assertEqual(self.run_standalone('1 + 2;3;', ndjson=True, delimiter=';'),
+            (0, [{'result': add}, {'result': '3'}]))
+
+        # Batches can finish out of order, but results are written in input order.
+        records = [' + '.join(['1'] * (i % 50 + 1)) for i in range(20000)]
+        code, lines = self.run_standalone('\n'.join(records), ndjson=True, workers=3)
+        self.assertEqual(code, 0)
+        self.assertEqual(lines, self.run_standalone('\n'.join(records), ndjson=True)[1])
+        self.assertEqual(len(lines), len(records))
+
+
+class TestProfile(unittest.TestCase):
+    def test_profile(self):
+        profile = Profile()
+        output = compile_source('export test :: [`foo`: x] `bar` as x', profile=profile)
+
+        self.assertEqual([phase.name for phase in profile.phases],
+            ['tokenize', 'parse_file', 'imports', 'set_additional_properties', 'optimize', 'assemble'])
+        tokenize, parse_file, imports, types, optimize, assemble = profile.phases
+        self.assertEqual(tokenize.counters['tokens'], 11)
+        self.assertGreater(parse_file.counters['backtracks'], 0)
+        self.assertEqual(imports.counters, {'compiled': 0, 'reused': 0})
+        self.assertEqual(types.counters['ast_nodes'], 8)
+        self.assertIn('ast_nodes', optimize.counters)
+        self.assertEqual(assemble.counters['bytes'], len(output.encode()))
+        # Tracing allocations would slow the phases down, so memory isn't measured by default.
+        self.assertTrue(all(phase.peak_memory_bytes is None for phase in profile.phases))
+        self.assertIn('set_additional_properties', profile.report())
+        self.assertEqual(len(json.loads(profile.to_json())['phases']), 6)
+
+        profile = Profile(memory=True)
+        compile_source('export test :: [`foo`: x] `bar` as x', profile=profile)
+        self.assertTrue(all(phase.peak_memory_bytes > 0 for phase in profile.phases))
+        self.assertFalse(tracemalloc.is_tracing())
+
+
+class TestImports(unittest.TestCase):
+    def test_imports(self):
+        with tempfile.TemporaryDirectory() as directory:
+            def write(filename, source):
+                with open(os.path.join(directory, filename), 'w') as f:
+                    f.write(source)
+
+            def compile_main():
+                profile = Profile()
+                output = compile_source('import "lib/ops.ll"\nexport test :: [sum: s] `;` as s',
+                    profile=profile, path=os.path.join(directory, 'main.ll'), target='python')
+                return output, next(p for p in profile.phases if p.name == 'imports').counters
+
+            os.mkdir(os.path.join(directory, 'lib'))
+            write('lib/numbers.ll', 'export number :: r`[0-9]+`\nunused :: `zzz`')
+            write('lib/ops.ll', 'import "numbers.ll"\nsum :: [number: a] `+` [number: b] as b')
+
+            output, counters = compile_main()
+            self.assertEqual(counters, {'compiled': 2, 'reused': 0})
+            # Artifacts hold the typed tree as IR, which can be read without running any code.
+            with open(os.path.join(directory, 'lib', '__llcache__', 'numbers.ll.artifact'), 'rb') as f:
+                self.assertTrue(ir.is_ir(f.read().partition(b'\n')[2]))
+            # Imported rules aren't exported, and unused ones are dropped.
+            self.assertIn("__all__ = ['test']", output)
+            self.assertNotIn('zzz', output)
+
+            self.assertEqual(compile_main(), (output, {'compiled': 0, 'reused': 2}))
+
+            # Changing a module rebuilds everything that imports it.
+            write('lib/numbers.ll', 'export number :: r`[0-9a-f]+`')
+            output, counters = compile_main()
+            self.assertEqual(counters, {'compiled': 2, 'reused': 0})
+            self.assertIn('[0-9a-f]+', output)
+
+            write('lib/numbers.ll', 'import "ops.ll"')
+            self.assertRaisesRegex(Exception, 'Import cycle', compile_main)
+
+    def test_import_name_collisions(self):
+        # Calls in each module mean the rules that module could see, even once their names clash.
+        with tempfile.TemporaryDirectory() as directory:
+            def write(filename, source):
+                with open(os.path.join(directory, filename), 'w') as f:
+                    f.write(source)
+
+            write('a.ll', 'helper :: `a`\nexport x :: helper')
+            write('b.ll', 'helper :: `b`\nexport y :: helper `,`')
+            write('c.ll', 'import "a.ll"\nexport z :: helper x')
+
+            for optimization_level in (0, 1):
+                output = compile_source(
+                    'import "b.ll"\nimport "c.ll"\n'
+                    'helper :: `c`\n'
+                    'export test :: y z helper',
+                    path=os.path.join(directory, 'main.ll'), target='python',
+                    optimization_level=optimization_level)
+                namespace = {}
+                exec(output, namespace)
+                self.assertEqual(namespace['test']('b, a a c'), 'c')
+                self.assertRaises(Exception, namespace['test'], 'b, a a a')
+
+
+class TestLoad(unittest.TestCase):
+    def test_load(self):
+        source = '''
+        number :: r`[0-9]+`
+        export add :: [number: left] `+` [number: right] as struct Add { left: left, right: right }
+        export class :: `class`
+        '''
+        grammar = load(source)
+        self.assertIs(load(source), grammar)
+        self.assertEqual(grammar.add('1 + 2'), {'left': '1', 'right': '2', '_type': 'Add'})
+        self.assertEqual(grammar.class_('class'), 'class')
+        self.assertRaises(grammar.ParseError, grammar.add, '1 +')
+        self.assertRaises(AttributeError, getattr, grammar, 'number')
+
+
+class TestServer(unittest.TestCase):
+    def test_server(self):
+        with tempfile.TemporaryDirectory() as directory:
+            def write(filename, source):
+                with open(os.path.join(directory, filename), 'w') as f:
+                    f.write(source)
+
+            server = CompileServer(os.path.join(directory, 'socket'), compile_tree, cache_size=2)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self.addCleanup(server.server_close)
+            self.addCleanup(server.shutdown)
+
+            def connect():
+                client = socket.socket(socket.AF_UNIX)
+                client.connect(os.path.join(directory, 'socket'))
+                self.addCleanup(client.close)
+                return client, client.makefile('rb')
+
+            def request(connection, **request):
+                client, responses = connection
+                client.sendall(json.dumps(request).encode() + b'\n')
+                return json.loads(responses.readline())
+
+            write('numbers.ll', 'number :: r`[0-9]+`')
+            write('main.ll', 'import "numbers.ll"\nexport test :: [number: a] `+` [number: b] as b')
+            main = os.path.join(directory, 'main.ll')
+            connection = connect()
+
+            response = request(connection, id=1, command='compile', path=main, target='python')
+            self.assertEqual(response['id'], 1)
+            self.assertIn("__all__ = ['test']", response['output'])
+            self.assertEqual(request(connection, id=2, command='compile', path=main, target='python'),
+                response | {'id': 2})
+            self.assertEqual(request(connection, command='stats'), {'id': None,
+                'modules': {'entries': 2, 'hits': 2, 'misses': 2},
+                'outputs': {'entries': 1, 'hits': 1, 'misses': 1}})
+
+            # Sent source is used instead of the file, and both connections are served at once.
+            other = connect()
+            self.assertEqual(request(other, id=3, command='check', path=main, source='export test :: nope'),
+                {'id': 3, 'error': 'Undefined variable: nope'})
+            self.assertEqual(request(connection, id=4, command='check', path=main), {'id': 4, 'ok': True})
+
+            write('numbers.ll', 'number :: r`[0-9a-f]+`')
+            self.assertIn('[0-9a-f]+', request(other, command='compile', path=main, target='python')['output'])
+
+            response = request(connection, command='analyze', path=main)
+            self.assertEqual(response['warnings'], [])
+            self.assertIn('FIRST', response['report'])
+
+            self.assertEqual(request(connection, id=5, command='compile', path=main, target='cobol'),
+                {'id': 5, 'error': 'Unknown target: cobol'})
+            self.assertEqual(request(connection, id=6, command='explode'),
+                {'id': 6, 'error': 'Unknown command: explode'})
+            self.assertEqual(request(connection, id=7, command='check'),
+                {'id': 7, 'error': 'Requests need the "path" of a grammar'})
+
+
+class TestWatcher(unittest.TestCase):
+    def test_watcher(self):
+        with tempfile.TemporaryDirectory() as directory:
+            grammar = os.path.join(directory, 'main.ll')
+            outfile = os.path.join(directory, 'main.js')
+            compiled = []
+            release = threading.Event()
+
+            def compile(path):
+                compiled.append(path)
+                if len(compiled) == 2:
+                    release.wait(5)
+                if len(compiled) == 3:
+                    raise Exception('Bad grammar')
+                return outfile, str(len(compiled)).encode()
+
+            def wait_for(condition):
+                deadline = time.monotonic() + 5
+                while not condition():
+                    self.assertLess(time.monotonic(), deadline)
+                    time.sleep(0.01)
+
+            def output():
+                with open(outfile, 'rb') as f:
+                    return f.read()
+
+            watcher = Watcher([grammar, os.path.join(directory, 'other.ll')], compile, debounce=0.05)
+            watcher.start()
+            self.addCleanup(watcher.stop)
+
+            # A burst of events, including a temporary file renamed over the grammar, compiles once.
+            watcher.on_any_event(FileModifiedEvent(grammar))
+            watcher.on_any_event(FileMovedEvent(grammar + '.tmp', grammar))
+            watcher.on_any_event(FileModifiedEvent(os.path.join(directory, 'unwatched.ll')))
+            wait_for(lambda: os.path.exists(outfile))
+            time.sleep(0.1)
+            self.assertEqual(compiled, [grammar])
+            self.assertEqual(output(), b'1')
+
+            # Output from a compile that a newer change overtook is dropped, and errors are reported
+            # without stopping the watcher.
+            watcher.changed(grammar)
+            wait_for(lambda: len(compiled) == 2)
+            watcher.changed(grammar)
+            release.set()
+            wait_for(lambda: len(compiled) == 3)
+            time.sleep(0.1)
+            self.assertEqual(output(), b'1')
+
+    def test_watcher_imports(self):
+        with tempfile.TemporaryDirectory() as directory:
+            def write(filename, source):
+                with open(os.path.join(directory, filename), 'w') as f:
+                    f.write(source)
+
+            os.mkdir(os.path.join(directory, 'lib'))
+            write('main.ll', 'import "lib/ops.ll"\nexport test :: sum')
+            write('lib/ops.ll', 'import "numbers.ll"\nsum :: number `+` number')
+            write('lib/numbers.ll', 'number :: r`[0-9]+`')
+            grammar = os.path.join(directory, 'main.ll')
+            numbers = os.path.join(directory, 'lib', 'numbers.ll')
+            self.assertEqual(sorted(imported_files(grammar)),
+                [os.path.join(directory, 'lib', 'numbers.ll'), os.path.join(directory, 'lib', 'ops.ll')])
+
+            compiled = []
+            scheduled = []
+            # The first output can't be written, since its directory doesn't exist.
+            outfiles = [os.path.join(directory, 'missing', 'main.js'), os.path.join(directory, 'main.js')]
+
+            def compile(path):
+                compiled.append(path)
+                return outfiles[len(compiled) - 1], b'output'
+
+            def wait_for(condition):
+                deadline = time.monotonic() + 5
+                while not condition():
+                    self.assertLess(time.monotonic(), deadline)
+                    time.sleep(0.01)
+
+            watcher = Watcher([grammar], compile, debounce=0.01, imports=imported_files,
+                schedule=scheduled.append)
+            watcher.start()
+            self.addCleanup(watcher.stop)
+            self.assertEqual(scheduled, [directory, os.path.join(directory, 'lib')])
+
+            # Changing a file imported through another one recompiles the grammar, and a failed
+            # write doesn't stop the watcher.
+            watcher.on_any_event(FileModifiedEvent(numbers))
+            wait_for(lambda: len(compiled) == 1)
+            watcher.on_any_event(FileModifiedEvent(numbers))
+            wait_for(lambda: os.path.exists(outfiles[1]))
+            self.assertEqual(compiled, [grammar, grammar])
+
+            # Dropping the import stops watching the file.
+            write('main.ll', 'export test :: `x`')
+            watcher.changed(grammar)
+            wait_for(lambda: len(compiled) == 3)
+            watcher.on_any_event(FileModifiedEvent(numbers))
+            time.sleep(0.1)
+            self.assertEqual(len(compiled), 3)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file